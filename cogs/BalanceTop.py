@@ -1,7 +1,8 @@
 import disnake
 from disnake.ext import commands
 import logging
-from utils.database import get_user_balance, transfer_to_bank, transfer_from_bank, ensure_user_exists, get_user_position, get_top_users, get_total_balance
+from utils.database import get_user_balance, transfer_to_bank, transfer_from_bank, ensure_user_exists, get_user_position, get_top_users, get_total_balance, count_users
+from utils.members import resolve_display_names, UNKNOWN_USER_NAME
 from config import currency, BALANCE_BOT_ERROR, BALANCE_ERROR, LEADERBOARD_NOTICE, LEADERBOARD_NO_USERS, LEADERBOARD_ERROR, DEPOSIT_INVALID_AMOUNT, DEPOSIT_INSUFFICIENT, DEPOSIT_ZERO_AMOUNT, DEPOSIT_ERROR, WITHDRAW_INVALID_AMOUNT, WITHDRAW_INSUFFICIENT, WITHDRAW_ZERO_AMOUNT, WITHDRAW_ERROR
 
 # Настройка логирования
@@ -18,10 +19,10 @@ def get_ordinal_suffix(position: int) -> str:
 
 class LeaderboardView(disnake.ui.View):
     """Класс для интерактивных кнопок пагинации в leaderboard."""
-    def __init__(self, author_id: int, users: list, sort_field: str, display_field: str, guild_name: str, total_balance: int, guild_id: int, items_per_page: int = 10):
+    def __init__(self, author_id: int, total_users: int, sort_field: str, display_field: str, guild_name: str, total_balance: int, guild_id: int, items_per_page: int = 10):
         super().__init__(timeout=60.0)
         self.author_id = author_id
-        self.users = users
+        self.total_users = total_users
         self.sort_field = sort_field
         self.display_field = display_field
         self.guild_name = guild_name
@@ -29,7 +30,7 @@ class LeaderboardView(disnake.ui.View):
         self.guild_id = guild_id
         self.items_per_page = items_per_page
         self.current_page = 0
-        self.total_pages = (len(users) + items_per_page - 1) // items_per_page
+        self.total_pages = (total_users + items_per_page - 1) // items_per_page
         self.update_buttons()
 
     def update_buttons(self):
@@ -47,15 +48,17 @@ class LeaderboardView(disnake.ui.View):
             color=0x2F3136
         )
         start_idx = self.current_page * self.items_per_page
-        end_idx = start_idx + self.items_per_page
-        page_users = self.users[start_idx:end_idx]
+        # Из БД берётся только текущая страница
+        page_users = await get_top_users(self.guild_id, self.sort_field, limit=self.items_per_page, offset=start_idx)
+        # Имена всей страницы одним пакетом: кэш участников → gateway → TTL-кэш
+        guild = self.bot.get_guild(self.guild_id)
+        if guild is not None:
+            names = await resolve_display_names(self.bot, guild, [row[0] for row in page_users])
+        else:
+            names = {}
 
         for i, (user_id, cash, bank) in enumerate(page_users, start_idx + 1):
-            try:
-                user = await self.bot.fetch_user(user_id)
-                display_name = user.display_name if user else "Неизвестный пользователь"
-            except disnake.NotFound:
-                display_name = "Неизвестный пользователь"
+            display_name = names.get(user_id, UNKNOWN_USER_NAME)
             total = cash + bank
             value = cash if self.sort_field == "cash" else bank if self.sort_field == "bank" else total
             embed.add_field(
@@ -309,9 +312,9 @@ class EconomyCog(commands.Cog):
             sort_field = "total"
             display_field = "Total"
         try:
-            top_users = await get_top_users(guild_id, sort_field)
+            total_users = await count_users(guild_id)
             total_balance = await get_total_balance(guild_id)
-            if not top_users:
+            if not total_users:
                 embed = disnake.Embed(
                     title="Ошибка",
                     description=LEADERBOARD_NO_USERS,
@@ -321,7 +324,7 @@ class EconomyCog(commands.Cog):
                 return
             view = LeaderboardView(
                 author_id=ctx.author.id,
-                users=top_users,
+                total_users=total_users,
                 sort_field=sort_field,
                 display_field=display_field,
                 guild_name=ctx.guild.name,
@@ -2,56 +2,18 @@ import disnake
 from disnake.ext import commands
 import random
 import logging
-import configparser
-import os
-from utils.database import get_user_balance, update_cash, save_active_game, get_active_game, delete_active_game, log_game_history
+from utils import settings
+from utils.cards import Shoe, CARD_NAMES, WIN_PAYOUT, BLACKJACK_PAYOUT, score_hand, play_dealer
+from utils.database import get_user_balance, update_cash, adjust_balance, unit_of_work, save_active_game, get_active_game, get_active_game_by_id, delete_active_game, log_game_history
 from config import currency, CARD_EMOJIS, BLACKJACK_SUCCESS_MESSAGES, BLACKJACK_FAIL_MESSAGES, BLACKJACK_PUSH_MESSAGES, BLACKJACK_ERROR_MESSAGES
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Чтение конфигурации из games.ini
-config = configparser.ConfigParser()
-config_file = "games.ini"
-
-if not os.path.exists(config_file):
-    logger.error(f"Файл конфигурации {config_file} не найден.")
-    raise FileNotFoundError(f"Файл конфигурации {config_file} не найден.")
-
-try:
-    config.read(config_file, encoding='utf-8')
-    logger.info(f"Файл конфигурации {config_file} успешно прочитан")
-except Exception as e:
-    logger.error(f"Ошибка чтения games.ini: {e}")
-    raise
-
 def get_blackjack_config():
-    """Получение настроек блэкджека из games.ini."""
-    logger.info("Загрузка конфигурации блэкджека")
-    try:
-        section = config["Blackjack"]
-        min_bet = int(section.get("min_bet", 10))
-        decks = int(section.get("decks", 1))
-        if min_bet < 1:
-            raise ValueError("min_bet должен быть >= 1")
-        if decks < 1:
-            raise ValueError("decks должен быть >= 1")
-        logger.info(f"Конфигурация блэкджека загружена: min_bet={min_bet}, decks={decks}")
-        return {
-            "min_bet": min_bet,
-            "decks": decks,
-            "success_messages": BLACKJACK_SUCCESS_MESSAGES,
-            "fail_messages": BLACKJACK_FAIL_MESSAGES,
-            "push_messages": BLACKJACK_PUSH_MESSAGES,
-            "error_messages": BLACKJACK_ERROR_MESSAGES
-        }
-    except KeyError as e:
-        logger.error(f"Неверная секция конфигурации для блэкджека: {e}")
-        raise ValueError(f"Неверная секция конфигурации для блэкджека")
-    except Exception as e:
-        logger.error(f"Ошибка разбора конфигурации блэкджека: {e}")
-        raise ValueError(f"Ошибка разбора конфигурации блэкджека")
+    """Настройки блэкджека из общего реестра (utils.settings)."""
+    return settings.blackjack()
 
 def create_game_embed(user, player_hand, player_score, dealer_hand, dealer_score, deck_count, decks, is_soft=False):
     """Создание эмбеда для текущего состояния игры."""
@@ -197,7 +159,7 @@ class BlackjackView(disnake.ui.View):
             await interaction.response.send_message("Это не ваша игра!", ephemeral=True)
             return False
         # Проверка, активна ли игра
-        game = await get_active_game(interaction.user.id)
+        game = await get_active_game(interaction.user.id, interaction.guild.id)
         if not game or game["game_id"] != self.game_id or game["message_id"] != interaction.message.id:
             await interaction.response.send_message("Игра уже завершена или не найдена.", ephemeral=True)
             self.disable_buttons()
@@ -208,7 +170,7 @@ class BlackjackView(disnake.ui.View):
     async def on_timeout(self):
         """Автоматический stand при таймауте с эмбедом как при ручном stand."""
         logger.debug(f"Таймаут для game_id={self.game_id}, user_id={self.user_id}")
-        game = await get_active_game(self.user_id)
+        game = await get_active_game_by_id(self.game_id)
         if not game or game["game_id"] != self.game_id or not game["message_id"]:
             logger.warning(f"Игра не найдена или уже завершена при таймауте: game_id={self.game_id}")
             await delete_active_game(self.game_id)
@@ -237,6 +199,7 @@ class BlackjackView(disnake.ui.View):
                     self.user = user  # Используем полноценный disnake.Member или disnake.User
                     self.message = message
                     self.channel = channel
+                    self.guild = message.guild
                     self.response = self
                     self.data = {"custom_id": str(game["game_id"])}
 
@@ -272,73 +235,77 @@ class BlackjackView(disnake.ui.View):
                         return
 
                     # Используем стандартный эмбед для stand
-                    dealer_score, _ = self.cog.calculate_score(game["dealer_hand"], is_dealer=True)
-                    while dealer_score < 17:
-                        game["dealer_hand"].append(game["deck"].pop())
-                        dealer_score, _ = self.cog.calculate_score(game["dealer_hand"], is_dealer=True)
-                    player_score, _ = self.cog.calculate_score(game["player_hand"])
-                    cash, _ = await get_user_balance(self.user_id, game["guild_id"])
-                    self.disable_buttons()
-
-                    if dealer_score > 21 or player_score > dealer_score:
-                        winnings = game["bet"] * 2
-                        is_blackjack = len(game["player_hand"]) == 2 and player_score == 21
-                        if is_blackjack:
-                            winnings = int(game["bet"] * 2.5)
-                        await update_cash(self.user_id, game["guild_id"], winnings)
-                        cash, _ = await get_user_balance(self.user_id, game["guild_id"])
-                        embed = create_win_embed(
-                            user=user,
-                            winnings=winnings,
-                            bet=game["bet"],
-                            player_hand=self.cog.format_hand(game["player_hand"]),
-                            player_score=player_score,
-                            dealer_hand=self.cog.format_hand(game["dealer_hand"]),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            is_blackjack=is_blackjack
-                        )
-                        result = "player" if not is_blackjack else "blackjack"
-                    elif player_score == dealer_score:
-                        await update_cash(self.user_id, game["guild_id"], game["bet"])
-                        cash, _ = await get_user_balance(self.user_id, game["guild_id"])
-                        embed = create_push_embed(
-                            user=user,
-                            bet=game["bet"],
-                            player_hand=self.cog.format_hand(game["player_hand"]),
-                            player_score=player_score,
-                            dealer_hand=self.cog.format_hand(game["dealer_hand"]),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            is_blackjack=(player_score == 21 and dealer_score == 21)
-                        )
-                        result = "push"
-                    else:
-                        embed = create_loss_embed(
-                            user=user,
-                            bet=game["bet"],
-                            player_hand=self.cog.format_hand(game["player_hand"]),
-                            player_score=player_score,
-                            dealer_hand=self.cog.format_hand(game["dealer_hand"]),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            dealer_blackjack=(dealer_score == 21 and len(game["dealer_hand"]) == 2)
-                        )
-                        result = "dealer"
-
+                    async with unit_of_work():
+                        # Выплату получает только первое из параллельных завершений игры
+                        live = await delete_active_game(self.game_id)
+                        if live:
+                            dealer_score = play_dealer(game["dealer_hand"], game["deck"])
+                            player_score, _ = self.cog.calculate_score(game["player_hand"])
+                            cash, _ = await get_user_balance(self.user_id, game["guild_id"])
+                            self.disable_buttons()
+
+                            if dealer_score > 21 or player_score > dealer_score:
+                                winnings = game["bet"] * WIN_PAYOUT
+                                is_blackjack = len(game["player_hand"]) == 2 and player_score == 21
+                                if is_blackjack:
+                                    winnings = int(game["bet"] * BLACKJACK_PAYOUT)
+                                await update_cash(self.user_id, game["guild_id"], winnings)
+                                cash, _ = await get_user_balance(self.user_id, game["guild_id"])
+                                embed = create_win_embed(
+                                    user=user,
+                                    winnings=winnings,
+                                    bet=game["bet"],
+                                    player_hand=self.cog.format_hand(game["player_hand"]),
+                                    player_score=player_score,
+                                    dealer_hand=self.cog.format_hand(game["dealer_hand"]),
+                                    dealer_score=dealer_score,
+                                    balance=cash,
+                                    is_blackjack=is_blackjack
+                                )
+                                result = "player" if not is_blackjack else "blackjack"
+                            elif player_score == dealer_score:
+                                await update_cash(self.user_id, game["guild_id"], game["bet"])
+                                cash, _ = await get_user_balance(self.user_id, game["guild_id"])
+                                embed = create_push_embed(
+                                    user=user,
+                                    bet=game["bet"],
+                                    player_hand=self.cog.format_hand(game["player_hand"]),
+                                    player_score=player_score,
+                                    dealer_hand=self.cog.format_hand(game["dealer_hand"]),
+                                    dealer_score=dealer_score,
+                                    balance=cash,
+                                    is_blackjack=(player_score == 21 and dealer_score == 21)
+                                )
+                                result = "push"
+                            else:
+                                embed = create_loss_embed(
+                                    user=user,
+                                    bet=game["bet"],
+                                    player_hand=self.cog.format_hand(game["player_hand"]),
+                                    player_score=player_score,
+                                    dealer_hand=self.cog.format_hand(game["dealer_hand"]),
+                                    dealer_score=dealer_score,
+                                    balance=cash,
+                                    dealer_blackjack=(dealer_score == 21 and len(game["dealer_hand"]) == 2)
+                                )
+                                result = "dealer"
+
+                            await log_game_history(
+                                game_id=self.game_id,
+                                user_id=self.user_id,
+                                guild_id=game["guild_id"],
+                                bet=game["bet"],
+                                result=result,
+                                player_hand=game["player_hand"],
+                                player_score=player_score,
+                                dealer_hand=game["dealer_hand"],
+                                dealer_score=dealer_score
+                            )
+                    if not live:
+                        logger.warning(f"Игра {self.game_id} уже завершена до резервного завершения")
+                        return
                     await game_message.edit(embed=embed, view=self)
                     logger.debug(f"Резервный эмбед stand отправлен для game_id={self.game_id}")
-                    await log_game_history(
-                        game_id=self.game_id,
-                        user_id=self.user_id,
-                        guild_id=game["guild_id"],
-                        bet=game["bet"],
-                        result=result,
-                        player_hand=game["player_hand"],
-                        player_score=player_score,
-                        dealer_hand=game["dealer_hand"],
-                        dealer_score=dealer_score
-                    )
             except Exception as e:
                 logger.error(f"Ошибка резервного завершения игры для game_id={self.game_id}: {e}")
             finally:
@@ -363,62 +330,23 @@ class BlackjackView(disnake.ui.View):
 class BlackjackCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.suits = ['♠', '♥', '♦', '♣']
-        self.ranks = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
         self.card_emojis = CARD_EMOJIS
         logger.info("Инициализирован BlackjackCog")
 
     def init_deck(self, decks: int):
-        """Инициализация колоды из указанного количества колод."""
+        """Инициализация колоды из указанного количества колод (карты — коды utils.cards)."""
         try:
-            deck = [f"{rank}{suit}" for suit in self.suits for rank in self.ranks] * decks
-            random.shuffle(deck)
-            logger.debug(f"Инициализирована колода с {len(deck)} картами ({decks} колод)")
+            deck = Shoe(decks)
+            logger.debug(f"Инициализирована колода с {len(deck)} картами ({decks} колод), seed={deck.seed}")
             return deck
         except Exception as e:
             logger.error(f"Ошибка в init_deck({decks}): {e}")
             raise
 
     def calculate_score(self, hand, is_dealer=False):
-        """Подсчет очков руки, учет туза и soft рук."""
+        """Подсчет очков руки, учет туза и soft рук (таблицы utils.cards)."""
         try:
-            score = 0
-            aces = 0
-            for card in hand:
-                rank = card[:-1]
-                if rank in ['J', 'Q', 'K']:
-                    score += 10
-                elif rank == 'A':
-                    aces += 1
-                else:
-                    score += int(rank)
-            
-            for _ in range(aces):
-                if score + 11 <= 21:
-                    score += 11
-                else:
-                    score += 1
-            
-            if is_dealer and aces > 0 and score == 17:
-                for card in hand:
-                    if card[:-1] == '6':
-                        score = 7
-                        for c in hand:
-                            rank = c[:-1]
-                            if rank in ['J', 'Q', 'K']:
-                                score += 10
-                            elif rank == 'A':
-                                score += 1
-                            elif rank != '6':
-                                score += int(rank)
-                        break
-            
-            is_soft = False
-            if aces > 0 and score > 11 and score <= 21:
-                temp_score = score - 10
-                if temp_score + 11 == score:
-                    is_soft = True
-            
+            score, is_soft = score_hand(hand, is_dealer)
             logger.debug(f"Рассчитан счёт: hand={hand}, score={score}, is_soft={is_soft}, is_dealer={is_dealer}")
             return score, is_soft
         except Exception as e:
@@ -429,16 +357,16 @@ class BlackjackCog(commands.Cog):
         """Форматирование руки в строку с эмодзи."""
         try:
             if hide_first and len(hand) > 0:
-                formatted = f"{' '.join(self.card_emojis[card] for card in hand[1:])} {self.card_emojis['back']} "
+                formatted = f"{' '.join(self.card_emojis[CARD_NAMES[card]] for card in hand[1:])} {self.card_emojis['back']} "
             else:
-                formatted = ' '.join(self.card_emojis[card] for card in hand)
+                formatted = ' '.join(self.card_emojis[CARD_NAMES[card]] for card in hand)
             logger.debug(f"Форматирована рука: hand={hand}, hide_first={hide_first}, result={formatted}")
             return formatted
         except Exception as e:
             logger.error(f"Ошибка в format_hand(hand={hand}, hide_first={hide_first}): {e}")
             raise
 
-    async def validate_bet(self, user_id: int, guild_id: int, bet: str, config: dict) -> tuple:
+    async def validate_bet(self, user_id: int, guild_id: int, bet: str, config: settings.BlackjackSettings) -> tuple:
         """Валидация ставки."""
         logger.debug(f"Валидация ставки: user_id={user_id}, guild_id={guild_id}, bet={bet}")
         try:
@@ -457,8 +385,8 @@ class BlackjackCog(commands.Cog):
                 if amount > cash:
                     logger.debug(f"Недостаточно средств: bet={amount}, cash={cash}")
                     return None, "insufficient_cash"
-            if amount < config["min_bet"]:
-                logger.debug(f"Ставка ниже минимальной: bet={amount}, min_bet={config['min_bet']}")
+            if amount < config.min_bet:
+                logger.debug(f"Ставка ниже минимальной: bet={amount}, min_bet={config.min_bet}")
                 return None, "min_bet"
             logger.debug(f"Ставка проверена: amount={amount}")
             return amount, None
@@ -486,7 +414,7 @@ class BlackjackCog(commands.Cog):
         logger.info(f"Обработка действия: user={interaction.user.id}, action={action}, message_id={interaction.message.id}, interaction_data={interaction.data}")
         try:
             # Проверка активной игры
-            game = await get_active_game(interaction.user.id)
+            game = await get_active_game(interaction.user.id, interaction.guild.id)
             if not game or game["message_id"] != interaction.message.id:
                 logger.warning(f"Игра не найдена или message_id не совпадает: user={interaction.user.id}, game_message_id={game.get('message_id') if game else None}, interaction_message_id={interaction.message.id}")
                 await interaction.response.send_message("Игра не найдена или завершена.", delete_after=5.0)
@@ -507,7 +435,7 @@ class BlackjackCog(commands.Cog):
 
             # Проверка наличия карт в колоде
             if deck_count < 10:
-                deck = self.init_deck(config["decks"])
+                deck = self.init_deck(config.decks)
                 deck_count = len(deck)
                 logger.debug(f"Переинициализирована колода для game_id={game_id}: {deck_count} карт")
 
@@ -519,56 +447,65 @@ class BlackjackCog(commands.Cog):
                 player_score, is_soft = self.calculate_score(player_hand)
                 dealer_score, _ = self.calculate_score(dealer_hand[1:], is_dealer=True)
                 logger.debug(f"Hit: player_hand={player_hand}, player_score={player_score}, is_soft={is_soft}, dealer_score={dealer_score}")
-                await save_active_game(
-                    game_id=game_id,
-                    user_id=interaction.user.id,
-                    guild_id=guild_id,
-                    channel_id=game["channel_id"],
-                    message_id=game["message_id"],
-                    player_hand=player_hand,
-                    dealer_hand=dealer_hand,
-                    bet=bet,
-                    deck=deck
-                )
-                embed = create_game_embed(
-                    user=interaction.user,
-                    player_hand=self.format_hand(player_hand),
-                    player_score=player_score,
-                    dealer_hand=self.format_hand(dealer_hand, hide_first=True),
-                    dealer_score=dealer_score,
-                    deck_count=deck_count,
-                    decks=config["decks"],
-                    is_soft=is_soft
-                )
-                if player_score > 21:
-                    dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                    logger.debug(f"Перебор: player_score={player_score}, dealer_score={dealer_score}, cash={cash}")
-                    embed = create_loss_embed(
-                        user=interaction.user,
-                        bet=bet,
-                        player_hand=self.format_hand(player_hand),
-                        player_score=player_score,
-                        dealer_hand=self.format_hand(dealer_hand),
-                        dealer_score=dealer_score,
-                        balance=cash,
-                        dealer_blackjack=False
-                    )
-                    logger.info(f"Создание эмбеда проигрыша: bet={bet}")
-                    await log_game_history(
-                        game_id=game_id,
-                        user_id=interaction.user.id,
-                        guild_id=guild_id,
-                        bet=bet,
-                        result="dealer",
-                        player_hand=player_hand,
-                        player_score=player_score,
-                        dealer_hand=dealer_hand,
-                        dealer_score=dealer_score
-                    )
-                    await delete_active_game(game_id)
-                    logger.info(f"Игра {game_id} завершена: игрок перебрал")
-                    view.disable_buttons()
+                async with unit_of_work():
+                    if player_score > 21:
+                        # Перебор завершает игру, только если её не завершили параллельно
+                        live = await delete_active_game(game_id)
+                        if live:
+                            dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
+                            cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                            logger.debug(f"Перебор: player_score={player_score}, dealer_score={dealer_score}, cash={cash}")
+                            embed = create_loss_embed(
+                                user=interaction.user,
+                                bet=bet,
+                                player_hand=self.format_hand(player_hand),
+                                player_score=player_score,
+                                dealer_hand=self.format_hand(dealer_hand),
+                                dealer_score=dealer_score,
+                                balance=cash,
+                                dealer_blackjack=False
+                            )
+                            logger.info(f"Создание эмбеда проигрыша: bet={bet}")
+                            await log_game_history(
+                                game_id=game_id,
+                                user_id=interaction.user.id,
+                                guild_id=guild_id,
+                                bet=bet,
+                                result="dealer",
+                                player_hand=player_hand,
+                                player_score=player_score,
+                                dealer_hand=dealer_hand,
+                                dealer_score=dealer_score
+                            )
+                            logger.info(f"Игра {game_id} завершена: игрок перебрал")
+                            view.disable_buttons()
+                    else:
+                        # 0 — игру уже завершили параллельно (stand, double down, таймаут)
+                        live = bool(await save_active_game(
+                            game_id=game_id,
+                            user_id=interaction.user.id,
+                            guild_id=guild_id,
+                            channel_id=game["channel_id"],
+                            message_id=game["message_id"],
+                            player_hand=player_hand,
+                            dealer_hand=dealer_hand,
+                            bet=bet,
+                            deck=deck
+                        ))
+                        embed = create_game_embed(
+                            user=interaction.user,
+                            player_hand=self.format_hand(player_hand),
+                            player_score=player_score,
+                            dealer_hand=self.format_hand(dealer_hand, hide_first=True),
+                            dealer_score=dealer_score,
+                            deck_count=deck_count,
+                            decks=deck.decks,
+                            is_soft=is_soft
+                        )
+                if not live:
+                    logger.warning(f"Игра {game_id} уже завершена, действие {action} пропущено")
+                    await interaction.response.send_message("Игра уже завершена.", delete_after=5.0)
+                    return
                 try:
                     await interaction.response.edit_message(embed=embed, view=view)
                     logger.debug(f"Эмбед успешно обновлен для действия hit, game_id={game_id}")
@@ -577,78 +514,82 @@ class BlackjackCog(commands.Cog):
                     await interaction.response.send_message("Ошибка обновления игры. Пожалуйста, проверьте игру.", delete_after=5.0)
 
             elif action == "stand":
-                dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                while dealer_score < 17:
-                    dealer_hand.append(deck.pop())
-                    dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                    logger.debug(f"Дилер взял карту: dealer_hand={dealer_hand}, dealer_score={dealer_score}")
-                player_score, is_soft = self.calculate_score(player_hand)
-                cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                logger.debug(f"Stand: player_score={player_score}, dealer_score={dealer_score}, cash={cash}")
-
-                view.disable_buttons()  # Отключаем кнопки до обновления эмбеда
-                if dealer_score > 21 or player_score > dealer_score:
-                    winnings = bet * 2
-                    is_blackjack = len(player_hand) == 2 and player_score == 21
-                    if is_blackjack:
-                        winnings = int(bet * 2.5)
-                    await update_cash(interaction.user.id, guild_id, winnings)
-                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                    embed = create_win_embed(
-                        user=interaction.user,
-                        winnings=winnings,
-                        bet=bet,
-                        player_hand=self.format_hand(player_hand),
-                        player_score=player_score,
-                        dealer_hand=self.format_hand(dealer_hand),
-                        dealer_score=dealer_score,
-                        balance=cash,
-                        is_blackjack=is_blackjack
-                    )
-                    logger.info(f"Создание эмбеда победы: winnings={winnings}, bet={bet}, is_blackjack={is_blackjack}")
-                    result = "player" if not is_blackjack else "blackjack"
-                elif player_score == dealer_score:
-                    await update_cash(interaction.user.id, guild_id, bet)
-                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                    embed = create_push_embed(
-                        user=interaction.user,
-                        bet=bet,
-                        player_hand=self.format_hand(player_hand),
-                        player_score=player_score,
-                        dealer_hand=self.format_hand(dealer_hand),
-                        dealer_score=dealer_score,
-                        balance=cash,
-                        is_blackjack=(player_score == 21 and dealer_score == 21)
-                    )
-                    logger.info(f"Создание эмбеда ничьей: bet={bet}")
-                    result = "push"
-                else:
-                    embed = create_loss_embed(
-                        user=interaction.user,
-                        bet=bet,
-                        player_hand=self.format_hand(player_hand),
-                        player_score=player_score,
-                        dealer_hand=self.format_hand(dealer_hand),
-                        dealer_score=dealer_score,
-                        balance=cash,
-                        dealer_blackjack=(dealer_score == 21 and len(dealer_hand) == 2)
-                    )
-                    logger.info(f"Создание эмбеда проигрыша: bet={bet}")
-                    result = "dealer"
-
-                await log_game_history(
-                    game_id=game_id,
-                    user_id=interaction.user.id,
-                    guild_id=guild_id,
-                    bet=bet,
-                    result=result,
-                    player_hand=player_hand,
-                    player_score=player_score,
-                    dealer_hand=dealer_hand,
-                    dealer_score=dealer_score
-                )
-                await delete_active_game(game_id)
-                logger.info(f"Игра {game_id} завершена: result={result}")
+                async with unit_of_work():
+                    # Выплату получает только первое из параллельных завершений игры
+                    live = await delete_active_game(game_id)
+                    if live:
+                        dealer_score = play_dealer(dealer_hand, deck)
+                        logger.debug(f"Дилер добрал карты: dealer_hand={dealer_hand}, dealer_score={dealer_score}")
+                        player_score, is_soft = self.calculate_score(player_hand)
+                        cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                        logger.debug(f"Stand: player_score={player_score}, dealer_score={dealer_score}, cash={cash}")
+
+                        view.disable_buttons()  # Отключаем кнопки до обновления эмбеда
+                        if dealer_score > 21 or player_score > dealer_score:
+                            winnings = bet * WIN_PAYOUT
+                            is_blackjack = len(player_hand) == 2 and player_score == 21
+                            if is_blackjack:
+                                winnings = int(bet * BLACKJACK_PAYOUT)
+                            await update_cash(interaction.user.id, guild_id, winnings)
+                            cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                            embed = create_win_embed(
+                                user=interaction.user,
+                                winnings=winnings,
+                                bet=bet,
+                                player_hand=self.format_hand(player_hand),
+                                player_score=player_score,
+                                dealer_hand=self.format_hand(dealer_hand),
+                                dealer_score=dealer_score,
+                                balance=cash,
+                                is_blackjack=is_blackjack
+                            )
+                            logger.info(f"Создание эмбеда победы: winnings={winnings}, bet={bet}, is_blackjack={is_blackjack}")
+                            result = "player" if not is_blackjack else "blackjack"
+                        elif player_score == dealer_score:
+                            await update_cash(interaction.user.id, guild_id, bet)
+                            cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                            embed = create_push_embed(
+                                user=interaction.user,
+                                bet=bet,
+                                player_hand=self.format_hand(player_hand),
+                                player_score=player_score,
+                                dealer_hand=self.format_hand(dealer_hand),
+                                dealer_score=dealer_score,
+                                balance=cash,
+                                is_blackjack=(player_score == 21 and dealer_score == 21)
+                            )
+                            logger.info(f"Создание эмбеда ничьей: bet={bet}")
+                            result = "push"
+                        else:
+                            embed = create_loss_embed(
+                                user=interaction.user,
+                                bet=bet,
+                                player_hand=self.format_hand(player_hand),
+                                player_score=player_score,
+                                dealer_hand=self.format_hand(dealer_hand),
+                                dealer_score=dealer_score,
+                                balance=cash,
+                                dealer_blackjack=(dealer_score == 21 and len(dealer_hand) == 2)
+                            )
+                            logger.info(f"Создание эмбеда проигрыша: bet={bet}")
+                            result = "dealer"
+
+                        await log_game_history(
+                            game_id=game_id,
+                            user_id=interaction.user.id,
+                            guild_id=guild_id,
+                            bet=bet,
+                            result=result,
+                            player_hand=player_hand,
+                            player_score=player_score,
+                            dealer_hand=dealer_hand,
+                            dealer_score=dealer_score
+                        )
+                        logger.info(f"Игра {game_id} завершена: result={result}")
+                if not live:
+                    logger.warning(f"Игра {game_id} уже завершена, действие {action} пропущено")
+                    await interaction.response.send_message("Игра уже завершена.", delete_after=5.0)
+                    return
                 try:
                     await interaction.response.edit_message(embed=embed, view=view)
                     logger.debug(f"Эмбед успешно обновлен для действия stand, game_id={game_id}")
@@ -659,7 +600,7 @@ class BlackjackCog(commands.Cog):
             elif action == "double down":
                 cash, _ = await get_user_balance(interaction.user.id, guild_id)
                 if cash < bet:
-                    embed = create_error_embed(config["error_messages"]["insufficient_cash"], interaction.user.id)
+                    embed = create_error_embed(BLACKJACK_ERROR_MESSAGES["insufficient_cash"], interaction.user.id)
                     try:
                         await interaction.response.edit_message(embed=embed, view=BlackjackView(self, interaction.user.id, game_id, can_double=False))
                         logger.debug(f"Эмбед ошибки отправлен для double down: insufficient_cash")
@@ -678,95 +619,114 @@ class BlackjackCog(commands.Cog):
                         await interaction.response.send_message("Ошибка обновления игры.", delete_after=5.0)
                     logger.warning(f"Double down не удался: не начальная рука, user={interaction.user.id}, player_hand={player_hand}")
                     return
-                await self.deduct_bet(interaction.user.id, guild_id, bet)
-                bet *= 2
-                player_hand.append(deck.pop())
-                deck_count -= 1
-                player_score, is_soft = self.calculate_score(player_hand)
-                logger.debug(f"Double down: player_hand={player_hand}, player_score={player_score}, bet={bet}")
-
-                view.disable_buttons()  # Отключаем кнопки до обновления эмбеда
-                if player_score > 21:
-                    dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                    embed = create_loss_embed(
-                        user=interaction.user,
-                        bet=bet,
-                        player_hand=self.format_hand(player_hand),
-                        player_score=player_score,
-                        dealer_hand=self.format_hand(dealer_hand),
-                        dealer_score=dealer_score,
-                        balance=cash,
-                        dealer_blackjack=False
-                    )
-                    logger.info(f"Создание эмбеда проигрыша: bet={bet}")
-                    result = "dealer"
-                else:
-                    dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                    while dealer_score < 17:
-                        dealer_hand.append(deck.pop())
-                        dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
-                        logger.debug(f"Дилер взял карту: dealer_hand={dealer_hand}, dealer_score={dealer_score}")
-                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                    if dealer_score > 21 or player_score > dealer_score:
-                        winnings = bet * 2
-                        await update_cash(interaction.user.id, guild_id, winnings)
-                        cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                        embed = create_win_embed(
-                            user=interaction.user,
-                            winnings=winnings,
-                            bet=bet,
-                            player_hand=self.format_hand(player_hand),
-                            player_score=player_score,
-                            dealer_hand=self.format_hand(dealer_hand),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            is_blackjack=False
-                        )
-                        logger.info(f"Создание эмбеда победы: winnings={winnings}, bet={bet}")
-                        result = "player"
-                    elif player_score == dealer_score:
-                        await update_cash(interaction.user.id, guild_id, bet)
-                        cash, _ = await get_user_balance(interaction.user.id, guild_id)
-                        embed = create_push_embed(
-                            user=interaction.user,
-                            bet=bet,
-                            player_hand=self.format_hand(player_hand),
-                            player_score=player_score,
-                            dealer_hand=self.format_hand(dealer_hand),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            is_blackjack=False
-                        )
-                        logger.info(f"Создание эмбеда ничьей: bet={bet}")
-                        result = "push"
-                    else:
-                        embed = create_loss_embed(
-                            user=interaction.user,
-                            bet=bet,
-                            player_hand=self.format_hand(player_hand),
-                            player_score=player_score,
-                            dealer_hand=self.format_hand(dealer_hand),
-                            dealer_score=dealer_score,
-                            balance=cash,
-                            dealer_blackjack=(dealer_score == 21 and len(dealer_hand) == 2)
-                        )
-                        logger.info(f"Создание эмбеда проигрыша: bet={bet}")
-                        result = "dealer"
-
-                await log_game_history(
-                    game_id=game_id,
-                    user_id=interaction.user.id,
-                    guild_id=guild_id,
-                    bet=bet,
-                    result=result,
-                    player_hand=player_hand,
-                    player_score=player_score,
-                    dealer_hand=dealer_hand,
-                    dealer_score=dealer_score
-                )
-                await delete_active_game(game_id)
-                logger.info(f"Игра {game_id} завершена: result={result}")
+                try:
+                    async with unit_of_work():
+                        # Выплату получает только первое из параллельных завершений игры
+                        live = await delete_active_game(game_id)
+                        if live:
+                            # Вторая ставка списывается с проверкой cash >= 0; при нехватке
+                            # ValueError откатывает транзакцию вместе с удалением игры
+                            await adjust_balance(
+                                interaction.user.id, guild_id, cash_delta=-bet, guard="cash",
+                                error=BLACKJACK_ERROR_MESSAGES["insufficient_cash"]
+                            )
+                            bet *= 2
+                            player_hand.append(deck.pop())
+                            deck_count -= 1
+                            player_score, is_soft = self.calculate_score(player_hand)
+                            logger.debug(f"Double down: player_hand={player_hand}, player_score={player_score}, bet={bet}")
+
+                            view.disable_buttons()  # Отключаем кнопки до обновления эмбеда
+                            if player_score > 21:
+                                dealer_score, _ = self.calculate_score(dealer_hand, is_dealer=True)
+                                cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                                embed = create_loss_embed(
+                                    user=interaction.user,
+                                    bet=bet,
+                                    player_hand=self.format_hand(player_hand),
+                                    player_score=player_score,
+                                    dealer_hand=self.format_hand(dealer_hand),
+                                    dealer_score=dealer_score,
+                                    balance=cash,
+                                    dealer_blackjack=False
+                                )
+                                logger.info(f"Создание эмбеда проигрыша: bet={bet}")
+                                result = "dealer"
+                            else:
+                                dealer_score = play_dealer(dealer_hand, deck)
+                                logger.debug(f"Дилер добрал карты: dealer_hand={dealer_hand}, dealer_score={dealer_score}")
+                                cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                                if dealer_score > 21 or player_score > dealer_score:
+                                    winnings = bet * WIN_PAYOUT
+                                    await update_cash(interaction.user.id, guild_id, winnings)
+                                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                                    embed = create_win_embed(
+                                        user=interaction.user,
+                                        winnings=winnings,
+                                        bet=bet,
+                                        player_hand=self.format_hand(player_hand),
+                                        player_score=player_score,
+                                        dealer_hand=self.format_hand(dealer_hand),
+                                        dealer_score=dealer_score,
+                                        balance=cash,
+                                        is_blackjack=False
+                                    )
+                                    logger.info(f"Создание эмбеда победы: winnings={winnings}, bet={bet}")
+                                    result = "player"
+                                elif player_score == dealer_score:
+                                    await update_cash(interaction.user.id, guild_id, bet)
+                                    cash, _ = await get_user_balance(interaction.user.id, guild_id)
+                                    embed = create_push_embed(
+                                        user=interaction.user,
+                                        bet=bet,
+                                        player_hand=self.format_hand(player_hand),
+                                        player_score=player_score,
+                                        dealer_hand=self.format_hand(dealer_hand),
+                                        dealer_score=dealer_score,
+                                        balance=cash,
+                                        is_blackjack=False
+                                    )
+                                    logger.info(f"Создание эмбеда ничьей: bet={bet}")
+                                    result = "push"
+                                else:
+                                    embed = create_loss_embed(
+                                        user=interaction.user,
+                                        bet=bet,
+                                        player_hand=self.format_hand(player_hand),
+                                        player_score=player_score,
+                                        dealer_hand=self.format_hand(dealer_hand),
+                                        dealer_score=dealer_score,
+                                        balance=cash,
+                                        dealer_blackjack=(dealer_score == 21 and len(dealer_hand) == 2)
+                                    )
+                                    logger.info(f"Создание эмбеда проигрыша: bet={bet}")
+                                    result = "dealer"
+
+                            await log_game_history(
+                                game_id=game_id,
+                                user_id=interaction.user.id,
+                                guild_id=guild_id,
+                                bet=bet,
+                                result=result,
+                                player_hand=player_hand,
+                                player_score=player_score,
+                                dealer_hand=dealer_hand,
+                                dealer_score=dealer_score
+                            )
+                            logger.info(f"Игра {game_id} завершена: result={result}")
+                except ValueError as e:
+                    embed = create_error_embed(str(e), interaction.user.id)
+                    try:
+                        await interaction.response.edit_message(embed=embed, view=BlackjackView(self, interaction.user.id, game_id, can_double=False))
+                    except disnake.HTTPException as http_error:
+                        logger.error(f"Ошибка обновления эмбеда для double down (insufficient_cash): {http_error}")
+                        await interaction.response.send_message("Ошибка обновления игры.", delete_after=5.0)
+                    logger.warning(f"Double down не удался: {e}, user={interaction.user.id}, bet={bet}")
+                    return
+                if not live:
+                    logger.warning(f"Игра {game_id} уже завершена, действие {action} пропущено")
+                    await interaction.response.send_message("Игра уже завершена.", delete_after=5.0)
+                    return
                 try:
                     await interaction.response.edit_message(embed=embed, view=view)
                     logger.debug(f"Эмбед успешно обновлен для действия double down, game_id={game_id}")
@@ -795,26 +755,26 @@ class BlackjackCog(commands.Cog):
             config = get_blackjack_config()
             amount, error = await self.validate_bet(ctx.author.id, ctx.guild.id, bet, config)
             if error:
-                error_message = config["error_messages"].get(error, "Некорректная ставка.")
+                error_message = BLACKJACK_ERROR_MESSAGES.get(error, "Некорректная ставка.")
                 embed = create_error_embed(error_message, ctx.author.id)
                 await ctx.send(embed=embed)
                 logger.warning(f"Валидация ставки не удалась: user={ctx.author.id}, error={error}")
                 return
 
-            game = await get_active_game(ctx.author.id)
+            game = await get_active_game(ctx.author.id, ctx.guild.id)
             if game:
-                embed = create_error_embed(config["error_messages"]["active_game"], ctx.author.id)
+                embed = create_error_embed(BLACKJACK_ERROR_MESSAGES["active_game"], ctx.author.id)
                 await ctx.send(embed=embed)
                 logger.info(f"Найдена активная игра для пользователя {ctx.author.id}, отправлен эмбед ошибки")
                 return
 
             if not await self.deduct_bet(ctx.author.id, ctx.guild.id, amount):
-                embed = create_error_embed(config["error_messages"]["insufficient_cash"], ctx.author.id)
+                embed = create_error_embed(BLACKJACK_ERROR_MESSAGES["insufficient_cash"], ctx.author.id)
                 await ctx.send(embed=embed)
                 logger.warning(f"Списание ставки не удалось: user={ctx.author.id}, amount={amount}")
                 return
 
-            deck = self.init_deck(config["decks"])
+            deck = self.init_deck(config.decks)
             logger.debug(f"Создана колода: {len(deck)} карт")
             player_hand = [deck.pop(), deck.pop()]
             dealer_hand = [deck.pop(), deck.pop()]
@@ -851,7 +811,7 @@ class BlackjackCog(commands.Cog):
                 view = BlackjackView(self, ctx.author.id, game_id, can_double=False)
                 view.disable_buttons()
                 if is_blackjack and not dealer_blackjack:
-                    winnings = int(amount * 2.5)
+                    winnings = int(amount * BLACKJACK_PAYOUT)
                     await update_cash(ctx.author.id, ctx.guild.id, winnings)
                     cash, _ = await get_user_balance(ctx.author.id, ctx.guild.id)
                     embed = create_win_embed(
@@ -950,7 +910,7 @@ class BlackjackCog(commands.Cog):
                     dealer_hand=self.format_hand(dealer_hand, hide_first=True),
                     dealer_score=self.calculate_score(dealer_hand[1:], is_dealer=True)[0],
                     deck_count=deck_count,
-                    decks=config["decks"],
+                    decks=config.decks,
                     is_soft=is_soft
                 )
                 view = BlackjackView(self, ctx.author.id, game_id, can_double)
@@ -991,7 +951,7 @@ class BlackjackCog(commands.Cog):
             logger.debug(f"Игнорирование сообщения: action '{action}' не в ['hit', 'stand', 'double down']")
             return
 
-        game = await get_active_game(message.author.id)
+        game = await get_active_game(message.author.id, message.guild.id)
         if not game:
             logger.debug(f"Нет активной игры для user={message.author.id}")
             return
@@ -1015,6 +975,7 @@ class BlackjackCog(commands.Cog):
                 self.user = user  # Используем message.author (disnake.Member)
                 self.message = message
                 self.channel = channel
+                self.guild = message.guild
                 self.response = self
                 self.data = {"custom_id": str(game["game_id"])}
 
@@ -1,8 +1,8 @@
 import disnake
 from disnake import Embed
 from disnake.ext import commands
-import random
 import asyncio
+import heapq
 import logging
 
 from datetime import datetime, timezone
@@ -11,25 +11,32 @@ from utils.database import (
     get_pool,
     get_all_cases,
     get_case_contents,
+    get_case_drop_table,
     get_item_id_by_external,
+    get_item_ids_by_external,
     decrement_inventory,
-    add_to_inventory,
-    update_bank,
-    update_cash,
+    add_to_inventory_many,
+    adjust_balance,
+    unit_of_work,
     add_shop_item,
     update_shop_item,
     deactivate_shop_item,
     add_case_content,
     update_case_content,
     delete_case_content,
-    add_or_update_temp_role,
-    remove_temp_role_record,
+    add_or_update_temp_roles,
+    pop_expired_temp_roles,
+    enqueue_role_changes,
     get_all_active_temp_roles
 )
+from utils.members import resolve_members
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Период планировщика временных ролей (секунды): роль снимается не позже чем через тик после срока
+TEMP_ROLE_TICK = 5
+
 
 def format_duration(seconds: int) -> str:
     """
@@ -61,94 +68,112 @@ def format_duration(seconds: int) -> str:
 class Cases(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # (user_id, role_id) -> {"expires": ts, "guild": guild_id}
         self.temp_role_data = {}
+        # Куча (expires_ts, guild_id, user_id, role_id); продлённые роли оставляют
+        # в ней устаревшие записи, они отбрасываются при извлечении
+        self._expiry_heap = []
         bot.loop.create_task(self._recover_temp_roles())
+        self._expiry_task = bot.loop.create_task(self._temp_role_expiry_loop())
+
+    def cog_unload(self):
+        self._expiry_task.cancel()
 
     async def _recover_temp_roles(self):
         """
-        Восстанавливает задачи по удалению временных ролей после рестарта бота.
+        Восстанавливает временные роли после рестарта бота:
+        сначала снимает роли, истёкшие за время простоя, затем по каждой гильдии
+        одним запросом к gateway находит участников и ставит недостающие роли
+        в очередь role_outbox (воркер выдаст их одним edit на участника),
+        а сроки кладёт в планировщик.
         """
         await self.bot.wait_until_ready()
         try:
-            rows = await get_all_active_temp_roles()
-            now_ts = int(datetime.now(timezone.utc).timestamp())
+            await self._expire_due_temp_roles(int(datetime.now(timezone.utc).timestamp()))
 
-            for user_id, guild_id, role_id, expires_at in rows:
+            by_guild = {}
+            for user_id, guild_id, role_id, expires_at in await get_all_active_temp_roles():
                 expires_ts = int(expires_at.replace(tzinfo=timezone.utc).timestamp())
-                delay = max(0, expires_ts - now_ts)
+                self._push_expiry(guild_id, user_id, role_id, expires_ts)
+                by_guild.setdefault(guild_id, {}).setdefault(user_id, []).append(role_id)
 
+            grants = []
+            for guild_id, users in by_guild.items():
                 guild = self.bot.get_guild(guild_id)
                 if guild is None:
                     continue
-                try:
-                    member = guild.get_member(user_id) or await guild.fetch_member(user_id)
-                except:
-                    continue
-
-                role_obj = guild.get_role(role_id)
-                if role_obj and role_obj not in member.roles:
-                    try:
-                        await member.add_roles(role_obj, reason="Восстановление временной роли")
-                    except Exception as e_add:
-                        logger.error(f"recover_temp_role: {e_add}")
-
-                key = (user_id, role_id)
-
-                async def remove_later(m: disnake.Member, rid: int, delay_secs: int):
-                    try:
-                        await asyncio.sleep(delay_secs)
-                        role_obj2 = m.guild.get_role(rid)
-                        if role_obj2 and role_obj2 in m.roles:
-                            try:
-                                await m.remove_roles(role_obj2, reason="Срок временной роли истёк")
-                            except Exception as e_rm:
-                                logger.error(f"recover_remove_temp_role: {e_rm}")
-                        self.temp_role_data.pop((m.id, rid), None)
-                        try:
-                            await remove_temp_role_record(m.id, m.guild.id, rid)
-                        except Exception as e_db2:
-                            logger.error(f"remove_temp_role_record error: {e_db2}")
-                    except asyncio.CancelledError:
-                        return
-
-                task = self.bot.loop.create_task(remove_later(member, role_id, delay))
-                self.temp_role_data[key] = {"expires": expires_ts, "task": task}
-
-            logger.info("Восстановлены задачи на удаление временных ролей.")
+                members = await resolve_members(guild, users)
+                for user_id, role_ids in users.items():
+                    member = members.get(user_id)
+                    if member is None:
+                        continue
+                    for role_id in role_ids:
+                        role_obj = guild.get_role(role_id)
+                        if role_obj is not None and role_obj not in member.roles:
+                            grants.append((user_id, guild_id, role_id, "add"))
+
+            # Через очередь, а не add_roles: воркер не затрёт выдачу своим edit(roles=...)
+            await enqueue_role_changes(grants, reason="Восстановление временной роли")
+            logger.info(f"Восстановлены сроки временных ролей, в очередь на выдачу поставлено ролей: {len(grants)}.")
         except Exception as e:
             logger.error(f"_recover_temp_roles: {e}")
 
+    def _push_expiry(self, guild_id: int, user_id: int, role_id: int, until_ts: int):
+        self.temp_role_data[(user_id, role_id)] = {"expires": until_ts, "guild": guild_id}
+        heapq.heappush(self._expiry_heap, (until_ts, guild_id, user_id, role_id))
+
     async def schedule_temp_role_removal(self, member: disnake.Member, role_id: int, until_ts: int):
         """
-        Планирует удаление временной роли в момент until_ts.
+        Планирует удаление временной роли в момент until_ts
+        (снимет её ближайший тик _temp_role_expiry_loop после until_ts).
         """
-        key = (member.id, role_id)
-        prev = self.temp_role_data.get(key)
-        if prev and prev.get("task"):
-            prev["task"].cancel()
-
-        now_ts = int(datetime.now(timezone.utc).timestamp())
-        delay = max(0, until_ts - now_ts)
+        self._push_expiry(member.guild.id, member.id, role_id, until_ts)
 
-        async def remove_later():
+    async def _temp_role_expiry_loop(self):
+        """
+        Единый планировщик временных ролей: раз в TEMP_ROLE_TICK секунд
+        проверяет вершину кучи и снимает всё наступившее одной пачкой.
+        """
+        await self.bot.wait_until_ready()
+        while True:
             try:
-                await asyncio.sleep(delay)
-                role_obj = member.guild.get_role(role_id)
-                if role_obj and role_obj in member.roles:
-                    try:
-                        await member.remove_roles(role_obj, reason="Срок временной роли истёк")
-                    except Exception as e2:
-                        logger.error(f"remove_temp_role: {e2}")
-                self.temp_role_data.pop(key, None)
-                try:
-                    await remove_temp_role_record(member.id, member.guild.id, role_id)
-                except Exception as e_db:
-                    logger.error(f"remove_temp_role_record error: {e_db}")
+                now_ts = int(datetime.now(timezone.utc).timestamp())
+                if self._expiry_heap and self._expiry_heap[0][0] <= now_ts:
+                    await self._expire_due_temp_roles(now_ts)
             except asyncio.CancelledError:
-                return
+                raise
+            except Exception as e:
+                logger.error(f"_temp_role_expiry_loop: {e}")
+            await asyncio.sleep(TEMP_ROLE_TICK)
 
-        task = asyncio.create_task(remove_later())
-        self.temp_role_data[key] = {"expires": until_ts, "task": task}
+    async def _expire_due_temp_roles(self, now_ts: int):
+        """
+        Забирает из БД все истёкшие записи одним запросом и в той же транзакции
+        ставит снятие ролей в очередь role_outbox (воркер снимет их по одному edit
+        на участника, а при падении бота снятие не потеряется).
+        """
+        due = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now_ts:
+            due.append(heapq.heappop(self._expiry_heap))
+
+        try:
+            async with unit_of_work():
+                removals = []
+                # Продление, пришедшее после DELETE, вставит запись заново и поставит
+                # выдачу в очередь следом за этим снятием (case_open)
+                for user_id, guild_id, role_id in await pop_expired_temp_roles(now_ts):
+                    removals.append((user_id, guild_id, role_id, "remove"))
+                await enqueue_role_changes(removals, reason="Срок временной роли истёк")
+        except BaseException:
+            # Транзакция откатилась: возвращаем сроки в кучу, следующий тик повторит
+            for entry in due:
+                heapq.heappush(self._expiry_heap, entry)
+            raise
+
+        for user_id, _, role_id, _ in removals:
+            data = self.temp_role_data.get((user_id, role_id))
+            if data and data["expires"] <= now_ts:
+                del self.temp_role_data[(user_id, role_id)]
 
 
     # -----------------------------
@@ -338,8 +363,8 @@ WHERE ui.user_id = %s AND si.type = 'case' AND ui.quantity > 0;
                     )
                 )
 
-            drops = await get_case_contents(case_ext_id)
-            if not drops:
+            drop_table = await get_case_drop_table(case_ext_id)
+            if not drop_table.rows:
                 return await ctx.send(
                     embed=Embed(
                         title="ℹ️ Награды не настроены",
@@ -348,19 +373,8 @@ WHERE ui.user_id = %s AND si.type = 'case' AND ui.quantity > 0;
                     )
                 )
 
-            valid_drops = [row for row in drops if len(row) == 7]
-            if not valid_drops:
-                return await ctx.send(
-                    embed=Embed(
-                        title="🚫 Ошибка",
-                        description="Некорректная запись дропа (ожидалось 7 полей).",
-                        color=0xFF0000
-                    )
-                )
-
             # Проверяем сумму шансов
-            probs = [(row[0], float(row[3])) for row in valid_drops]
-            total_chance = sum(p for _, p in probs)
+            total_chance = drop_table.total_chance
             if abs(total_chance - 100.0) > 1e-6:
                 # Если сумма шансов не равна ровно 100%
                 return await ctx.send(
@@ -374,13 +388,6 @@ WHERE ui.user_id = %s AND si.type = 'case' AND ui.quantity > 0;
                     )
                 )
 
-            # Копим кумулятивные вероятности
-            cum = []
-            acc = 0.0
-            for cid, p in probs:
-                acc += p
-                cum.append((cid, acc))
-
             total_cash = 0
             total_bank = 0
 
@@ -394,18 +401,8 @@ WHERE ui.user_id = %s AND si.type = 'case' AND ui.quantity > 0;
 
             now_ts = int(datetime.now(timezone.utc).timestamp())
 
-            # Открываем count кейсов
-            for _ in range(count):
-                r = random.random() * total_chance
-                chosen_cid = None
-                for cid, bound in cum:
-                    if r <= bound:
-                        chosen_cid = cid
-                        break
-                if chosen_cid is None:
-                    chosen_cid = cum[-1][0]
-
-                sel = next(x for x in valid_drops if x[0] == chosen_cid)
+            # 1) Разыгрываем все открытия и только копим итоги: без запросов к БД и Discord
+            for sel in drop_table.draw(count):
                 _, rtype, rval, _chance, dur_secs, comp_coins, hidden = sel
 
                 if rtype == "coins_cash":
@@ -417,84 +414,97 @@ WHERE ui.user_id = %s AND si.type = 'case' AND ui.quantity > 0;
                 elif rtype == "role_perm":
                     role_id = int(rval)
                     role_obj = ctx.guild.get_role(role_id)
-                    if role_obj in user.roles:
+                    # Роль уже есть или выдана предыдущим открытием — компенсация
+                    if role_obj in user.roles or role_id in perm_roles_assigned:
                         if comp_coins > 0:
                             compensation_for_roles.setdefault(role_id, 0)
                             compensation_for_roles[role_id] += comp_coins
-                    else:
-                        if role_obj:
-                            await user.add_roles(role_obj, reason="Кейс: перм-роль")
-                            perm_roles_assigned.setdefault(role_id, 0)
-                            perm_roles_assigned[role_id] += 1
+                    elif role_obj:
+                        perm_roles_assigned[role_id] = 1
 
                 elif rtype == "role_temp":
                     role_id = int(rval)
-                    role_obj = ctx.guild.get_role(role_id)
-
-                    key = (user_id, role_id)
-                    existing = self.temp_role_data.get(key)
-                    if existing and existing["expires"] > now_ts:
-                        base_expires = existing["expires"]
-                        new_expires = base_expires + dur_secs
-                        if comp_coins > 0:
-                            compensation_for_roles.setdefault(role_id, 0)
-                            compensation_for_roles[role_id] += comp_coins
+                    info = temp_roles_info.get(role_id)
+                    if info is None:
+                        existing = self.temp_role_data.get((user_id, role_id))
+                        active = bool(existing and existing["expires"] > now_ts)
+                        info = {
+                            "added": 0,
+                            "final_expires": existing["expires"] if active else now_ts
+                        }
+                        temp_roles_info[role_id] = info
+                        extended = active
                     else:
-                        new_expires = now_ts + dur_secs
-                        if role_obj:
-                            await user.add_roles(role_obj, reason="Кейс: временная роль")
-
-                    expires_dt = datetime.fromtimestamp(new_expires, tz=timezone.utc)
-                    try:
-                        await add_or_update_temp_role(user_id, guild_id, role_id, expires_dt)
-                    except Exception as e_db:
-                        logger.error(f"DB add_or_update_temp_role error: {e_db}")
-
-                    await self.schedule_temp_role_removal(user, role_id, new_expires)
-
-                    info = temp_roles_info.get(role_id, {"added": 0, "final_expires": new_expires})
+                        extended = True
+                    # Продление уже действующей роли — компенсация, как и раньше
+                    if extended and comp_coins > 0:
+                        compensation_for_roles.setdefault(role_id, 0)
+                        compensation_for_roles[role_id] += comp_coins
                     info["added"] += dur_secs
-                    info["final_expires"] = new_expires
-                    temp_roles_info[role_id] = info
+                    info["final_expires"] += dur_secs
 
                 elif rtype == "item":
-                    child_item = await get_item_id_by_external(rval)
-                    if child_item:
-                        await add_to_inventory(user_id, child_item, 1)
-                        items_received.setdefault(rval, 0)
-                        items_received[rval] += 1
+                    items_received.setdefault(rval, 0)
+                    items_received[rval] += 1
 
                 elif rtype == "case":
-                    child_item = await get_item_id_by_external(rval)
-                    if child_item:
-                        await add_to_inventory(user_id, child_item, 1)
-                        nested_cases.setdefault(rval, 0)
-                        nested_cases[rval] += 1
+                    nested_cases.setdefault(rval, 0)
+                    nested_cases[rval] += 1
 
                 else:
                     continue
 
-            # Снимаем из инвентаря открытые кейсы
-            await decrement_inventory(user_id, item_id, count)
-
-            # Обновляем баланс, если что-нибудь выпало
-            if total_cash:
-                try:
-                    await update_cash(user_id, guild_id, total_cash)
-                except Exception as e:
-                    logger.error(f"update_cash: {e}")
-            if total_bank:
-                try:
-                    await update_bank(user_id, guild_id, total_bank)
-                except Exception as e:
-                    logger.error(f"update_bank: {e}")
+            # Предметы и кейсы: item_id одним запросом, неизвестные external_id отбрасываем
+            item_ids = await get_item_ids_by_external([*items_received, *nested_cases])
+            items_received = {ext: cnt for ext, cnt in items_received.items() if ext in item_ids}
+            nested_cases = {ext: cnt for ext, cnt in nested_cases.items() if ext in item_ids}
+            inventory = {}
+            for received in (items_received, nested_cases):
+                for ext, cnt in received.items():
+                    inventory[item_ids[ext]] = inventory.get(item_ids[ext], 0) + cnt
 
             total_comp_coins = sum(compensation_for_roles.values())
-            if total_comp_coins:
-                try:
-                    await update_bank(user_id, guild_id, total_comp_coins)
-                except Exception as e:
-                    logger.error(f"compensation update_bank: {e}")
+            temp_expirations = {
+                role_id: datetime.fromtimestamp(info["final_expires"], tz=timezone.utc)
+                for role_id, info in temp_roles_info.items()
+            }
+
+            grant_ids = list(perm_roles_assigned)
+
+            # 2) Применяем всё одной транзакцией; число запросов не зависит от count
+            try:
+                async with unit_of_work():
+                    # Кейсы снимаем первыми: параллельное открытие тех же кейсов откатится целиком
+                    removed = await decrement_inventory(user_id, item_id, count)
+                    if removed < count:
+                        raise ValueError(f"У вас есть только **{removed}** × «{actual_name}».")
+                    await add_to_inventory_many(user_id, inventory)
+                    # Выдавать или продлевать, решает upsert, а не temp_role_data: параллельный
+                    # тик планировщика мог уже удалить запись и поставить роль на снятие
+                    grant_ids += await add_or_update_temp_roles(user_id, guild_id, temp_expirations)
+                    # Роли выдаст воркер очереди после коммита, по одному edit на участника
+                    await enqueue_role_changes(
+                        [(user_id, guild_id, role_id, "add") for role_id in grant_ids],
+                        reason="Кейс: роли"
+                    )
+                    if total_cash or total_bank or total_comp_coins:
+                        await adjust_balance(
+                            user_id, guild_id,
+                            cash_delta=total_cash,
+                            bank_delta=total_bank + total_comp_coins
+                        )
+            except ValueError as e:
+                return await ctx.send(
+                    embed=Embed(
+                        title="❗ Недостаточно кейсов",
+                        description=str(e),
+                        color=0xFFA500
+                    )
+                )
+
+            # 3) Сроки временных ролей — в планировщик, по одному разу на роль
+            for role_id, info in temp_roles_info.items():
+                await self.schedule_temp_role_removal(user, role_id, info["final_expires"])
 
             # Собираем эмбед
             embed = Embed(
@@ -2,10 +2,8 @@ import disnake
 from disnake.ext import commands
 import random
 import logging
-import configparser
-import os
-import aiohttp
 
+from utils import settings
 from utils.database import (
     get_user_balance,
     update_cash,
@@ -14,43 +12,23 @@ from utils.database import (
     get_cock_fight_chance,
     update_cock_fight_chance
 )
-from config import currency, audit_webhook, make_audit_payload
+from utils.audit import set_audit_reason
+from config import currency
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Загрузка конфигурации из games.ini
-config = configparser.ConfigParser()
-config_file = "games.ini"
-if not os.path.exists(config_file):
-    logger.error(f"Файл конфигурации {config_file} не найден.")
-    raise FileNotFoundError(f"Файл конфигурации {config_file} не найден.")
-config.read(config_file, encoding="utf-8")
+COCK_FIGHT_ERRORS = {
+    "insufficient_cash": "Недостаточно средств для ставки!",
+    "no_chicken": "У вас нет курицы для участия в бою!",
+    "invalid_bet": "Некорректная ставка. Укажите число, 'all', 'half' или формат 1e6.",
+    "min_bet": "Минимальная ставка: {min_bet} {currency}."
+}
 
 def get_cock_fight_config():
-    """Читает настройки CockFight из games.ini один раз."""
-    section = config["CockFight"]
-    min_bet = int(section.get("min_bet", 10))
-    min_chance = int(section.get("min_chance", 50))
-    max_chance = int(section.get("max_chance", 90))
-    if min_bet < 1:
-        raise ValueError("min_bet должен быть >= 1")
-    if not (0 <= min_chance <= max_chance <= 100):
-        raise ValueError(
-            "min_chance/max_chance должны быть в диапазоне 0–100 и min_chance ≤ max_chance"
-        )
-    return {
-        "min_bet": min_bet,
-        "min_chance": min_chance,
-        "max_chance": max_chance,
-        "errors": {
-            "insufficient_cash": "Недостаточно средств для ставки!",
-            "no_chicken": "У вас нет курицы для участия в бою!",
-            "invalid_bet": "Некорректная ставка. Укажите число, 'all', 'half' или формат 1e6.",
-            "min_bet": f"Минимальная ставка: {min_bet} {currency}."
-        }
-    }
+    """Настройки CockFight из общего реестра (utils.settings)."""
+    return settings.cock_fight()
 
 def create_win_embed(user: disnake.Member, winnings: int, chance: int, max_chance: int) -> disnake.Embed:
     embed = disnake.Embed(
@@ -90,32 +68,15 @@ def create_error_embed(msg: str, user_id: int) -> disnake.Embed:
 class CockFightCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.cfg = get_cock_fight_config()
-        self._session = None
         logger.info("CockFightCog initialized")
 
-    def cog_unload(self):
-        if self._session and not self._session.closed:
-            self.bot.loop.create_task(self._session.close())
-
-    async def _get_session(self) -> aiohttp.ClientSession:
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
-        return self._session
-
-    async def _send_audit(self, user_id: int, cash_change: int, bank_change: int, reason: str):
-        payload = make_audit_payload(
-            action="Обновление баланса",
-            user_id=user_id,
-            cash_change=cash_change,
-            bank_change=bank_change,
-            reason=reason
-        )
-        try:
-            session = await self._get_session()
-            await session.post(audit_webhook, json=payload)
-        except Exception as e:
-            logger.warning(f"Audit webhook error: {e}")
+    @property
+    def cfg(self):
+        # Берётся при каждом обращении, чтобы подхватывать перезагрузку games.ini
+        return get_cock_fight_config()
+
+    def error_message(self, key: str) -> str:
+        return COCK_FIGHT_ERRORS[key].format(min_bet=self.cfg.min_bet, currency=currency)
 
     async def validate_bet(self, user_id: int, guild_id: int, bet: str):
         """Поддерживает 'all', 'half', натуральные числа и формат 1e6."""
@@ -135,7 +96,7 @@ class CockFightCog(commands.Cog):
                 return None, "invalid_bet"
             if amount > cash:
                 return None, "insufficient_cash"
-        if amount < self.cfg["min_bet"]:
+        if amount < self.cfg.min_bet:
             return None, "min_bet"
         return amount, None
 
@@ -161,20 +122,21 @@ class CockFightCog(commands.Cog):
 
         amount, err = await self.validate_bet(user_id, guild_id, bet)
         if err:
-            await ctx.send(embed=create_error_embed(self.cfg["errors"][err], user_id))
+            await ctx.send(embed=create_error_embed(self.error_message(err), user_id))
             return
 
         if not await self.has_chicken(user_id):
-            await ctx.send(embed=create_error_embed(self.cfg["errors"]["no_chicken"], user_id))
+            await ctx.send(embed=create_error_embed(self.error_message("no_chicken"), user_id))
             return
 
+        set_audit_reason("Ставка в куриных боях")
         if not await self.deduct_bet(user_id, guild_id, amount):
-            await ctx.send(embed=create_error_embed(self.cfg["errors"]["insufficient_cash"], user_id))
+            await ctx.send(embed=create_error_embed(self.error_message("insufficient_cash"), user_id))
             return
 
         chance = await get_cock_fight_chance(user_id, guild_id)
         if chance is None:
-            chance = self.cfg["min_chance"]
+            chance = self.cfg.min_chance
             await update_cock_fight_chance(user_id, guild_id, chance)
 
         roll = random.randint(1, 100)
@@ -183,18 +145,13 @@ class CockFightCog(commands.Cog):
 
         if win:
             winnings = amount * 2
-            new_chance = min(chance + 1, self.cfg["max_chance"])
+            new_chance = min(chance + 1, self.cfg.max_chance)
+            # Выигрыш попадает в аудит из update_cash
+            set_audit_reason("Победа в куриных боях")
             await update_cash(user_id, guild_id, winnings)
             await update_cock_fight_chance(user_id, guild_id, new_chance)
 
-            await self._send_audit(
-                user_id=user_id,
-                cash_change=winnings,
-                bank_change=0,
-                reason="Победа в куриных боях"
-            )
-
-            embed = create_win_embed(ctx.author, winnings, new_chance, self.cfg["max_chance"])
+            embed = create_win_embed(ctx.author, winnings, new_chance, self.cfg.max_chance)
             logger.info(f"Victory: user={user_id}, +{winnings:,}, new_chance={new_chance}")
 
         else:
@@ -210,14 +167,7 @@ class CockFightCog(commands.Cog):
             else:
                 logger.warning(f"No Chicken to remove for user={user_id}")
 
-            await self._send_audit(
-                user_id=user_id,
-                cash_change=-amount,
-                bank_change=0,
-                reason="Поражение в куриных боях"
-            )
-
-            await update_cock_fight_chance(user_id, guild_id, self.cfg["min_chance"])
+            await update_cock_fight_chance(user_id, guild_id, self.cfg.min_chance)
             embed = create_loss_embed(ctx.author)
             logger.info(f"Defeat: user={user_id}, -{amount:,}, chicken_removed={removed}")
 
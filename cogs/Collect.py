@@ -1,33 +1,18 @@
 import disnake
 from disnake.ext import commands
-import configparser
-import os
 import time
 import logging
 import random
 import uuid
 import asyncio
-from utils.database import ensure_user_exists, update_cash, update_bank, get_cooldown, update_cooldown, get_user_balance
+from utils import settings
+from utils.database import adjust_balance, get_cooldowns, update_cooldowns, unit_of_work
 from config import currency, COMMAND_CONFIG_ERROR, COMMAND_COOLDOWN, COMMAND_ERROR
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Чтение конфигурации из config.ini
-config_file = "config.ini"
-
-if not os.path.exists(config_file):
-    logger.error(f"Config file {config_file} not found.")
-    raise FileNotFoundError(f"Config file {config_file} not found.")
-
-try:
-    config = configparser.ConfigParser()
-    config.read(config_file, encoding='utf-8')
-except Exception as e:
-    logger.error(f"Failed to read {config_file}: {e}")
-    raise
-
 # Сообщения для команды collect-income
 COLLECT_SUCCESS_MESSAGES = [
     "Награда {currency} {amount} за роль <@&{role_id}> получена!"
@@ -45,48 +30,24 @@ COLLECT_CONFIG_NOT_FOUND = "Роль <@&{role_id}> не найдена в кон
 COLLECT_CONFIG_LIST = "Текущая конфигурация:\n{config_list}"
 COLLECT_CONFIG_ERROR = "Ошибка при обновлении конфигурации: {error}"
 
+def get_collect_snapshot():
+    """Снимок секции [Collect] из общего реестра (utils.settings)."""
+    return settings.collect()
+
 def get_collect_config():
-    """Получение настроек из config.ini."""
-    try:
-        role_ids = [int(id.strip()) for id in config['Collect']['role_id'].strip('[]').split(',') if id.strip()]
-        role_rewards = [int(reward.strip()) for reward in config['Collect']['role_reward'].strip('[]').split(',') if reward.strip()]
-        reward_cooldowns = [int(cooldown.strip()) for cooldown in config['Collect']['reward_cooldown'].strip('[]').split(',') if cooldown.strip()]
-        reward_types = [t.strip() for t in config['Collect']['reward_type'].strip('[]').split(',') if t.strip()]
-        
-        if not (len(role_ids) == len(role_rewards) == len(reward_cooldowns) == len(reward_types)):
-            raise ValueError("Lists role_id, role_reward, reward_cooldown, and reward_type must have the same length.")
-        
-        for t in reward_types:
-            if t not in ['cash', 'bank']:
-                raise ValueError(f"Invalid reward_type: '{t}'. Must be 'cash' or 'bank'.")
-        
-        return [{"role_id": role_id, "reward": reward, "cooldown": cooldown, "reward_type": reward_type}
-                for role_id, reward, cooldown, reward_type in zip(role_ids, role_rewards, reward_cooldowns, reward_types)]
-    except KeyError as e:
-        logger.error(f"Invalid config section for Collect: {e}")
-        raise ValueError("Invalid config section for Collect")
-    except Exception as e:
-        logger.error(f"Error parsing {config_file}: {e}")
-        raise ValueError(f"Error parsing {config_file}: {e}")
+    """Получение настроек в виде списка словарей (для меню настройки)."""
+    return [
+        {"role_id": role.role_id, "reward": role.reward, "cooldown": role.cooldown, "reward_type": role.reward_type}
+        for role in get_collect_snapshot().roles
+    ]
 
 def save_collect_config(config_list):
-    """Сохранение конфигурации в config.ini."""
+    """Сохранение конфигурации в config.ini и обновление реестра настроек."""
     try:
-        config.read(config_file, encoding='utf-8')  # Перечитываем текущий файл
-        config['Collect'] = {
-            'role_id': f"[{', '.join(str(item['role_id']) for item in config_list)}]",
-            'role_reward': f"[{', '.join(str(item['reward']) for item in config_list)}]",
-            'reward_cooldown': f"[{', '.join(str(item['cooldown']) for item in config_list)}]",
-            'reward_type': f"[{', '.join(item['reward_type'] for item in config_list)}]"
-        }
-        with open(config_file, 'w', encoding='utf-8') as f:
-            config.write(f)
+        settings.save_collect(config_list)
         logger.info("Collect configuration saved successfully.")
-        # Логируем содержимое config.ini для отладки
-        with open(config_file, 'r', encoding='utf-8') as f:
-            logger.debug(f"Current config.ini content:\n{f.read()}")
     except Exception as e:
-        logger.error(f"Error saving {config_file}: {e}")
+        logger.error(f"Error saving {settings.CONFIG_FILE}: {e}")
         raise
 
 class AddRoleModal(disnake.ui.Modal):
@@ -473,22 +434,6 @@ class CollectCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    async def check_cooldown(self, ctx, command_name: str, cooldown: int, role_id: int):
-        """Проверка кулдауна для конкретной роли."""
-        user_id = ctx.author.id
-        guild_id = ctx.guild.id
-        cooldown_key = f"collect_{role_id}"
-        current_time = int(time.time())
-        last_used = await get_cooldown(user_id, guild_id, cooldown_key)
-
-        if last_used is not None:
-            time_passed = current_time - last_used
-            if time_passed < cooldown:
-                remaining = cooldown - time_passed
-                minutes, seconds = divmod(remaining, 60)
-                return False, minutes, seconds, remaining
-        return True, 0, 0, 0
-
     @commands.command(name="collect-income", aliases=["collect", "collectincome"])
     async def collect_income(self, ctx):
         user_id = ctx.author.id
@@ -496,7 +441,7 @@ class CollectCog(commands.Cog):
         member = ctx.guild.get_member(user_id)
 
         try:
-            config_list = get_collect_config()
+            collect_config = get_collect_snapshot()
         except ValueError as e:
             embed = disnake.Embed(
                 title="Ошибка",
@@ -507,17 +452,7 @@ class CollectCog(commands.Cog):
             logger.error(f"Config error for collect-income command, user {user_id}: {e}")
             return
 
-        eligible_roles = []
-        for config_item in config_list:
-            role = ctx.guild.get_role(config_item['role_id'])
-            if role and role in member.roles:
-                eligible_roles.append(config_item)
-                logger.debug(f"Role {config_item['role_id']} is eligible for user {user_id}")
-            else:
-                if not role:
-                    logger.warning(f"Role {config_item['role_id']} not found on server {guild_id}")
-                else:
-                    logger.debug(f"User {user_id} does not have role {config_item['role_id']}")
+        eligible_roles = collect_config.eligible(role.id for role in member.roles)
 
         if not eligible_roles:
             embed = disnake.Embed(
@@ -529,41 +464,33 @@ class CollectCog(commands.Cog):
             logger.info(f"User {user_id} has no eligible roles for collect-income in guild {guild_id}")
             return
 
+        # Кулдауны всех ролей читаются одним вызовом
+        cooldown_keys = {item.role_id: f"collect_{item.role_id}" for item in eligible_roles}
+        last_used = await get_cooldowns(user_id, guild_id, list(cooldown_keys.values()))
+        current_time = int(time.time())
+
         rewards = []
         remaining_cooldowns = []
-        all_on_cooldown = True
+        collectable = []
         for config_item in eligible_roles:
-            role_id = config_item['role_id']
-            can_collect, minutes, seconds, remaining = await self.check_cooldown(ctx, "collect-income", config_item['cooldown'], role_id)
-            if can_collect:
-                all_on_cooldown = False
-                try:
-                    await ensure_user_exists(user_id, guild_id)
-                    if config_item['reward_type'] == 'cash':
-                        new_balance = await update_cash(user_id, guild_id, config_item['reward'])
-                        balance_type = 'cash'
-                    elif config_item['reward_type'] == 'bank':
-                        new_balance = await update_bank(user_id, guild_id, config_item['reward'])
-                        balance_type = 'bank'
-                    else:
-                        raise ValueError(f"Invalid reward_type: {config_item['reward_type']}")
-                    await update_cooldown(user_id, guild_id, f"collect_{role_id}", int(time.time()))
-                    message = random.choice(COLLECT_SUCCESS_MESSAGES).format(
-                        mention=ctx.author.mention,
-                        amount=config_item['reward'],
-                        currency=currency,
-                        role_id=role_id
-                    )
-                    rewards.append(f"{message}")
-                    logger.info(f"User {user_id} collected {config_item['reward']} ({balance_type}) for role ID {role_id} in guild {guild_id}")
-                except Exception as e:
-                    logger.error(f"Error processing collect-income for user {user_id}, role ID {role_id}: {e}")
-                    rewards.append(f"Ошибка при сборе награды за роль <@&{role_id}>: {str(e)}")
-            else:
+            role_id = config_item.role_id
+            used_at = last_used.get(cooldown_keys[role_id])
+            if used_at is not None and current_time - used_at < config_item.cooldown:
+                remaining = config_item.cooldown - (current_time - used_at)
+                minutes, seconds = divmod(remaining, 60)
                 rewards.append(f"Роль <@&{role_id}> на кулдауне: осталось {minutes} мин {seconds} сек.")
                 remaining_cooldowns.append(remaining)
+                continue
+            collectable.append(config_item)
+            message = random.choice(COLLECT_SUCCESS_MESSAGES).format(
+                mention=ctx.author.mention,
+                amount=config_item.reward,
+                currency=currency,
+                role_id=role_id
+            )
+            rewards.append(f"{message}")
 
-        if all_on_cooldown and remaining_cooldowns:
+        if not collectable:
             min_remaining = min(remaining_cooldowns)
             minutes, seconds = divmod(min_remaining, 60)
             embed = disnake.Embed(
@@ -575,8 +502,32 @@ class CollectCog(commands.Cog):
             logger.info(f"User {user_id} tried collect-income but all roles on cooldown in guild {guild_id}")
             return
 
+        # Награды суммируются и начисляются вместе с кулдаунами в одной транзакции
+        cash_reward = sum(item.reward for item in collectable if item.reward_type == 'cash')
+        bank_reward = sum(item.reward for item in collectable if item.reward_type == 'bank')
+        try:
+            async with unit_of_work():
+                cash, bank = await adjust_balance(user_id, guild_id, cash_delta=cash_reward, bank_delta=bank_reward)
+                await update_cooldowns(
+                    user_id, guild_id,
+                    [cooldown_keys[item.role_id] for item in collectable],
+                    current_time
+                )
+        except Exception as e:
+            embed = disnake.Embed(
+                title="Ошибка",
+                description=COMMAND_ERROR.format(error=str(e)),
+                color=0xFF0000
+            )
+            await ctx.send(embed=embed)
+            logger.error(f"Error processing collect-income for user {user_id} in guild {guild_id}: {e}")
+            return
+        logger.info(
+            f"User {user_id} collected cash={cash_reward}, bank={bank_reward} for roles "
+            f"{[item.role_id for item in collectable]} in guild {guild_id}"
+        )
+
         description = "\n".join(rewards)
-        cash, bank = await get_user_balance(user_id, guild_id)
         total = cash + bank
         embed = disnake.Embed(
             title="Сбор наград",
@@ -3,7 +3,7 @@ from disnake.ext import commands
 import logging
 import asyncio
 
-from utils.database import get_pool, init_db
+from utils.database import get_pool, init_db, invalidate_balance_cache, reset_cooldown_cache, warm_cooldowns, reset_active_game_cache, warm_active_games, reset_roulette_cache, warm_roulettes, invalidate_drop_table, reset_history_queue
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -38,8 +38,18 @@ class DatabaseClearCog(commands.Cog):
 
                 # Коммит транзакции произойдёт при выходе из async with conn.cursor()
                 logger.info("Очистка схемы выполнена")
+            # Закэшированные балансы, кулдауны, игры, раунды, таблицы дропа и незаписанная история относятся к удалённым строкам
+            invalidate_balance_cache()
+            reset_cooldown_cache()
+            reset_active_game_cache()
+            reset_roulette_cache()
+            invalidate_drop_table()
+            reset_history_queue()
             # 3) Переинициализируем структуру через init_db()
             await init_db()
+            await warm_cooldowns()
+            await warm_active_games()
+            await warm_roulettes()
             logger.info("Все таблицы пересозданы через init_db")
             return True
 
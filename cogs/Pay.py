@@ -1,13 +1,12 @@
 import disnake
 from disnake.ext import commands
 import logging
-import configparser
-import os
 import time
 import math
 import random
 import asyncio
 from typing import Union
+from utils import settings
 from utils.database import get_user_balance, ensure_user_exists, get_cooldown, update_cooldown, transfer_cash
 from config import currency, GIVEMONEY_SUCCESS_MESSAGES, GIVEMONEY_FAIL_MESSAGES, GIVEMONEY_INSUFFICIENT_FUNDS_MESSAGES, GIVEMONEY_ERROR_MESSAGES, GIVEMONEY_COOLDOWN_MESSAGES, GIVEMONEY_NOTICE_MESSAGES
 
@@ -15,20 +14,6 @@ from config import currency, GIVEMONEY_SUCCESS_MESSAGES, GIVEMONEY_FAIL_MESSAGES
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Чтение конфигурации из config.ini
-config = configparser.ConfigParser()
-config_file = "config.ini"
-
-if not os.path.exists(config_file):
-    logger.error(f"Config file {config_file} not found.")
-    raise FileNotFoundError(f"Config file {config_file} not found.")
-
-try:
-    config.read(config_file, encoding='utf-8')
-except Exception as e:
-    logger.error(f"Failed to read config.ini: {e}")
-    raise
-
 def create_embed(embed_type, user, message=None, error_message=None, total=None, amount=None, fee=None, received=None, required=None, available=None):
     """Создание эмбеда для различных типов сообщений."""
     embed = disnake.Embed(color=0x2F3136)
@@ -62,58 +47,6 @@ def create_embed(embed_type, user, message=None, error_message=None, total=None,
         embed.description = message
     return embed
 
-def get_command_config(command_name):
-    """Получение настроек для команды из config.ini."""
-    try:
-        section = config[command_name]
-        cooldown = int(section.get("cooldown", 3))
-        banned_roles = section.get("banned_roles", "[]")
-        reduce_tax_roles = section.get("reduce_tax_roles", "[]")
-        try:
-            banned_roles = eval(banned_roles)
-            reduce_tax_roles = eval(reduce_tax_roles)
-            if not isinstance(banned_roles, list) or not isinstance(reduce_tax_roles, list):
-                raise ValueError("banned_roles and reduce_tax_roles must be lists")
-        except Exception as e:
-            logger.error(f"Invalid roles format for {command_name}: {e}")
-            raise ValueError(f"Invalid roles format for {command_name}")
-
-        min_amount = int(section.get("min_amount", 0))
-        max_amount = int(section.get("max_amount", 1000))
-        tax_percentage = float(section.get("tax_percentage", 10))
-        reduce_tax_percentage = float(section.get("reduce_tax_percentage", 5))
-
-        if min_amount < 0 or max_amount < 0:
-            raise ValueError("min_amount and max_amount cannot be negative")
-        if max_amount != 0 and min_amount > max_amount:
-            raise ValueError("min_amount cannot be greater than max_amount")
-        if not (0 <= tax_percentage <= 100) or not (0 <= reduce_tax_percentage <= 100):
-            raise ValueError("tax_percentage and reduce_tax_percentage must be between 0 and 100")
-
-        logger.info(f"Loaded config for {command_name}: cooldown={cooldown}s, banned_roles={banned_roles}, reduce_tax_roles={reduce_tax_roles}, min_amount={min_amount}, max_amount={max_amount}, tax_percentage={tax_percentage}%, reduce_tax_percentage={reduce_tax_percentage}%")
-        
-        return {
-            "cooldown": cooldown,
-            "banned_roles": banned_roles,
-            "reduce_tax_roles": reduce_tax_roles,
-            "min_amount": min_amount,
-            "max_amount": max_amount,
-            "tax_percentage": tax_percentage,
-            "reduce_tax_percentage": reduce_tax_percentage,
-            "success_messages": GIVEMONEY_SUCCESS_MESSAGES,
-            "fail_messages": GIVEMONEY_FAIL_MESSAGES,
-            "insufficient_funds_messages": GIVEMONEY_INSUFFICIENT_FUNDS_MESSAGES,
-            "error_messages": GIVEMONEY_ERROR_MESSAGES,
-            "cooldown_messages": GIVEMONEY_COOLDOWN_MESSAGES,
-            "notice_messages": GIVEMONEY_NOTICE_MESSAGES,
-        }
-    except KeyError as e:
-        logger.error(f"Invalid config section for {command_name}: {e}")
-        raise ValueError(f"Invalid config section for {command_name}")
-    except Exception as e:
-        logger.error(f"Error parsing config for {command_name}: {e}")
-        raise ValueError(f"Error parsing config for {command_name}")
-
 class PayCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -177,7 +110,7 @@ class PayCog(commands.Cog):
 
         # Проверка конфигурации
         try:
-            config = get_command_config("Pay")
+            config = settings.pay()
         except ValueError as e:
             message = random.choice(GIVEMONEY_ERROR_MESSAGES).format(error=f"ошибка конфигурации: {str(e)}")
             embed = create_embed(
@@ -190,13 +123,13 @@ class PayCog(commands.Cog):
             return
 
         # Проверка кулдауна
-        if not await self.check_cooldown(ctx, "pay", config["cooldown"]):
+        if not await self.check_cooldown(ctx, "pay", config.cooldown):
             return
 
         # Проверка ролей
         user_roles = [role.id for role in ctx.author.roles]
-        banned_roles = config["banned_roles"]
-        reduce_tax_roles = config["reduce_tax_roles"]
+        banned_roles = config.banned_roles
+        reduce_tax_roles = config.reduce_tax_roles
 
         if any(role_id in banned_roles for role_id in user_roles):
             message = random.choice(GIVEMONEY_ERROR_MESSAGES).format(error="у вас есть роль, запрещающая перевод денег")
@@ -210,10 +143,10 @@ class PayCog(commands.Cog):
             return
 
         # Расчёт налога
-        fee_percent = config["tax_percentage"]
+        fee_percent = config.tax_percentage
         for role_id in user_roles:
             if role_id in reduce_tax_roles:
-                fee_percent = config["reduce_tax_percentage"]
+                fee_percent = config.reduce_tax_percentage
                 break
         fee = math.ceil(amount * (fee_percent / 100)) if isinstance(amount, int) else None
         amount_to_receive = amount - fee if isinstance(amount, int) and fee is not None else None
@@ -266,8 +199,8 @@ class PayCog(commands.Cog):
             logger.info(f"User {sender_id} tried to transfer invalid amount: {amount}")
             return
 
-        min_amount = config["min_amount"]
-        max_amount = config["max_amount"]
+        min_amount = config.min_amount
+        max_amount = config.max_amount
         if min_amount > 0 and amount < min_amount:
             message = random.choice(GIVEMONEY_ERROR_MESSAGES).format(error=f"минимальная сумма перевода: {min_amount} {currency}")
             embed = create_embed(
@@ -308,7 +241,7 @@ class PayCog(commands.Cog):
         sender_cash, _ = await get_user_balance(sender_id, guild_id)
         total_required = amount
         if sender_cash < total_required:
-            message = random.choice(config["insufficient_funds_messages"]).format(
+            message = random.choice(GIVEMONEY_INSUFFICIENT_FUNDS_MESSAGES).format(
                 required=total_required,
                 available=sender_cash,
                 currency=currency
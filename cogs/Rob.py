@@ -2,9 +2,8 @@ import disnake
 from disnake.ext import commands
 import random
 import logging
-import configparser
-import os
 import time
+from utils import settings
 from utils.database import get_user_balance, ensure_user_exists, apply_fine, get_cooldown, update_cooldown, rob_user
 from config import currency, ROB_SUCCESS_MESSAGES, ROB_FAIL_MESSAGES, ROB_ERROR_MESSAGES, ROB_COOLDOWN_MESSAGES, ROB_NOTICE_MESSAGES
 
@@ -12,20 +11,6 @@ from config import currency, ROB_SUCCESS_MESSAGES, ROB_FAIL_MESSAGES, ROB_ERROR_
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Чтение конфигурации из config.ini
-config = configparser.ConfigParser()
-config_file = "config.ini"
-
-if not os.path.exists(config_file):
-    logger.error(f"Config file {config_file} not found.")
-    raise FileNotFoundError(f"Config file {config_file} not found.")
-
-try:
-    config.read(config_file, encoding='utf-8')
-except Exception as e:
-    logger.error(f"Failed to read config.ini: {e}")
-    raise
-
 # Резервные сообщения
 FALLBACK_SUCCESS_MESSAGES = ["Успех! Ты украл {amount} {currency} у {target}!"] 
 FALLBACK_FAIL_MESSAGES = ["Неудача! Потеряно {amount} {currency} при попытке ограбить {target}."]
@@ -33,55 +18,6 @@ FALLBACK_ERROR_MESSAGES = ["Ошибка: {error}"]
 FALLBACK_COOLDOWN_MESSAGES = ["Команда {command_name} на кулдауне! Попробуйте снова через {minutes} мин {seconds} сек."]
 FALLBACK_NOTICE_MESSAGES = ["Уведомление: {error}"]
 
-def get_command_config(command_name):
-    """Получение настроек для команды из config.ini."""
-    try:
-        section = config[command_name]
-        min_fine = float(section.get("min_fine", 10))
-        max_fine = float(section.get("max_fine", 25))
-        cooldown = int(section.get("cooldown", 15))
-        immune_role = section.get("immune_role", "[]")
-        
-        try:
-            immune_role = eval(immune_role)
-            if not isinstance(immune_role, list):
-                raise ValueError("immune_role must be a list")
-        except Exception as e:
-            logger.error(f"Invalid immune_role format for {command_name}: {e}")
-            raise ValueError(f"Invalid immune_role format for {command_name}")
-
-        if not (0 <= min_fine <= 100) or not (0 <= max_fine <= 100):
-            raise ValueError("min_fine and max_fine must be between 0 and 100")
-        if min_fine > max_fine:
-            raise ValueError("min_fine cannot be greater than max_fine")
-        if cooldown < 0:
-            raise ValueError("cooldown cannot be negative")
-
-        success_msgs = getattr(globals().get('config', {}), 'ROB_SUCCESS_MESSAGES', FALLBACK_SUCCESS_MESSAGES)
-        fail_msgs = getattr(globals().get('config', {}), 'ROB_FAIL_MESSAGES', FALLBACK_FAIL_MESSAGES)
-        error_msgs = getattr(globals().get('config', {}), 'ROB_ERROR_MESSAGES', FALLBACK_ERROR_MESSAGES)
-        cooldown_msgs = getattr(globals().get('config', {}), 'ROB_COOLDOWN_MESSAGES', FALLBACK_COOLDOWN_MESSAGES)
-        notice_msgs = getattr(globals().get('config', {}), 'ROB_NOTICE_MESSAGES', FALLBACK_NOTICE_MESSAGES)
-
-        logger.info(f"Loaded config for {command_name}: min_fine={min_fine}%, max_fine={max_fine}%, cooldown={cooldown}s, immune_role={immune_role}")
-        return {
-            "min_fine_percent": min_fine,
-            "max_fine_percent": max_fine,
-            "cooldown": cooldown,
-            "immune_role": immune_role,
-            "success_messages": success_msgs,
-            "fail_messages": fail_msgs,
-            "error_messages": error_msgs,
-            "cooldown_messages": cooldown_msgs,
-            "notice_messages": notice_msgs
-        }
-    except KeyError as e:
-        logger.error(f"Invalid config section for {command_name}: {e}")
-        raise ValueError(f"Invalid config section for {command_name}")
-    except Exception as e:
-        logger.error(f"Error parsing config for {command_name}: {e}")
-        raise ValueError(f"Error parsing config for {command_name}")
-
 class RobCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -154,7 +90,7 @@ class RobCog(commands.Cog):
             return
 
         try:
-            config = get_command_config("Rob")
+            config = settings.rob()
         except ValueError as e:
             embed.title = "🚫 Ошибка"
             embed.description = random.choice(ROB_ERROR_MESSAGES).format(error=f"ошибка конфигурации: {str(e)}")
@@ -163,15 +99,14 @@ class RobCog(commands.Cog):
             return
 
         # Проверка защищённых ролей
-        target_roles = [role.id for role in user.roles]
-        if any(role_id in config["immune_role"] for role_id in target_roles):
+        if not config.immune_roles.isdisjoint(role.id for role in user.roles):
             embed.title = "🚫 Ошибка"
             embed.description = random.choice(ROB_ERROR_MESSAGES).format(error="нельзя ограбить пользователя с защищённой ролью")
             await ctx.send(embed=embed)
             logger.info(f"User {robber_id} tried to rob {target_id} with immune role")
             return
 
-        if not await self.check_cooldown(ctx, "rob", config["cooldown"]):
+        if not await self.check_cooldown(ctx, "rob", config.cooldown):
             return
 
         try:
@@ -206,7 +141,7 @@ class RobCog(commands.Cog):
                 await update_cooldown(robber_id, guild_id, "rob", int(time.time()))
                 logger.info(f"User {robber_id} successfully robbed {target_id} in guild {guild_id}: stole {stolen_amount}")
             else:
-                fine_percent = random.uniform(config["min_fine_percent"], config["max_fine_percent"])
+                fine_percent = random.uniform(config.min_fine_percent, config.max_fine_percent)
                 fine = int(total_robber * (fine_percent / 100))
                 fine = max(0, fine)
                 new_robber_cash, robber_bank = await apply_fine(robber_id, guild_id, fine)
@@ -2,11 +2,11 @@ import disnake
 from disnake.ext import commands
 import random
 import logging
-import configparser
-import os
 import time
 import asyncio
-from utils.database import get_user_balance, update_cash, ensure_user_exists, create_roulette, add_roulette_bet, get_active_roulette, set_roulette_result, save_roulette_history, delete_roulette
+from utils import settings
+from utils.roulette import SLOTS, classify_space, payout
+from utils.database import get_user_balance, unit_of_work, create_roulette, place_roulette_bet, get_active_roulette, set_roulette_result, settle_roulette, get_open_roulettes, refund_roulettes
 from config import (
     currency, ROULETTE_INFO, ROULETTE_IMAGE_URL,
     ROULETTE_SUCCESS_MESSAGES, ROULETTE_FAIL_MESSAGES, ROULETTE_NO_WINNERS,
@@ -18,67 +18,18 @@ from config import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Чтение конфигурации из games.ini
-config = configparser.ConfigParser()
-config_file = "games.ini"
-
-if not os.path.exists(config_file):
-    logger.error(f"Config file {config_file} not found.")
-    raise FileNotFoundError(f"Config file {config_file} not found.")
-
-try:
-    config.read(config_file, encoding='utf-8')
-except Exception as e:
-    logger.error(f"Failed to read games.ini: {e}")
-    raise
-
 def get_roulette_config():
-    """Получение настроек рулетки из games.ini."""
-    try:
-        section = config["Roulette"]
-        duration = int(section.get("duration", 30))
-        min_bet = int(section.get("min_bet", 100))
-        if duration < 10 or min_bet < 1:
-            raise ValueError("duration >= 10s, min_bet >= 1")
-        logger.info(f"Loaded Roulette config: duration={duration}s, min_bet={min_bet}")
-        return {"duration": duration, "min_bet": min_bet}
-    except KeyError as e:
-        logger.error(f"Invalid config section for Roulette: {e}")
-        raise ValueError(f"Invalid config section for Roulette")
-    except Exception as e:
-        logger.error(f"Error parsing Roulette config: {e}")
-        raise ValueError(f"Error parsing Roulette config")
+    """Настройки рулетки из общего реестра (utils.settings)."""
+    return settings.roulette()
 
 class RouletteCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.slots = {
-            '0': 'green', '1': 'red', '2': 'black', '3': 'red', '4': 'black', '5': 'red', '6': 'black',
-            '7': 'red', '8': 'black', '9': 'red', '10': 'black', '11': 'red', '12': 'black', '13': 'red',
-            '14': 'black', '15': 'red', '16': 'black', '17': 'red', '18': 'black', '19': 'red', '20': 'black',
-            '21': 'red', '22': 'black', '23': 'red', '24': 'black', '25': 'red', '26': 'black', '27': 'red',
-            '28': 'black', '29': 'red', '30': 'black', '31': 'red', '32': 'black', '33': 'red', '34': 'black',
-            '35': 'red', '36': 'black'
-        }
-        self.valid_spaces = {
-            "numbers": set(str(i) for i in range(0, 37)),
-            "dozens": {"1-12", "13-24", "25-36"},
-            "columns": {
-                "1st": {1, 4, 7, 10, 13, 16, 19, 22, 25, 28, 31, 34},
-                "2nd": {2, 5, 8, 11, 14, 17, 20, 23, 26, 29, 32, 35},
-                "3rd": {3, 6, 9, 12, 15, 18, 21, 24, 27, 30, 33, 36}
-            },
-            "halves": {"1-18", "19-36"},
-            "parity": {"odd", "even"},
-            "colors": {"red", "black"}
-        }
-        self.multipliers = {
-            "num    ber": 36, "dozen": 3, "column": 3, "half": 2, "parity": 2, "color": 2
-        }
+        self.slots = SLOTS
         self.channel_locks = {}  # Блокировки для каналов
         self.roulette_tasks = {}  # Задачи завершения рулетки
 
-    async def validate_bet_and_space(self, user_id: int, guild_id: int, bet: str, space: str, config: dict) -> tuple:
+    async def validate_bet_and_space(self, user_id: int, guild_id: int, bet: str, space: str, config: settings.RouletteSettings) -> tuple:
         """Валидация ставки и места, возврат суммы, места и типа или ошибки."""
         logger.info(f"Validating bet: user={user_id}, bet={bet}, space={space}")
         try:
@@ -100,68 +51,24 @@ class RouletteCog(commands.Cog):
         if amount > cash:
             logger.warning(f"Insufficient cash: bet={amount}, cash={cash}")
             return None, None, "insufficient_cash"
-        if amount < config["min_bet"]:
-            logger.warning(f"Bet below minimum: bet={amount}, min_bet={config['min_bet']}")
+        if amount < config.min_bet:
+            logger.warning(f"Bet below minimum: bet={amount}, min_bet={config.min_bet}")
             return None, None, "min_bet"
 
         space = space.lower().strip()
         logger.info(f"Validating space: {space}")
-        if space in self.valid_spaces["numbers"]:
-            return amount, space, "number"
-        if space in self.valid_spaces["dozens"]:
-            return amount, space, "dozen"
-        if space in self.valid_spaces["columns"]:
-            return amount, space, "column"
-        if space in self.valid_spaces["halves"]:
-            return amount, space, "half"
-        if space in self.valid_spaces["parity"]:
-            return amount, space, "parity"
-        if space in self.valid_spaces["colors"]:
-            return amount, space, "color"
+        space_type = classify_space(space)
+        if space_type is not None:
+            return amount, space, space_type
         logger.warning(f"Invalid space: {space}")
         return None, None, "invalid_space"
 
-    async def process_bet(self, user_id: int, guild_id: int, amount: int, space: str, space_type: str, result: str) -> tuple:
-        """Обработка ставки: проверка выигрыша и начисление."""
-        try:
-            await ensure_user_exists(user_id, guild_id)
-            cash, _ = await get_user_balance(user_id, guild_id)
-
-            win = False
-            multiplier = self.multipliers[space_type]
-            if space_type == "number":
-                win = space == result
-            elif space_type == "dozen":
-                result_num = int(result)
-                ranges = {"1-12": range(1, 13), "13-24": range(13, 25), "25-36": range(25, 37)}
-                win = result_num in ranges[space]
-            elif space_type == "column":
-                result_num = int(result)
-                win = result_num in self.valid_spaces["columns"][space]
-            elif space_type == "half":
-                result_num = int(result)
-                ranges = {"1-18": range(1, 19), "19-36": range(19, 37)}
-                win = result_num in ranges[space]
-            elif space_type == "parity":
-                result_num = int(result)
-                win = (result_num % 2 == 1) if space == "odd" else (result_num % 2 == 0)
-            elif space_type == "color":
-                win = self.slots[result] == space
-
-            winnings = amount * multiplier if win else 0
-            if winnings > 0:
-                await update_cash(user_id, guild_id, winnings)
-            new_cash, _ = await get_user_balance(user_id, guild_id)
-
-            logger.info(f"Processed bet: user={user_id}, space={space}, win={win}, winnings={winnings}, new_cash={new_cash}")
-            return (win, winnings, new_cash), None
-        except Exception as e:
-            logger.error(f"Error processing bet for user {user_id} in guild {guild_id}: {e}")
-            return None, str(e)
-
-    async def complete_roulette(self, ctx, roulette_id, channel_id, guild_id, duration):
-        """Завершение рулетки: ожидание, обработка ставок, отправка результата."""
-        user_id = ctx.author.id
+    async def complete_roulette(self, channel, roulette_id, channel_id, guild_id, duration, author=None):
+        """
+        Завершение рулетки: ожидание, обработка ставок, отправка результата.
+        author — запустивший раунд (None для раундов, восстановленных после перезапуска).
+        """
+        mention = f"{author.mention} " if author else ""
         start_time = time.time()
         logger.info(f"Starting roulette for roulette_id={roulette_id}, channel={channel_id} at {start_time}")
         try:
@@ -170,72 +77,108 @@ class RouletteCog(commands.Cog):
             await asyncio.sleep(duration)
             logger.info(f"Finished waiting for roulette_id={roulette_id}")
 
-            roulette = await get_active_roulette(channel_id)
-            if not roulette or roulette["id"] != roulette_id:
-                logger.warning(f"Roulette {roulette_id} not found or mismatched for channel {channel_id}")
-                embed = disnake.Embed(
-                    title="Ошибка",
-                    description=f"{ctx.author.mention} Рулетка не найдена или завершена.",
-                    color=0x2F3136
-                )
-                embed.set_footer(text=f"ID: {user_id}")
-                await ctx.send(embed=embed)
-                return
-
-            result = roulette["result"] or random.choice(list(self.slots.keys()))
-            result_prompt = f"🎰 Шар остановился на: **{self.slots[result]} {result}**!\n"
-            winners = []
-            results = {}
-
-            for user_id, user_bets in roulette["bets"].items():
-                user_mention = f"<@{user_id}>"
-                results[user_id] = {}
-                for amount, space, space_type in user_bets:
-                    result_data, error = await self.process_bet(user_id, guild_id, amount, space, space_type, result)
-                    if error:
-                        embed = disnake.Embed(
-                            title="Ошибка",
-                            description=ROULETTE_PROCESS_ERROR.format(error=error),
-                            color=0x2F3136
-                        )
-                        embed.set_footer(text=f"ID: {user_id}")
-                        await ctx.send(embed=embed)
-                        continue
-
-                    win, winnings, new_cash = result_data
-                    results[user_id][space] = winnings
-                    if win:
-                        message = random.choice(ROULETTE_SUCCESS_MESSAGES).format(
-                            mention=user_mention, amount=winnings, space=space, currency=currency
-                        )
-                        winners.append(message)
+            # Под блокировкой канала: ставка не может попасть в уже рассчитанный раунд
+            if channel_id not in self.channel_locks:
+                self.channel_locks[channel_id] = asyncio.Lock()
+            async with self.channel_locks[channel_id]:
+                roulette = await get_active_roulette(channel_id)
+                if not roulette or roulette["id"] != roulette_id:
+                    logger.warning(f"Roulette {roulette_id} not found or mismatched for channel {channel_id}")
+                    embed = disnake.Embed(
+                        title="Ошибка",
+                        description=f"{mention}Рулетка не найдена или завершена.",
+                        color=0x2F3136
+                    )
+                    if author:
+                        embed.set_footer(text=f"ID: {author.id}")
+                    await channel.send(embed=embed)
+                    return
+
+                result = roulette["result"] or random.choice(list(self.slots.keys()))
+                result_prompt = f"🎰 Шар остановился на: **{self.slots[result]} {result}**!\n"
+                winners = []
+                settled = []
+
+                # Выплаты считаются в памяти и применяются одной транзакцией
+                for user_id, user_bets in roulette["bets"].items():
+                    user_mention = f"<@{user_id}>"
+                    for amount, space, space_type in user_bets:
+                        winnings = payout(amount, space, space_type, result)
+                        settled.append((user_id, amount, space, space_type, winnings))
+                        if winnings:
+                            message = random.choice(ROULETTE_SUCCESS_MESSAGES).format(
+                                mention=user_mention, amount=winnings, space=space, currency=currency
+                            )
+                            winners.append(message)
+
+                await settle_roulette(roulette["id"], guild_id, result, int(time.time()), settled)
 
             if winners:
                 result_prompt += "Победители:\n" + "\n".join(winners)
             else:
                 result_prompt += ROULETTE_NO_WINNERS
 
-            await ctx.send(result_prompt)
+            await channel.send(result_prompt)
 
-            await save_roulette_history(roulette["id"], result, int(time.time()), roulette["bets"], results)
-            await delete_roulette(roulette["id"])
             end_time = time.time()
             logger.info(f"Completed roulette {roulette_id}, result={result}, duration={end_time - start_time:.2f}s")
         except Exception as e:
             embed = disnake.Embed(
                 title="Ошибка",
-                description=f"{ctx.author.mention} Ошибка завершения рулетки: {str(e)}",
+                description=f"{mention}Ошибка завершения рулетки: {str(e)}",
                 color=0x2F3136
             )
-            embed.set_footer(text=f"ID: {user_id}")
-            await ctx.send(embed=embed)
+            if author:
+                embed.set_footer(text=f"ID: {author.id}")
+            await channel.send(embed=embed)
             logger.error(f"Error completing roulette for channel {channel_id}: {e}")
         finally:
-            # Очистка задачи и блокировки
+            # Очистка задачи (блокировка канала остаётся: её могут ждать новые ставки)
             if channel_id in self.roulette_tasks:
                 del self.roulette_tasks[channel_id]
-            if channel_id in self.channel_locks:
-                del self.channel_locks[channel_id]
+
+    async def recover_rounds(self):
+        """
+        Восстановление после перезапуска: раунды, время которых вышло, пока бот
+        был выключен, возвращаются одной транзакцией; живые получают новую
+        задачу завершения. Раунды с уже работающей задачей не трогаются,
+        поэтому повторный вызов (переподключение) безопасен.
+        """
+        now = time.time()
+        expired = []
+        live = []
+        for roulette in get_open_roulettes():
+            if roulette["channel_id"] in self.roulette_tasks:
+                continue
+            channel = self.bot.get_channel(roulette["channel_id"])
+            if channel is None or roulette["end_time"] <= now:
+                expired.append((roulette, channel))
+            else:
+                live.append((roulette, channel))
+
+        if expired:
+            try:
+                refunded = await refund_roulettes([roulette for roulette, _ in expired], int(now))
+            except Exception as e:
+                # Раунды остались в БД и памяти — следующий вызов попробует снова
+                logger.error(f"Error refunding expired roulettes: {e}")
+                expired = []
+            else:
+                logger.info(f"Refunded {refunded} bets from {len(expired)} expired roulettes")
+            for roulette, channel in expired:
+                if channel is None:
+                    continue
+                try:
+                    await channel.send("🎰 Рулетка была прервана перезапуском бота, ставки возвращены.")
+                except disnake.HTTPException as e:
+                    logger.warning(f"Failed to notify channel {roulette['channel_id']} about refund: {e}")
+
+        for roulette, channel in live:
+            channel_id = roulette["channel_id"]
+            self.roulette_tasks[channel_id] = asyncio.create_task(
+                self.complete_roulette(channel, roulette["id"], channel_id, roulette["guild_id"], max(0, roulette["end_time"] - now))
+            )
+            logger.info(f"Rescheduled roulette {roulette['id']} in channel {channel_id}")
 
     @commands.command(name="roulette", aliases=["r"])
     async def roulette(self, ctx, bet: str, space: str):
@@ -290,7 +233,7 @@ class RouletteCog(commands.Cog):
             try:
                 cash, _ = await get_user_balance(user_id, guild_id) if space_type_or_error != "database_error" else (0, 0)
                 error_msg = ROULETTE_ERROR_MESSAGES[space_type_or_error].format(
-                    cash=cash, min_bet=config["min_bet"], currency=currency, roulette_info=ROULETTE_INFO
+                    cash=cash, min_bet=config.min_bet, currency=currency, roulette_info=ROULETTE_INFO
                 )
             except Exception as e:
                 error_msg = f"Ошибка обработки: {space_type_or_error} (форматирование: {str(e)})"
@@ -305,44 +248,15 @@ class RouletteCog(commands.Cog):
             return
         space_type = space_type_or_error
 
-        try:
-            logger.info(f"Ensuring user exists: user={user_id}, guild={guild_id}")
-            await ensure_user_exists(user_id, guild_id)
-            logger.info(f"Fetching balance for user={user_id}")
-            cash, _ = await get_user_balance(user_id, guild_id)
-            logger.info(f"User {user_id} cash: {cash}, attempting to deduct {amount}")
-            if cash < amount:
-                error_msg = ROULETTE_ERROR_MESSAGES["insufficient_cash"].format(cash=cash, currency=currency)
-                embed = disnake.Embed(
-                    title="Ошибка",
-                    description=f"{ctx.author.mention} {error_msg}",
-                    color=0x2F3136
-                )
-                embed.set_footer(text=f"ID: {user_id}")
-                await ctx.send(embed=embed)
-                logger.warning(f"Insufficient cash for user {user_id}: cash={cash}, amount={amount}")
-                return
-            await update_cash(user_id, guild_id, -amount)
-            logger.info(f"Deducted {amount} cash for user {user_id}")
-        except Exception as e:
-            embed = disnake.Embed(
-                title="Ошибка",
-                description=f"{ctx.author.mention} {ROULETTE_CASH_ERROR.format(currency=currency)}",
-                color=0x2F3136
-            )
-            embed.set_footer(text=f"ID: {user_id}")
-            await ctx.send(embed=embed)
-            logger.error(f"Error deducting cash for user {user_id}: {e}")
-            return
-
         # Получаем или создаём блокировку для канала
         if channel_id not in self.channel_locks:
             self.channel_locks[channel_id] = asyncio.Lock()
         async with self.channel_locks[channel_id]:
             try:
                 roulette = await get_active_roulette(channel_id)
-                if roulette and time.time() > roulette["end_time"]:
-                    await delete_roulette(roulette["id"])
+                if roulette and time.time() > roulette["end_time"] and channel_id not in self.roulette_tasks:
+                    # Раунд без задачи завершения (например, после сбоя задачи): ставки возвращаются
+                    await refund_roulettes([roulette], int(time.time()))
                     roulette = None
 
                 if roulette:
@@ -356,11 +270,9 @@ class RouletteCog(commands.Cog):
                         )
                         embed.set_footer(text=f"ID: {user_id}")
                         await ctx.send(embed=embed)
-                        # Вернуть деньги
-                        await update_cash(user_id, guild_id, amount)
                         return
-                    await add_roulette_bet(roulette["id"], user_id, amount, validated_space, space_type)
-                    cash, _ = await get_user_balance(user_id, guild_id)
+                    # Списание и запись в журнал ставок — один запрос, остальное в памяти
+                    await place_roulette_bet(roulette["id"], user_id, guild_id, amount, validated_space, space_type)
                     embed = disnake.Embed(
                         title="Рулетка",
                         description=ROULETTE_BET_SUCCESS.format(
@@ -375,15 +287,16 @@ class RouletteCog(commands.Cog):
                     return  # Не создаём новую задачу завершения
 
                 logger.info(f"Creating new roulette for channel={channel_id}")
-                roulette_id = await create_roulette(channel_id, guild_id, int(time.time() + config["duration"]))
-                logger.info(f"Adding bet for roulette_id={roulette_id}, user={user_id}")
-                await add_roulette_bet(roulette_id, user_id, amount, validated_space, space_type)
-                cash, _ = await get_user_balance(user_id, guild_id)
+                # Раунд создаётся только вместе с первой ставкой
+                async with unit_of_work():
+                    roulette_id = await create_roulette(channel_id, guild_id, int(time.time() + config.duration))
+                    logger.info(f"Adding bet for roulette_id={roulette_id}, user={user_id}")
+                    await place_roulette_bet(roulette_id, user_id, guild_id, amount, validated_space, space_type)
                 embed = disnake.Embed(
                     title="Рулетка",
                     description=ROULETTE_START.format(
                         mention=ctx.author.mention, amount=amount, currency=currency,
-                        space=validated_space, duration=config["duration"]
+                        space=validated_space, duration=config.duration
                     ),
                     color=0x2F3136
                 )
@@ -394,8 +307,19 @@ class RouletteCog(commands.Cog):
                 # Создаём задачу завершения только для новой рулетки
                 if channel_id not in self.roulette_tasks:
                     self.roulette_tasks[channel_id] = asyncio.create_task(
-                        self.complete_roulette(ctx, roulette_id, channel_id, guild_id, config["duration"])
+                        self.complete_roulette(ctx.channel, roulette_id, channel_id, guild_id, config.duration, ctx.author)
                     )
+            except ValueError:
+                cash, _ = await get_user_balance(user_id, guild_id)
+                error_msg = ROULETTE_ERROR_MESSAGES["insufficient_cash"].format(cash=cash, currency=currency)
+                embed = disnake.Embed(
+                    title="Ошибка",
+                    description=f"{ctx.author.mention} {error_msg}",
+                    color=0x2F3136
+                )
+                embed.set_footer(text=f"ID: {user_id}")
+                await ctx.send(embed=embed)
+                logger.warning(f"Insufficient cash for user {user_id}: cash={cash}, amount={amount}")
             except Exception as e:
                 embed = disnake.Embed(
                     title="Ошибка",
@@ -405,9 +329,6 @@ class RouletteCog(commands.Cog):
                 embed.set_footer(text=f"ID: {user_id}")
                 await ctx.send(embed=embed)
                 logger.error(f"Error starting roulette for user {user_id} in channel {channel_id}: {e}")
-                # Вернуть деньги при ошибке
-                await update_cash(user_id, guild_id, amount)
-                return
 
     @commands.command(name="roulette-info")
     async def roulette_info(self, ctx):
@@ -1,6 +1,6 @@
 import disnake
 from disnake.ext import commands
-from utils.database import get_user_balance, update_cash, get_cooldown, update_cooldown, get_shop_items, get_shop_item_by_id, get_shop_item_by_name, add_to_inventory
+from utils.database import get_user_balance, update_cash, get_cooldown, update_cooldown, get_shop_items, get_shop_item_by_id, get_shop_item_by_name, add_to_inventory, unit_of_work, enqueue_role_changes
 import time
 import asyncio
 from config import currency
@@ -278,6 +278,17 @@ class Shop(commands.Cog):
                     await ctx.send(embed=embed)
                     logger.info(f"Buy command completed (role already owned) in {time.time() - start_time:.2f} seconds")
                     return
+
+                # Роль выдаётся уже после оплаты, поэтому права бота проверяем заранее
+                me = ctx.guild.me
+                if not me.guild_permissions.manage_roles or role >= me.top_role:
+                    embed = disnake.Embed(
+                        description=f"<@{ctx.author.id}>, у бота нет прав для выдачи роли '{name}'.",
+                        color=0xFF4500
+                    )
+                    await ctx.send(embed=embed)
+                    logger.info(f"Buy command completed (forbidden) in {time.time() - start_time:.2f} seconds")
+                    return
             except ValueError:
                 logger.error(f"Некорректный external_id для роли: {external_id}")
                 embed = disnake.Embed(
@@ -289,11 +300,18 @@ class Shop(commands.Cog):
                 return
 
         try:
-            new_cash = await update_cash(ctx.author.id, ctx.guild.id, -price)
-            await update_cooldown(ctx.author.id, ctx.guild.id, "buy", current_time)
-            logger.debug(f"Balance updated and cooldown set: {time.time() - start_time:.2f} seconds")
+            async with unit_of_work():
+                new_cash = await update_cash(ctx.author.id, ctx.guild.id, -price)
+                await update_cooldown(ctx.author.id, ctx.guild.id, "buy", current_time)
+                # Оплата и выдача товара — одна транзакция: при сбое не спишется ничего
+                if item_type == "role":
+                    # Роль выдаст воркер очереди после коммита
+                    await enqueue_role_changes([(ctx.author.id, ctx.guild.id, role_id, "add")], reason="Покупка в магазине")
+                else:
+                    await add_to_inventory(ctx.author.id, item_id)
+            logger.debug(f"Balance, cooldown and item updated: {time.time() - start_time:.2f} seconds")
         except Exception as e:
-            logger.error(f"Ошибка обновления баланса или кулдауна: {e}")
+            logger.error(f"Ошибка обработки покупки: {e}")
             embed = disnake.Embed(
                 description=f"<@{ctx.author.id}>, не удалось обработать покупку. Попробуйте снова.",
                 color=0xFF4500
@@ -303,32 +321,9 @@ class Shop(commands.Cog):
             return
 
         if item_type == "role":
-            try:
-                await ctx.author.add_roles(role)
-                logger.debug(f"Role assigned: {time.time() - start_time:.2f} seconds")
-                message = f"<@{ctx.author.id}>, вы успешно купили **{name}** за {price} {currency}!\nРоль <@&{role_id}> выдана."
-            except disnake.Forbidden:
-                embed = disnake.Embed(
-                    description=f"<@{ctx.author.id}>, у бота нет прав для выдачи роли '{name}'.",
-                    color=0xFF4500
-                )
-                await ctx.send(embed=embed)
-                logger.info(f"Buy command completed (forbidden) in {time.time() - start_time:.2f} seconds")
-                return
+            message = f"<@{ctx.author.id}>, вы успешно купили **{name}** за {price} {currency}!\nРоль <@&{role_id}> будет выдана в течение нескольких секунд."
         else:
-            try:
-                await add_to_inventory(ctx.author.id, item_id)
-                logger.debug(f"Inventory updated: {time.time() - start_time:.2f} seconds")
-                message = f"<@{ctx.author.id}>, вы успешно купили **{name}** за {price} {currency}!\n{'Кейс' if item_type == 'case' else 'Предмет'} добавлен в инвентарь. Проверьте с помощью `.inv`."
-            except Exception as e:
-                logger.error(f"Ошибка добавления в инвентарь: {e}")
-                embed = disnake.Embed(
-                    description=f"<@{ctx.author.id}>, не удалось добавить товар в инвентарь. Попробуйте снова.",
-                    color=0xFF4500
-                )
-                await ctx.send(embed=embed)
-                logger.info(f"Buy command failed in {time.time() - start_time:.2f} seconds")
-                return
+            message = f"<@{ctx.author.id}>, вы успешно купили **{name}** за {price} {currency}!\n{'Кейс' if item_type == 'case' else 'Предмет'} добавлен в инвентарь. Проверьте с помощью `.inv`."
 
         embed = disnake.Embed(
             description=message,
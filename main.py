@@ -6,7 +6,14 @@ import os
 import traceback
 
 from config import Token, Prefix
-from utils.database import init_db, get_pool
+from utils.settings import get_settings, start_settings_watcher
+from utils.database import (
+    init_db, get_pool, warm_cooldowns, start_cooldown_flusher, flush_cooldowns,
+    warm_active_games, start_active_game_flusher, flush_active_games, warm_roulettes,
+    start_history_flusher, flush_history
+)
+from utils.role_outbox import start_role_outbox
+from utils.audit import start_audit, close_audit, set_audit_reason
 
 activity = disnake.Game(name="Казино | .help")
 
@@ -14,13 +21,37 @@ intents = disnake.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(
+class CasinoBot(commands.Bot):
+    async def close(self):
+        # Дописываем в БД всё, что ещё висит в памяти
+        try:
+            await flush_cooldowns()
+        except Exception as e:
+            print(f"Cooldown flush error: {e}")
+        try:
+            await flush_active_games()
+        except Exception as e:
+            print(f"Active games flush error: {e}")
+        try:
+            await flush_history()
+        except Exception as e:
+            print(f"History flush error: {e}")
+        # Отправляем накопленный аудит балансов
+        await close_audit()
+        await super().close()
+
+bot = CasinoBot(
     intents=intents,
     activity=activity,
     command_prefix=Prefix
 )
 # bot.remove_command("help")
 
+@bot.before_invoke
+async def audit_command_reason(ctx):
+    # Изменения баланса внутри команды попадают в аудит с её именем
+    set_audit_reason(f"Команда .{ctx.command.qualified_name}")
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, (commands.CommandNotFound,)):
@@ -42,6 +73,9 @@ async def keepalive():
         # пинг каждые 2 минуты
         await asyncio.sleep(120)
 
+# Настройки загружаются один раз до подключения когов
+get_settings()
+
 for file in os.listdir('./cogs'):
     if file.endswith('.py') and file != '__init__.py':
         try:
@@ -55,6 +89,26 @@ for file in os.listdir('./cogs'):
 async def on_ready():
     print('Бот готов пахать')
     await init_db()
+    # Кулдауны читаются из памяти и периодически сбрасываются в БД
+    await warm_cooldowns()
+    start_cooldown_flusher()
+    # Активные игры блэкджека обслуживаются из памяти, БД — для восстановления
+    await warm_active_games()
+    start_active_game_flusher()
+    # История игр, рулетки и переводов пишется пачками в фоне
+    start_history_flusher()
+    # Открытые раунды рулетки тоже живут в памяти
+    await warm_roulettes()
+    # Раунды, прерванные перезапуском: истёкшие возвращаются, живые доигрываются
+    roulette_cog = bot.get_cog("RouletteCog")
+    if roulette_cog:
+        await roulette_cog.recover_rounds()
+    # Аудит изменений баланса уходит в webhook пачками в фоне
+    start_audit()
+    # Выдача и снятие ролей из очереди role_outbox (в т.ч. оставшихся с прошлого запуска)
+    start_role_outbox(bot)
+    # config.ini / games.ini перечитываются при изменении файлов
+    start_settings_watcher()
     # Запускаем keep-alive, чтобы база не приостанавливалась
     bot.loop.create_task(keepalive())
     print('База данных определена и keep-alive запущен')
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+
+import aiohttp
+
+from config import audit_url, make_audit_payload
+
+# ------------------------
+#  Настройка логирования
+# ------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ------------------------
+#  Аудит изменений баланса (webhook)
+# ------------------------
+# utils.database сообщает сюда о каждом изменении баланса после COMMIT;
+# события копятся в ограниченном буфере и уходят в webhook пачками
+# в фоне, не задерживая команды.
+
+# Максимум неотправленных событий; сверх него новые события отбрасываются
+AUDIT_BUFFER_SIZE = 5000
+# Лимит Discord: эмбедов в одном сообщении webhook
+AUDIT_EMBEDS_PER_MESSAGE = 10
+# Как часто отправляется неполная пачка (секунды)
+AUDIT_FLUSH_INTERVAL = 2
+# Попыток отправить одно сообщение при сетевых ошибках и 5xx
+AUDIT_MAX_RETRIES = 5
+# Сколько ждать отправки остатка при остановке бота (секунды)
+AUDIT_SHUTDOWN_TIMEOUT = 10
+
+AUDIT_ACTION = "Обновление баланса"
+DEFAULT_REASON = "Изменение баланса"
+
+# Причина по умолчанию для изменений в текущей задаче (обычно — вызванная команда)
+_audit_reason = contextvars.ContextVar("audit_reason", default=None)
+
+# (guild_id, user_id, reason) -> [cash_change, bank_change]; повторные события
+# с тем же ключом до отправки суммируются
+_pending = OrderedDict()
+_dropped = 0
+_wakeup = None
+_audit_task = None
+_session = None
+
+def set_audit_reason(reason: str):
+    """
+    Задаёт причину для следующих изменений баланса в текущей задаче.
+    """
+    _audit_reason.set(reason)
+
+def audit_balance(user_id: int, guild_id: int, cash_change: int, bank_change: int, reason: str = None):
+    """
+    Ставит изменение баланса в очередь аудита. Не блокирует и не бросает:
+    при выключенном webhook событие игнорируется, при переполнении — отбрасывается.
+    """
+    global _dropped
+    if not audit_url or (not cash_change and not bank_change):
+        return
+    key = (guild_id, user_id, reason or _audit_reason.get() or DEFAULT_REASON)
+    entry = _pending.get(key)
+    if entry is not None:
+        entry[0] += cash_change
+        entry[1] += bank_change
+        return
+    if len(_pending) >= AUDIT_BUFFER_SIZE:
+        _dropped += 1
+        return
+    _pending[key] = [cash_change, bank_change]
+    if len(_pending) >= AUDIT_EMBEDS_PER_MESSAGE and _wakeup is not None:
+        _wakeup.set()
+
+def _restore(batch: list):
+    """Возвращает неотправленную пачку в начало буфера."""
+    for key, (cash_change, bank_change) in reversed(batch):
+        entry = _pending.setdefault(key, [0, 0])
+        entry[0] += cash_change
+        entry[1] += bank_change
+        _pending.move_to_end(key, last=False)
+
+def _build_payload(batch: list) -> dict:
+    embeds = []
+    user_ids = []
+    for (guild_id, user_id, reason), (cash_change, bank_change) in batch:
+        # Изменения, взаимно погасившиеся до отправки, не показываем
+        if not cash_change and not bank_change:
+            continue
+        embeds.extend(make_audit_payload(AUDIT_ACTION, user_id, cash_change, bank_change, reason)["embeds"])
+        user_ids.append(str(user_id))
+    if not embeds:
+        return None
+    return {"content": " ".join(dict.fromkeys(user_ids)), "embeds": embeds}
+
+async def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession()
+    return _session
+
+async def _post(payload: dict):
+    """
+    Отправляет одно сообщение в webhook с учётом лимитов Discord:
+    на 429 ждёт retry_after, при исчерпанном бакете (X-RateLimit-Remaining: 0)
+    ждёт X-RateLimit-Reset-After. Сетевые ошибки и 5xx повторяются с паузой,
+    остальные 4xx логируются, сообщение отбрасывается.
+    """
+    for attempt in range(AUDIT_MAX_RETRIES):
+        delay = min(60, 2 ** attempt)
+        try:
+            session = await _get_session()
+            async with session.post(audit_url, json=payload) as resp:
+                if resp.status == 429:
+                    data = await resp.json(content_type=None)
+                    delay = float(data.get("retry_after", resp.headers.get("Retry-After", 1)))
+                elif resp.status >= 500:
+                    logger.warning(f"Audit webhook: HTTP {resp.status}, повтор через {delay} с")
+                elif resp.status >= 400:
+                    logger.error(f"Audit webhook: HTTP {resp.status}: {await resp.text()}")
+                    return
+                else:
+                    if resp.headers.get("X-RateLimit-Remaining") == "0":
+                        await asyncio.sleep(float(resp.headers.get("X-RateLimit-Reset-After", 1)))
+                    return
+        except aiohttp.ClientError as e:
+            logger.warning(f"Audit webhook error: {e}, повтор через {delay} с")
+        await asyncio.sleep(delay)
+    raise RuntimeError("audit webhook недоступен")
+
+async def flush_audit():
+    """
+    Отправляет всё накопленное сообщениями по AUDIT_EMBEDS_PER_MESSAGE эмбедов.
+    При ошибке неотправленная пачка возвращается в буфер.
+    """
+    global _dropped
+    if _dropped:
+        logger.warning(f"Аудит: буфер переполнен, пропущено событий: {_dropped}")
+        _dropped = 0
+    while _pending:
+        batch = [_pending.popitem(last=False) for _ in range(min(AUDIT_EMBEDS_PER_MESSAGE, len(_pending)))]
+        payload = _build_payload(batch)
+        if payload is None:
+            continue
+        try:
+            await _post(payload)
+        except BaseException:
+            _restore(batch)
+            raise
+
+async def _audit_worker():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), AUDIT_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await flush_audit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка отправки аудита: {e}")
+
+def start_audit():
+    """
+    Запускает фоновую отправку аудита (один раз). Без audit_webhook ничего не делает.
+    """
+    global _wakeup, _audit_task
+    if not audit_url:
+        return
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    if _audit_task is None or _audit_task.done():
+        _audit_task = asyncio.create_task(_audit_worker())
+
+async def close_audit():
+    """
+    Останавливает фоновую отправку, дописывает остаток буфера
+    (не дольше AUDIT_SHUTDOWN_TIMEOUT) и закрывает HTTP-сессию.
+    """
+    global _audit_task, _session
+    if _audit_task is not None:
+        _audit_task.cancel()
+        try:
+            await _audit_task
+        except asyncio.CancelledError:
+            pass
+        _audit_task = None
+    try:
+        await asyncio.wait_for(flush_audit(), AUDIT_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Не удалось дописать аудит при остановке: {e}, осталось событий: {len(_pending)}")
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,136 @@
+import random
+
+# ------------------------
+#  Кодирование карт
+# ------------------------
+# Карта хранится как небольшое целое: code = suit_index * 13 + rank_index,
+# т.е. 0..51 в том же порядке, в котором раньше строилась колода строк.
+SUITS = ('♠', '♥', '♦', '♣')
+RANKS = ('2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A')
+DECK_SIZE = len(SUITS) * len(RANKS)
+
+# code -> "10♥" (ключи CARD_EMOJIS и формат game_history)
+CARD_NAMES = tuple(f"{rank}{suit}" for suit in SUITS for rank in RANKS)
+# "10♥" -> code
+CARD_CODES = {name: code for code, name in enumerate(CARD_NAMES)}
+
+def card_rank(code: int) -> str:
+    return RANKS[code % 13]
+
+def card_names(hand) -> list:
+    """[8, 51] -> ['10♠', 'A♣']."""
+    return [CARD_NAMES[code] for code in hand]
+
+# ------------------------
+#  Подсчёт очков
+# ------------------------
+# Очки ранга с тузом = 1 (мягкость туза учитывается таблицей ниже)
+RANK_VALUES = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'J': 10, 'Q': 10, 'K': 10, 'A': 1}
+CARD_VALUES = tuple(RANK_VALUES[card_rank(code)] for code in range(DECK_SIZE))
+
+# Вес карты упакован в одно число: очки | тузы << 8 | шестёрки << 16.
+# Сумма весов руки даёт сразу жёсткую сумму и количество тузов и шестёрок
+# (рука короче 256 карт, поля не переполняются).
+_ACE_UNIT = 1 << 8
+_SIX_UNIT = 1 << 16
+CARD_WEIGHTS = tuple(
+    CARD_VALUES[code]
+    + (_ACE_UNIT if card_rank(code) == 'A' else 0)
+    + (_SIX_UNIT if card_rank(code) == '6' else 0)
+    for code in range(DECK_SIZE)
+)
+
+# (жёсткая сумма, есть туз) -> (очки, soft); индекс = hard * 2 + есть_туз
+SCORE_TABLE_SIZE = 64
+def _table_score(hard: int, has_ace: bool) -> tuple:
+    if has_ace and hard + 10 <= 21:
+        return hard + 10, True
+    return hard, False
+SCORE_TABLE = tuple(_table_score(hard, has_ace) for hard in range(SCORE_TABLE_SIZE) for has_ace in (False, True))
+
+def _score_packed(packed: int, is_dealer: bool) -> tuple:
+    hard = packed & 0xFF
+    aces = (packed >> 8) & 0xFF
+    score, is_soft = SCORE_TABLE[hard * 2 + (aces > 0)] if hard < SCORE_TABLE_SIZE else (hard, False)
+    # Правило дилера: 17 с тузом и шестёркой считается как 7 + остальные карты (туз = 1)
+    if is_dealer and aces and score == 17 and packed >> 16:
+        return 7 + hard - 6 * (packed >> 16), False
+    return score, is_soft
+
+def score_hand(hand, is_dealer: bool = False) -> tuple:
+    """Очки руки из кодов карт: (score, is_soft)."""
+    return _score_packed(sum(map(CARD_WEIGHTS.__getitem__, hand)), is_dealer)
+
+def score_hands(hands, is_dealer: bool = False) -> list:
+    """То же, что score_hand, для пачки рук (для симуляций и массовых пересчётов)."""
+    weights = CARD_WEIGHTS.__getitem__
+    return [_score_packed(sum(map(weights, hand)), is_dealer) for hand in hands]
+
+# ------------------------
+#  Правила раздачи
+# ------------------------
+# Дилер добирает, пока у него меньше DEALER_STANDS_ON
+DEALER_STANDS_ON = 17
+# Выплата (вместе со ставкой) в ставках
+WIN_PAYOUT = 2
+BLACKJACK_PAYOUT = 2.5
+
+def play_dealer(hand: list, shoe) -> int:
+    """Добирает карты дилеру из shoe (на месте) и возвращает итоговые очки."""
+    score = score_hand(hand, True)[0]
+    while score < DEALER_STANDS_ON:
+        hand.append(shoe.pop())
+        score = score_hand(hand, True)[0]
+    return score
+
+# ------------------------
+#  Шу (колода из нескольких колод)
+# ------------------------
+_seed_source = random.SystemRandom()
+
+def new_seed() -> int:
+    """Случайное зерно, помещающееся в BIGINT."""
+    return _seed_source.getrandbits(63)
+
+class Shoe:
+    """
+    Перемешанный шу, заданный тройкой (seed, pos, decks).
+    Порядок карт однозначно восстанавливается из seed, поэтому в БД
+    хранятся только эти три числа, а не оставшиеся карты.
+    Интерфейс совместим со списком: pop() выдаёт следующую карту, len() — остаток.
+    """
+    __slots__ = ("seed", "pos", "decks", "_cards")
+
+    def __init__(self, decks: int, seed: int = None, pos: int = 0):
+        self.decks = decks
+        self.seed = new_seed() if seed is None else seed
+        self.pos = pos
+        self._cards = None
+
+    @property
+    def cards(self) -> list:
+        # Перемешиваем лениво: для len() и сохранения порядок не нужен
+        if self._cards is None:
+            cards = list(range(DECK_SIZE)) * self.decks
+            random.Random(self.seed).shuffle(cards)
+            self._cards = cards
+        return self._cards
+
+    def pop(self) -> int:
+        if self.pos >= DECK_SIZE * self.decks:
+            raise IndexError("pop from empty shoe")
+        card = self.cards[self.pos]
+        self.pos += 1
+        return card
+
+    def copy(self) -> "Shoe":
+        """Независимая позиция, общий (неизменяемый) порядок карт."""
+        shoe = Shoe(self.decks, seed=self.seed, pos=self.pos)
+        shoe._cards = self._cards
+        return shoe
+
+    def __len__(self) -> int:
+        return DECK_SIZE * self.decks - self.pos
+
+    def __repr__(self) -> str:
+        return f"Shoe(decks={self.decks}, seed={self.seed}, pos={self.pos})"
@@ -1,9 +1,16 @@
 import aiopg
+import psycopg2
 import json
 import logging
 import asyncio
+import contextvars
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from config import database_url
+from utils.cards import Shoe, card_names
+from utils.drops import DropTable
+from utils.audit import audit_balance
 
 # ------------------------
 #  Настройка логирования
@@ -47,6 +54,151 @@ async def close_pool():
         _pool = None
         logger.info("Пул PostgreSQL закрыт.")
 
+# ------------------------
+#  Единица работы (одно соединение и одна транзакция на команду)
+# ------------------------
+class _UnitOfWork:
+    def __init__(self, conn):
+        self.conn = conn
+        # Задача-владелец: задачи, созданные внутри блока, наследуют контекст,
+        # но не должны писать в чужое соединение.
+        self.task = asyncio.current_task()
+        # Ключи кэша балансов, изменённые внутри транзакции (сбрасываются при откате)
+        self.touched = set()
+        # Функции, вызываемые после успешного COMMIT
+        self.on_commit = []
+
+_current_uow = contextvars.ContextVar("unit_of_work", default=None)
+
+def _active_uow():
+    """
+    Возвращает открытую в текущей задаче единицу работы или None.
+    """
+    uow = _current_uow.get()
+    if uow is not None and uow.task is asyncio.current_task():
+        return uow
+    return None
+
+@asynccontextmanager
+async def _cursor():
+    """
+    Курсор для хелперов: внутри unit_of_work() использует её соединение
+    и транзакцию, иначе берёт соединение из пула на один вызов.
+    """
+    uow = _active_uow()
+    if uow is not None:
+        async with uow.conn.cursor() as cur:
+            yield cur
+        return
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            yield cur
+
+@asynccontextmanager
+async def unit_of_work():
+    """
+    Открывает транзакцию на одном соединении из пула. Все хелперы этого модуля,
+    вызванные внутри блока, работают в ней; COMMIT выполняется один раз при выходе,
+    при исключении — ROLLBACK и сброс затронутых записей кэша балансов.
+    Вложенные блоки присоединяются к внешней транзакции.
+
+        async with unit_of_work():
+            await update_cash(user_id, guild_id, reward)
+            await update_cooldown(user_id, guild_id, "work", now)
+    """
+    if _active_uow() is not None:
+        yield
+        return
+    # Ждём переполненную очередь истории до захвата соединения, а не внутри транзакции
+    await _history_backpressure()
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        uow = _UnitOfWork(conn)
+        token = _current_uow.set(uow)
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute("BEGIN;")
+            try:
+                yield
+                async with conn.cursor() as cur:
+                    await cur.execute("COMMIT;")
+            except BaseException:
+                try:
+                    async with conn.cursor() as cur:
+                        await cur.execute("ROLLBACK;")
+                except Exception as e:
+                    logger.error(f"Ошибка ROLLBACK: {e}")
+                for key in uow.touched:
+                    _balance_cache.pop(key, None)
+                raise
+        finally:
+            _current_uow.reset(token)
+    for callback in uow.on_commit:
+        callback()
+
+def _after_commit(callback):
+    """
+    Вызывает callback после COMMIT текущей unit_of_work() или сразу, если её нет.
+    При откате callback не вызывается.
+    """
+    uow = _active_uow()
+    if uow is not None:
+        uow.on_commit.append(callback)
+    else:
+        callback()
+
+# ------------------------
+#  Кэш балансов (write-through)
+# ------------------------
+BALANCE_CACHE_SIZE = 10000
+
+# (user_id, guild_id) -> (cash, bank); порядок ключей = порядок использования (LRU)
+_balance_cache = OrderedDict()
+
+def _cache_get_balance(user_id: int, guild_id: int):
+    """
+    Возвращает (cash, bank) из кэша или None.
+    """
+    key = (user_id, guild_id)
+    row = _balance_cache.get(key)
+    if row is not None:
+        _balance_cache.move_to_end(key)
+    return row
+
+def _cache_put_balance(user_id: int, guild_id: int, cash: int, bank: int, overwrite: bool = True):
+    """
+    Кладёт (cash, bank) в кэш и вытесняет самые старые записи сверх BALANCE_CACHE_SIZE.
+    overwrite=False используется для результатов чтения: значение, записанное
+    параллельной мутацией, свежее прочитанного и не должно затираться.
+    """
+    key = (user_id, guild_id)
+    uow = _active_uow()
+    if uow is not None:
+        uow.touched.add(key)
+    if not overwrite and key in _balance_cache:
+        return
+    _balance_cache[key] = (cash, bank)
+    _balance_cache.move_to_end(key)
+    while len(_balance_cache) > BALANCE_CACHE_SIZE:
+        _balance_cache.popitem(last=False)
+
+def _audit(user_id: int, guild_id: int, cash_change: int, bank_change: int, reason: str = None):
+    """
+    Передаёт изменение баланса в аудит (utils.audit) после COMMIT.
+    Без reason берётся причина текущей задачи (см. set_audit_reason).
+    """
+    _after_commit(lambda: audit_balance(user_id, guild_id, cash_change, bank_change, reason))
+
+def invalidate_balance_cache(user_id: int = None, guild_id: int = None):
+    """
+    Сбрасывает кэш балансов: целиком (без аргументов) или для одной пары (user_id, guild_id).
+    """
+    if user_id is None:
+        _balance_cache.clear()
+    else:
+        _balance_cache.pop((user_id, guild_id), None)
+
 # ------------------------
 #  Инициализация схемы БД
 # ------------------------
@@ -71,6 +223,10 @@ CREATE TABLE IF NOT EXISTS users (
     PRIMARY KEY(user_id, guild_id)
 );
 """)
+                # Индексы для постраничного топа (порядок совпадает с ORDER BY в get_top_users)
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_users_top_cash  ON users(guild_id, cash DESC, user_id);")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_users_top_bank  ON users(guild_id, bank DESC, user_id);")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_users_top_total ON users(guild_id, (cash + bank) DESC, user_id);")
 
                 # 2) Таблица cooldowns
                 await cur.execute("""
@@ -93,6 +249,7 @@ CREATE TABLE IF NOT EXISTS active_roulettes (
     result     VARCHAR(255)
 );
 """)
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_active_roulettes_channel ON active_roulettes(channel_id);")
 
                 # 4) Таблица roulette_bets
                 await cur.execute("""
@@ -105,6 +262,7 @@ CREATE TABLE IF NOT EXISTS roulette_bets (
     space_type  VARCHAR(255) NOT NULL
 );
 """)
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_roulette_bets_roulette ON roulette_bets(roulette_id);")
 
                 # 5) Таблица roulette_history
                 await cur.execute("""
@@ -129,13 +287,16 @@ CREATE TABLE IF NOT EXISTS active_games (
     guild_id    BIGINT       NOT NULL,
     channel_id  BIGINT       NOT NULL,
     message_id  BIGINT       NOT NULL,
-    player_hand JSONB        NOT NULL,
-    dealer_hand JSONB        NOT NULL,
+    player_hand SMALLINT[]   NOT NULL,
+    dealer_hand SMALLINT[]   NOT NULL,
     bet         BIGINT       NOT NULL,
     start_time  TIMESTAMPTZ  NOT NULL,
-    deck        JSONB        NOT NULL
+    shoe_seed   BIGINT       NOT NULL,
+    shoe_pos    SMALLINT     NOT NULL,
+    decks       SMALLINT     NOT NULL
 );
 """)
+                await _migrate_active_games(cur)
 
                 # 7) Таблица game_history
                 await cur.execute("""
@@ -229,6 +390,24 @@ CREATE TABLE IF NOT EXISTS user_temp_roles (
     PRIMARY KEY(user_id, guild_id, role_id)
 );
 """)
+                # Очередь истечения: планировщик забирает наступившие записи по индексу
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_user_temp_roles_expires ON user_temp_roles(expires_at);")
+
+                # 14) Таблица role_outbox (очередь выдачи/снятия ролей в Discord)
+                await cur.execute("""
+CREATE TABLE IF NOT EXISTS role_outbox (
+    id            BIGSERIAL    PRIMARY KEY,
+    user_id       BIGINT       NOT NULL,
+    guild_id      BIGINT       NOT NULL,
+    role_id       BIGINT       NOT NULL,
+    action        VARCHAR(6)   NOT NULL,      -- 'add' или 'remove'
+    reason        VARCHAR(100),
+    attempts      INTEGER      NOT NULL DEFAULT 0,
+    next_attempt  TIMESTAMPTZ  NOT NULL DEFAULT NOW()
+);
+""")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_role_outbox_due ON role_outbox(next_attempt);")
+                await cur.execute("CREATE INDEX IF NOT EXISTS idx_role_outbox_member ON role_outbox(guild_id, user_id);")
 
                 # Если таблица shop_items пуста, добавляем тестовый товар
                 await cur.execute("SELECT COUNT(*) FROM shop_items;")
@@ -251,29 +430,107 @@ async def ensure_user_exists(user_id: int, guild_id: int):
     """
     Если записи (user_id, guild_id) нет в таблице users,
     создаёт её с cash=0, bank=0.
+    Пользователь из кэша балансов заведомо существует — запрос не нужен.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT 1 FROM users WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
-            if not await cur.fetchone():
-                await cur.execute(
-                    "INSERT INTO users (user_id, guild_id, cash, bank) VALUES (%s, %s, 0, 0);",
-                    (user_id, guild_id)
-                )
+    if _cache_get_balance(user_id, guild_id) is not None:
+        return
+    async with _cursor() as cur:
+        await cur.execute("SELECT 1 FROM users WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
+        if not await cur.fetchone():
+            await cur.execute(
+                "INSERT INTO users (user_id, guild_id, cash, bank) VALUES (%s, %s, 0, 0);",
+                (user_id, guild_id)
+            )
+            _cache_put_balance(user_id, guild_id, 0, 0, overwrite=False)
 
 async def get_user_balance(user_id: int, guild_id: int) -> tuple:
     """
     Возвращает (cash, bank) для user_id в guild_id.
-    Сначала вызывает ensure_user_exists.
+    Сначала смотрит в кэш, при промахе вызывает ensure_user_exists и читает БД.
     """
+    cached = _cache_get_balance(user_id, guild_id)
+    if cached is not None:
+        return cached
     await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
-            row = await cur.fetchone()
-            return (row[0], row[1]) if row else (0, 0)
+    async with _cursor() as cur:
+        await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
+        row = await cur.fetchone()
+        if not row:
+            return (0, 0)
+        _cache_put_balance(user_id, guild_id, row[0], row[1], overwrite=False)
+        return (row[0], row[1])
+
+# Условия, которым должен удовлетворять баланс ПОСЛЕ изменения.
+# SQL-шаблон получает выражения нового cash/bank, функция — числа
+# (по ней проверяется вставка нового пользователя с балансом 0/0).
+BALANCE_GUARDS = {
+    # cash + bank >= 0 (cash может уйти в минус за счёт bank)
+    "total": (
+        "({cash}) + ({bank}) >= 0",
+        lambda cash, bank: cash + bank >= 0
+    ),
+    # bank >= 0 и cash + bank >= 0
+    "bank": (
+        "({bank}) >= 0 AND ({cash}) + ({bank}) >= 0",
+        lambda cash, bank: bank >= 0 and cash + bank >= 0
+    ),
+    # cash >= 0 (нельзя тратить больше наличных)
+    "cash": (
+        "({cash}) >= 0",
+        lambda cash, bank: cash >= 0
+    ),
+}
+
+async def adjust_balance(
+    user_id: int,
+    guild_id: int,
+    cash_delta: int = 0,
+    bank_delta: int = 0,
+    guard: str = "total",
+    error: str = "Недостаточно средств.",
+    reason: str = None
+) -> tuple:
+    """
+    Атомарно изменяет cash += cash_delta, bank += bank_delta одним запросом.
+    Создаёт пользователя, если его нет, и проверяет условие guard
+    (ключ BALANCE_GUARDS) для нового баланса. Если условие не выполняется,
+    ничего не меняет и бросает ValueError(error).
+    reason — причина для аудита (по умолчанию — причина текущей задачи).
+    Возвращает (новый cash, новый bank).
+    """
+    guard_sql, guard_ok = BALANCE_GUARDS[guard]
+    async with _cursor() as cur:
+        if guard_ok(cash_delta, bank_delta):
+            # Новый пользователь с балансом 0/0 + delta проходит проверку,
+            # поэтому upsert безопасен: условие нужно только для существующей строки.
+            cond = guard_sql.format(cash="users.cash + EXCLUDED.cash", bank="users.bank + EXCLUDED.bank")
+            await cur.execute(f"""
+INSERT INTO users (user_id, guild_id, cash, bank)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (user_id, guild_id) DO UPDATE
+  SET cash = users.cash + EXCLUDED.cash,
+      bank = users.bank + EXCLUDED.bank
+  WHERE {cond}
+RETURNING cash, bank;
+""", (user_id, guild_id, cash_delta, bank_delta))
+        else:
+            # Для нового пользователя такое списание всё равно невозможно,
+            # так что достаточно UPDATE существующей строки.
+            cond = guard_sql.format(cash="u.cash + d.cash", bank="u.bank + d.bank")
+            await cur.execute(f"""
+UPDATE users AS u
+SET cash = u.cash + d.cash,
+    bank = u.bank + d.bank
+FROM (VALUES (%s::BIGINT, %s::BIGINT)) AS d(cash, bank)
+WHERE u.user_id = %s AND u.guild_id = %s AND {cond}
+RETURNING u.cash, u.bank;
+""", (cash_delta, bank_delta, user_id, guild_id))
+        row = await cur.fetchone()
+        if not row:
+            raise ValueError(error)
+        _cache_put_balance(user_id, guild_id, row[0], row[1])
+        _audit(user_id, guild_id, cash_delta, bank_delta, reason)
+        return (row[0], row[1])
 
 async def update_cash(user_id: int, guild_id: int, amount: int) -> int:
     """
@@ -281,17 +538,11 @@ async def update_cash(user_id: int, guild_id: int, amount: int) -> int:
     Проверяет, что cash + bank >= 0.
     Возвращает новый cash.
     """
-    await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (user_id, guild_id))
-            cash, bank = await cur.fetchone()
-            new_cash = cash + amount
-            if new_cash < -bank:
-                raise ValueError("Недостаточно средств (cash+bank не может быть отрицательным).")
-            await cur.execute("UPDATE users SET cash=%s WHERE user_id=%s AND guild_id=%s;", (new_cash, user_id, guild_id))
-            return new_cash
+    cash, _ = await adjust_balance(
+        user_id, guild_id, cash_delta=amount, guard="total",
+        error="Недостаточно средств (cash+bank не может быть отрицательным)."
+    )
+    return cash
 
 async def update_bank(user_id: int, guild_id: int, amount: int) -> int:
     """
@@ -299,17 +550,11 @@ async def update_bank(user_id: int, guild_id: int, amount: int) -> int:
     Проверяет bank >= 0 и cash + bank >= 0.
     Возвращает новый bank.
     """
-    await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (user_id, guild_id))
-            cash, bank = await cur.fetchone()
-            new_bank = bank + amount
-            if new_bank < 0 or cash < -new_bank:
-                raise ValueError("Недостаточно средств или общая сумма < 0.")
-            await cur.execute("UPDATE users SET bank=%s WHERE user_id=%s AND guild_id=%s;", (new_bank, user_id, guild_id))
-            return new_bank
+    _, bank = await adjust_balance(
+        user_id, guild_id, bank_delta=amount, guard="bank",
+        error="Недостаточно средств или общая сумма < 0."
+    )
+    return bank
 
 async def transfer_to_bank(user_id: int, guild_id: int, amount: int) -> tuple:
     """
@@ -317,16 +562,10 @@ async def transfer_to_bank(user_id: int, guild_id: int, amount: int) -> tuple:
     Проверяет cash >= amount.
     Возвращает (новый cash, новый bank).
     """
-    await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (user_id, guild_id))
-            cash, bank = await cur.fetchone()
-            if cash < amount:
-                raise ValueError("Недостаточно cash для перевода.")
-            await cur.execute("UPDATE users SET cash=cash-%s, bank=bank+%s WHERE user_id=%s AND guild_id=%s;", (amount, amount, user_id, guild_id))
-            return (cash - amount, bank + amount)
+    return await adjust_balance(
+        user_id, guild_id, cash_delta=-amount, bank_delta=amount, guard="cash",
+        error="Недостаточно cash для перевода.", reason="Перевод в банк"
+    )
 
 async def transfer_from_bank(user_id: int, guild_id: int, amount: int) -> tuple:
     """
@@ -334,179 +573,468 @@ async def transfer_from_bank(user_id: int, guild_id: int, amount: int) -> tuple:
     Проверяет bank >= amount и cash + bank >= 0.
     Возвращает (новый cash, новый bank).
     """
-    await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (user_id, guild_id))
-            cash, bank = await cur.fetchone()
-            if bank < amount:
-                raise ValueError("Недостаточно bank для перевода.")
-            new_cash = cash + amount
-            new_bank = bank - amount
-            if new_cash < -new_bank:
-                raise ValueError("Общая сумма cash+bank не может быть отрицательной.")
-            await cur.execute("UPDATE users SET cash=%s, bank=%s WHERE user_id=%s AND guild_id=%s;", (new_cash, new_bank, user_id, guild_id))
-            return (new_cash, new_bank)
+    return await adjust_balance(
+        user_id, guild_id, cash_delta=amount, bank_delta=-amount, guard="bank",
+        error="Недостаточно bank для перевода.", reason="Снятие из банка"
+    )
 
 async def apply_fine(user_id: int, guild_id: int, fine: int) -> tuple:
     """
     Списывает fine с cash, ограничивая cash+bank >= 0.
     Если fine > cash+bank, списывает всю сумму.
     Возвращает (новый cash, банк).
-    """
-    await ensure_user_exists(user_id, guild_id)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (user_id, guild_id))
-            cash, bank = await cur.fetchone()
-            total = cash + bank
-            if fine > total:
-                fine = total
-            new_cash = cash - fine
-            if new_cash < -bank:
-                raise ValueError("Cash не может стать меньше -bank.")
-            await cur.execute("UPDATE users SET cash=%s WHERE user_id=%s AND guild_id=%s;", (new_cash, user_id, guild_id))
-            return (new_cash, bank)
+    Существующему пользователю — одним запросом; нового создаёт с нулевым балансом.
+    """
+    async with _cursor() as cur:
+        # Подзапрос блокирует строку, поэтому списанная сумма для аудита точна
+        await cur.execute("""
+UPDATE users AS u
+SET cash = u.cash - f.charged
+FROM (
+    SELECT LEAST(%s, cash + bank) AS charged FROM users
+    WHERE user_id = %s AND guild_id = %s
+    FOR UPDATE
+) AS f
+WHERE u.user_id = %s AND u.guild_id = %s
+RETURNING u.cash, u.bank, f.charged;
+""", (fine, user_id, guild_id, user_id, guild_id))
+        row = await cur.fetchone()
+        if row is None:
+            # Нового пользователя создаём с нулевым балансом: списывать нечего
+            await cur.execute(
+                "INSERT INTO users (user_id, guild_id, cash, bank) VALUES (%s, %s, 0, 0) ON CONFLICT DO NOTHING;",
+                (user_id, guild_id)
+            )
+            _cache_put_balance(user_id, guild_id, 0, 0, overwrite=False)
+            return (0, 0)
+        cash, bank, charged = row
+        _cache_put_balance(user_id, guild_id, cash, bank)
+        _audit(user_id, guild_id, -charged, 0)
+        return (cash, bank)
 
 async def get_user_position(user_id: int, guild_id: int) -> int:
     """
-    Возвращает позицию пользователя в топе (по сумме cash+bank) в guild_id.
+    Возвращает позицию пользователя в топе (по сумме cash+bank) в guild_id:
+    1 + число пользователей с большей суммой. Запрос идёт по индексу
+    idx_users_top_total и не зависит от размера гильдии.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT user_id FROM users WHERE guild_id=%s ORDER BY (cash + bank) DESC;", (guild_id,))
-            rows = await cur.fetchall()
-            for idx, (uid,) in enumerate(rows, start=1):
-                if uid == user_id:
-                    return idx
-            return len(rows) + 1
-
-async def get_top_users(guild_id: int, sort_field: str) -> list:
+    cached = _cache_get_balance(user_id, guild_id)
+    async with _cursor() as cur:
+        if cached is not None:
+            await cur.execute(
+                "SELECT COUNT(*) FROM users WHERE guild_id=%s AND (cash + bank) > %s;",
+                (guild_id, cached[0] + cached[1])
+            )
+        else:
+            # Несуществующий пользователь оказывается после всех
+            await cur.execute("""
+SELECT COUNT(*) FROM users
+WHERE guild_id = %s
+  AND (cash + bank) > COALESCE(
+      (SELECT cash + bank FROM users WHERE user_id = %s AND guild_id = %s),
+      -9223372036854775808
+  );
+""", (guild_id, user_id, guild_id))
+        row = await cur.fetchone()
+        return row[0] + 1
+
+# Выражения сортировки топа; каждому соответствует индекс idx_users_top_*
+LEADERBOARD_ORDER = {
+    "cash": "cash",
+    "bank": "bank",
+    "total": "(cash + bank)",
+}
+
+async def get_top_users(guild_id: int, sort_field: str, limit: int = None, offset: int = 0) -> list:
     """
     Возвращает [(user_id, cash, bank), …], отсортированный по sort_field:
     "cash", "bank" или "total" (cash+bank).
+    limit/offset задают страницу; без limit возвращается весь список.
     """
-    order_by = "cash" if sort_field == "cash" else ("bank" if sort_field == "bank" else "(cash + bank)")
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(f"SELECT user_id, cash, bank FROM users WHERE guild_id=%s ORDER BY {order_by} DESC;", (guild_id,))
-            return await cur.fetchall()
+    order_by = LEADERBOARD_ORDER.get(sort_field, LEADERBOARD_ORDER["total"])
+    async with _cursor() as cur:
+        await cur.execute(
+            f"SELECT user_id, cash, bank FROM users WHERE guild_id=%s "
+            f"ORDER BY {order_by} DESC, user_id LIMIT %s OFFSET %s;",
+            (guild_id, limit, offset)
+        )
+        return await cur.fetchall()
+
+async def count_users(guild_id: int) -> int:
+    """
+    Возвращает количество пользователей guild_id (для числа страниц топа).
+    """
+    async with _cursor() as cur:
+        await cur.execute("SELECT COUNT(*) FROM users WHERE guild_id=%s;", (guild_id,))
+        row = await cur.fetchone()
+        return row[0]
 
 async def get_total_balance(guild_id: int) -> int:
     """
     Возвращает сумму cash+bank для всех пользователей guild_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT COALESCE(SUM(cash + bank), 0) FROM users WHERE guild_id=%s;", (guild_id,))
-            row = await cur.fetchone()
-            return row[0]
+    async with _cursor() as cur:
+        await cur.execute("SELECT COALESCE(SUM(cash + bank), 0) FROM users WHERE guild_id=%s;", (guild_id,))
+        row = await cur.fetchone()
+        return row[0]
 
 # ------------------------
 #  Рулетка
 # ------------------------
+# Открытые раунды живут в памяти по channel_id; roulette_bets — журнал ставок
+# только на дописывание, нужен для восстановления после перезапуска.
+
+# channel_id -> раунд
+_active_roulettes = {}
+# roulette_id -> channel_id
+_roulette_channels = {}
+_roulettes_warm = False
+
+def _remember_roulette(roulette: dict):
+    _active_roulettes[roulette["channel_id"]] = roulette
+    _roulette_channels[roulette["id"]] = roulette["channel_id"]
+
+def _forget_roulette(roulette_id: int):
+    channel_id = _roulette_channels.pop(roulette_id, None)
+    if channel_id is not None and _active_roulettes.get(channel_id, {}).get("id") == roulette_id:
+        del _active_roulettes[channel_id]
+
+async def _load_roulettes(where: str = "", params: tuple = ()) -> list:
+    async with _cursor() as cur:
+        await cur.execute(f"SELECT id, channel_id, guild_id, end_time, result FROM active_roulettes {where};", params)
+        rows = await cur.fetchall()
+        if not rows:
+            return []
+        roulettes = {
+            rid: {"id": rid, "channel_id": ch, "guild_id": gid, "end_time": et, "result": res, "bets": {}}
+            for rid, ch, gid, et, res in rows
+        }
+        await cur.execute(
+            "SELECT roulette_id, user_id, amount, space, space_type FROM roulette_bets "
+            "WHERE roulette_id = ANY(%s) ORDER BY id;",
+            (list(roulettes),)
+        )
+        for rid, usr, amt, sp, st in await cur.fetchall():
+            roulettes[rid]["bets"].setdefault(usr, []).append((amt, sp, st))
+    return list(roulettes.values())
+
+async def warm_roulettes():
+    """
+    Загружает открытые раунды и их ставки в память. Вызывается при старте после init_db().
+    """
+    global _roulettes_warm
+    roulettes = await _load_roulettes()
+    for roulette in roulettes:
+        _remember_roulette(roulette)
+    _roulettes_warm = True
+    logger.info(f"Загружено раундов рулетки: {len(roulettes)}")
+
+def reset_roulette_cache():
+    """
+    Очищает раунды в памяти (после пересоздания схемы).
+    """
+    global _roulettes_warm
+    _active_roulettes.clear()
+    _roulette_channels.clear()
+    _roulettes_warm = False
+
 async def create_roulette(channel_id: int, guild_id: int, end_time: int) -> int:
     """
     Создаёт новую рулетку. Возвращает id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO active_roulettes (channel_id, guild_id, end_time, result) VALUES (%s, %s, %s, NULL) RETURNING id;",
-                (channel_id, guild_id, end_time)
-            )
-            row = await cur.fetchone()
-            return row[0]
-
-async def add_roulette_bet(roulette_id: int, user_id: int, amount: int, space: str, space_type: str):
-    """
-    Добавляет запись о ставке для рулетки.
+    async with _cursor() as cur:
+        await cur.execute(
+            "INSERT INTO active_roulettes (channel_id, guild_id, end_time, result) VALUES (%s, %s, %s, NULL) RETURNING id;",
+            (channel_id, guild_id, end_time)
+        )
+        row = await cur.fetchone()
+    roulette = {"id": row[0], "channel_id": channel_id, "guild_id": guild_id, "end_time": end_time, "result": None, "bets": {}}
+    _after_commit(lambda: _remember_roulette(roulette))
+    return row[0]
+
+async def place_roulette_bet(roulette_id: int, user_id: int, guild_id: int, amount: int, space: str, space_type: str) -> int:
+    """
+    Списывает ставку с cash и дописывает её в журнал roulette_bets одним запросом.
+    Если cash не хватает, ничего не меняет и бросает ValueError.
+    Ставка добавляется к раунду в памяти (внутри unit_of_work() — после COMMIT).
+    Возвращает новый cash.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO roulette_bets (roulette_id, user_id, amount, space, space_type) VALUES (%s, %s, %s, %s, %s);",
-                (roulette_id, user_id, amount, space, space_type)
-            )
+    async with _cursor() as cur:
+        await cur.execute("""
+WITH debit AS (
+    UPDATE users SET cash = cash - %s
+    WHERE user_id = %s AND guild_id = %s AND cash >= %s
+    RETURNING cash, bank
+), bet AS (
+    INSERT INTO roulette_bets (roulette_id, user_id, amount, space, space_type)
+    SELECT %s, %s, %s, %s, %s FROM debit
+)
+SELECT cash, bank FROM debit;
+""", (amount, user_id, guild_id, amount, roulette_id, user_id, amount, space, space_type))
+        row = await cur.fetchone()
+    if not row:
+        raise ValueError("Недостаточно средств.")
+    _cache_put_balance(user_id, guild_id, row[0], row[1])
+    _audit(user_id, guild_id, -amount, 0, "Рулетка: ставка")
+
+    def apply():
+        channel_id = _roulette_channels.get(roulette_id)
+        if channel_id is not None:
+            _active_roulettes[channel_id]["bets"].setdefault(user_id, []).append((amount, space, space_type))
+
+    _after_commit(apply)
+    return row[0]
 
 async def get_active_roulette(channel_id: int) -> dict:
     """
     Возвращает данные по активной рулетке (или None).
+    После warm_roulettes() отвечает из памяти без запроса к БД.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT id, channel_id, guild_id, end_time, result FROM active_roulettes WHERE channel_id=%s;", (channel_id,))
-            row = await cur.fetchone()
-            if not row:
-                return None
-
-            rid, ch, gid, et, res = row
-            await cur.execute("SELECT user_id, amount, space, space_type FROM roulette_bets WHERE roulette_id=%s;", (rid,))
-            bets = {}
-            for usr, amt, sp, st in await cur.fetchall():
-                bets.setdefault(usr, []).append((amt, sp, st))
-
-            return {
-                "id":         rid,
-                "channel_id": ch,
-                "guild_id":   gid,
-                "end_time":   et,
-                "result":     res,
-                "bets":       bets
-            }
+    roulette = _active_roulettes.get(channel_id)
+    if roulette is None and not _roulettes_warm:
+        roulettes = await _load_roulettes("WHERE channel_id=%s", (channel_id,))
+        if roulettes:
+            roulette = roulettes[0]
+            _remember_roulette(roulette)
+    return roulette
 
 async def set_roulette_result(roulette_id: int, result: str):
     """
     Устанавливает поле result для рулетки.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("UPDATE active_roulettes SET result=%s WHERE id=%s;", (result, roulette_id))
+    async with _cursor() as cur:
+        await cur.execute("UPDATE active_roulettes SET result=%s WHERE id=%s;", (result, roulette_id))
+
+    def apply():
+        channel_id = _roulette_channels.get(roulette_id)
+        if channel_id is not None:
+            _active_roulettes[channel_id]["result"] = result
+
+    _after_commit(apply)
+
+async def credit_cash_many(guild_id: int, credits: dict, reason: str = None) -> dict:
+    """
+    Начисляет cash нескольким пользователям одним multi-row upsert
+    (отсутствующие пользователи создаются). credits: {user_id: сумма},
+    reason — причина для аудита.
+    Возвращает {user_id: (cash, bank)} после начисления.
+    """
+    credits = {user_id: amount for user_id, amount in credits.items() if amount}
+    if not credits:
+        return {}
+    # Порядок строк фиксирован, чтобы параллельные пачки брали блокировки одинаково
+    user_ids = sorted(credits)
+    params = []
+    for user_id in user_ids:
+        params.extend((user_id, guild_id, credits[user_id]))
+    values = ", ".join(["(%s, %s, %s, 0)"] * len(user_ids))
+    async with _cursor() as cur:
+        await cur.execute(
+            "INSERT INTO users (user_id, guild_id, cash, bank) "
+            f"VALUES {values} "
+            "ON CONFLICT (user_id, guild_id) DO UPDATE SET cash = users.cash + EXCLUDED.cash "
+            "RETURNING user_id, cash, bank;",
+            params
+        )
+        rows = await cur.fetchall()
+    balances = {}
+    for user_id, cash, bank in rows:
+        _cache_put_balance(user_id, guild_id, cash, bank)
+        _audit(user_id, guild_id, credits[user_id], 0, reason)
+        balances[user_id] = (cash, bank)
+    return balances
+
+async def settle_roulette(roulette_id: int, guild_id: int, result: str, timestamp: int, settled: list) -> dict:
+    """
+    Закрывает раунд рулетки в одной транзакции: начисляет выигрыши
+    (credit_cash_many) и удаляет раунд со ставками; история после COMMIT
+    уходит в отложенную запись (flush_history).
+    settled: [(user_id, amount, space, space_type, winnings), ...].
+    Возвращает {user_id: (cash, bank)} для получивших выигрыш.
+    """
+    credits = {}
+    for user_id, _, _, _, winnings in settled:
+        credits[user_id] = credits.get(user_id, 0) + winnings
+
+    async with unit_of_work():
+        balances = await credit_cash_many(guild_id, credits, "Рулетка: выигрыш")
+        await _queue_history("roulette_history", [
+            (roulette_id, result, timestamp, user_id, amount, space, space_type, winnings)
+            for user_id, amount, space, space_type, winnings in settled
+        ])
+        async with _cursor() as cur:
+            # roulette_bets удаляются каскадом
+            await cur.execute("DELETE FROM active_roulettes WHERE id=%s;", (roulette_id,))
+        _after_commit(lambda: _forget_roulette(roulette_id))
+    return balances
 
-async def save_roulette_history(
-    roulette_id: int,
-    result: str,
-    timestamp: int,
-    bets: dict,
-    results: dict
-):
+def get_open_roulettes() -> list:
     """
-    Записывает историю рулетки.
+    Все открытые раунды из памяти (после warm_roulettes()).
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            for usr, bet_list in bets.items():
-                for amount, space, space_type in bet_list:
-                    win = results.get(usr, {}).get(space, 0)
-                    await cur.execute("""
-INSERT INTO roulette_history
-  (roulette_id, result, timestamp, user_id, amount, space, space_type, winnings)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-""", (roulette_id, result, timestamp, usr, amount, space, space_type, win))
+    return list(_active_roulettes.values())
+
+async def refund_roulettes(roulettes: list, timestamp: int) -> int:
+    """
+    Возвращает все ставки раундов (словари как из get_active_roulette) и удаляет
+    раунды — одной транзакцией: начисления по серверам через credit_cash_many
+    и один DELETE; история с result='refund' уходит в отложенную запись.
+    Возвращает число ставок.
+    """
+    if not roulettes:
+        return 0
+    credits = {}
+    history = []
+    for roulette in roulettes:
+        guild_credits = credits.setdefault(roulette["guild_id"], {})
+        for user_id, user_bets in roulette["bets"].items():
+            for amount, space, space_type in user_bets:
+                guild_credits[user_id] = guild_credits.get(user_id, 0) + amount
+                history.append((roulette["id"], "refund", timestamp, user_id, amount, space, space_type, amount))
+    roulette_ids = [roulette["id"] for roulette in roulettes]
+
+    async with unit_of_work():
+        for guild_id, guild_credits in credits.items():
+            await credit_cash_many(guild_id, guild_credits, "Рулетка: возврат ставки")
+        await _queue_history("roulette_history", history)
+        async with _cursor() as cur:
+            await cur.execute("DELETE FROM active_roulettes WHERE id = ANY(%s);", (roulette_ids,))
+
+        def apply():
+            for roulette_id in roulette_ids:
+                _forget_roulette(roulette_id)
+
+        _after_commit(apply)
+    return len(history)
 
 async def delete_roulette(roulette_id: int):
     """
     Удаляет рулетку и связанные ставки.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("DELETE FROM roulette_bets WHERE roulette_id=%s;", (roulette_id,))
-            await cur.execute("DELETE FROM active_roulettes WHERE id=%s;", (roulette_id,))
+    async with _cursor() as cur:
+        await cur.execute("DELETE FROM roulette_bets WHERE roulette_id=%s;", (roulette_id,))
+        await cur.execute("DELETE FROM active_roulettes WHERE id=%s;", (roulette_id,))
+    _after_commit(lambda: _forget_roulette(roulette_id))
 
 # ------------------------
 #  Игры (Blackjack и др.)
 # ------------------------
+async def _migrate_active_games(cur):
+    """
+    Старый формат active_games хранил весь шу в JSONB (deck) и руки строками.
+    Незавершённые игры в этом формате не восстановить, поэтому ставки
+    возвращаются игрокам, записи удаляются, а таблица переводится на
+    компактный формат (seed + позиция, руки как SMALLINT[]).
+    Всё выполняется одной транзакцией (DDL в Postgres транзакционный):
+    после сбоя посередине ни ставки не вернутся дважды, ни игры не пропадут.
+    """
+    await cur.execute("BEGIN;")
+    try:
+        # Блокировка и проверка внутри транзакции: параллельный запуск ждёт и видит новую схему
+        await cur.execute("LOCK TABLE active_games IN ACCESS EXCLUSIVE MODE;")
+        await cur.execute("""
+SELECT 1 FROM information_schema.columns
+WHERE table_name = 'active_games' AND column_name = 'deck';
+""")
+        migrate = await cur.fetchone() is not None
+        if migrate:
+            await cur.execute("""
+UPDATE users AS u SET cash = u.cash + g.bet
+FROM (SELECT user_id, guild_id, SUM(bet) AS bet FROM active_games GROUP BY user_id, guild_id) AS g
+WHERE u.user_id = g.user_id AND u.guild_id = g.guild_id;
+""")
+            await cur.execute("DELETE FROM active_games;")
+            await cur.execute("""
+ALTER TABLE active_games
+    DROP COLUMN deck,
+    ALTER COLUMN player_hand TYPE SMALLINT[] USING '{}',
+    ALTER COLUMN dealer_hand TYPE SMALLINT[] USING '{}',
+    ADD COLUMN shoe_seed BIGINT   NOT NULL,
+    ADD COLUMN shoe_pos  SMALLINT NOT NULL,
+    ADD COLUMN decks     SMALLINT NOT NULL;
+""")
+        await cur.execute("COMMIT;")
+    except BaseException:
+        try:
+            await cur.execute("ROLLBACK;")
+        except Exception as e:
+            logger.error(f"Ошибка ROLLBACK: {e}")
+        raise
+    if not migrate:
+        return
+    # Кэш сбрасывается только после COMMIT, иначе его могли бы заполнить старые балансы
+    invalidate_balance_cache()
+    logger.info("active_games переведена на компактный формат колоды, незавершённые игры возвращены")
+
+# Живые игры хранятся в памяти процесса по (user_id, guild_id); БД нужна
+# только для восстановления после перезапуска и обновляется в фоне.
+ACTIVE_GAME_FLUSH_INTERVAL = 2
+
+# (user_id, guild_id) -> игра
+_active_games = {}
+# game_id -> (user_id, guild_id)
+_active_game_keys = {}
+# game_id, ещё не записанные в БД
+_active_games_dirty = set()
+_active_games_warm = False
+_active_game_flusher_task = None
+
+def _game_from_row(row) -> dict:
+    return {
+        "game_id":     row[0],
+        "user_id":     row[1],
+        "guild_id":    row[2],
+        "channel_id":  row[3],
+        "message_id":  row[4],
+        "player_hand": list(row[5]),
+        "dealer_hand": list(row[6]),
+        "bet":         row[7],
+        "deck":        Shoe(row[10], seed=row[8], pos=row[9])
+    }
+
+def _copy_game(game: dict) -> dict:
+    # Вызывающий код меняет руки и колоду на месте — реестр меняется только через save
+    copy = dict(game)
+    copy["player_hand"] = list(game["player_hand"])
+    copy["dealer_hand"] = list(game["dealer_hand"])
+    copy["deck"] = game["deck"].copy()
+    return copy
+
+def _remember_game(game: dict):
+    key = (game["user_id"], game["guild_id"])
+    previous = _active_games.get(key)
+    if previous is not None and previous["game_id"] != game["game_id"]:
+        _active_game_keys.pop(previous["game_id"], None)
+    _active_games[key] = game
+    _active_game_keys[game["game_id"]] = key
+
+async def warm_active_games():
+    """
+    Загружает active_games в память. Вызывается при старте после init_db().
+    """
+    global _active_games_warm
+    async with _cursor() as cur:
+        await cur.execute("""
+SELECT game_id, user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, shoe_seed, shoe_pos, decks
+FROM active_games;
+""")
+        rows = await cur.fetchall()
+    for row in rows:
+        if row[0] not in _active_games_dirty:
+            _remember_game(_game_from_row(row))
+    _active_games_warm = True
+    logger.info(f"Загружено активных игр: {len(rows)}")
+
+def reset_active_game_cache():
+    """
+    Очищает реестр игр в памяти (после пересоздания схемы).
+    """
+    global _active_games_warm
+    _active_games.clear()
+    _active_game_keys.clear()
+    _active_games_dirty.clear()
+    _active_games_warm = False
+
 async def save_active_game(
     game_id: int,
     user_id: int,
@@ -516,77 +1044,191 @@ async def save_active_game(
     player_hand: list,
     dealer_hand: list,
     bet: int,
-    deck: list
+    deck: Shoe
 ) -> int:
     """
-    Сохраняет или обновляет запись в active_games.
-    Если game_id=0, создаёт новую и возвращает её id.
+    Сохраняет или обновляет игру.
+    Если game_id=0, сразу вставляет запись в active_games и возвращает её id.
+    Обновления после warm_active_games() меняют только реестр в памяти,
+    в БД они попадают при ближайшем flush_active_games().
+    Руки — списки кодов карт, колода сохраняется как (seed, позиция, число колод).
+    Внутри unit_of_work() реестр меняется только после COMMIT.
+    Возвращает game_id или 0, если игру уже завершили (delete_active_game):
+    такая игра не сохраняется и не возвращается в реестр.
     """
     now = datetime.now(timezone.utc)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
+    created = game_id == 0
+    if created or not _active_games_warm:
+        async with _cursor() as cur:
             if game_id == 0:
                 await cur.execute(
                     "INSERT INTO active_games "
-                    "(user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, start_time, deck) "
-                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING game_id;",
+                    "(user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, start_time, shoe_seed, shoe_pos, decks) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING game_id;",
                     (
                         user_id, guild_id, channel_id, message_id,
-                        json.dumps(player_hand), json.dumps(dealer_hand),
-                        bet, now, json.dumps(deck)
+                        list(player_hand), list(dealer_hand),
+                        bet, now, deck.seed, deck.pos, deck.decks
                     )
                 )
                 row = await cur.fetchone()
-                return row[0]
+                game_id = row[0]
             else:
                 await cur.execute(
                     "UPDATE active_games SET "
                     "user_id=%s, guild_id=%s, channel_id=%s, message_id=%s, "
-                    "player_hand=%s, dealer_hand=%s, bet=%s, start_time=%s, deck=%s "
-                    "WHERE game_id=%s;",
+                    "player_hand=%s, dealer_hand=%s, bet=%s, start_time=%s, shoe_seed=%s, shoe_pos=%s, decks=%s "
+                    "WHERE game_id=%s RETURNING game_id;",
                     (
                         user_id, guild_id, channel_id, message_id,
-                        json.dumps(player_hand), json.dumps(dealer_hand),
-                        bet, now, json.dumps(deck), game_id
+                        list(player_hand), list(dealer_hand),
+                        bet, now, deck.seed, deck.pos, deck.decks, game_id
                     )
                 )
-                return game_id
-
-async def get_active_game(user_id: int) -> dict:
-    """
-    Возвращает активную игру (словарь) по user_id или пустой dict.
-    """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
+                if await cur.fetchone() is None:
+                    return 0
+        dirty = False
+    elif game_id not in _active_game_keys:
+        return 0
+    else:
+        dirty = True
+
+    game = _copy_game({
+        "game_id":     game_id,
+        "user_id":     user_id,
+        "guild_id":    guild_id,
+        "channel_id":  channel_id,
+        "message_id":  message_id,
+        "player_hand": player_hand,
+        "dealer_hand": dealer_hand,
+        "bet":         bet,
+        "deck":        deck
+    })
+    game["start_time"] = now
+
+    def apply():
+        # Игру могли завершить, пока шла транзакция: не воскрешаем её в реестре
+        if not created and _active_games_warm and game_id not in _active_game_keys:
+            return
+        _remember_game(game)
+        if dirty:
+            _active_games_dirty.add(game_id)
+
+    _after_commit(apply)
+    return game_id
+
+async def get_active_game(user_id: int, guild_id: int) -> dict:
+    """
+    Возвращает активную игру (словарь) пользователя на сервере или пустой dict.
+    После warm_active_games() отвечает из памяти без запроса к БД.
+    Возвращается копия: изменения применяются только через save_active_game().
+    """
+    game = _active_games.get((user_id, guild_id))
+    if game is None and not _active_games_warm:
+        async with _cursor() as cur:
             await cur.execute("""
-SELECT game_id, user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, deck
-FROM active_games WHERE user_id=%s;
-""", (user_id,))
+SELECT game_id, user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, shoe_seed, shoe_pos, decks
+FROM active_games WHERE user_id=%s AND guild_id=%s;
+""", (user_id, guild_id))
             row = await cur.fetchone()
-            if not row:
-                return {}
-            return {
-                "game_id":     row[0],
-                "user_id":     row[1],
-                "guild_id":    row[2],
-                "channel_id":  row[3],
-                "message_id":  row[4],
-                "player_hand": row[5],
-                "dealer_hand": row[6],
-                "bet":         row[7],
-                "deck":        row[8]
-            }
-
-async def delete_active_game(game_id: int):
-    """
-    Удаляет запись из active_games.
-    """
+        if not row:
+            return {}
+        game = _game_from_row(row)
+    return _copy_game(game) if game else {}
+
+async def get_active_game_by_id(game_id: int) -> dict:
+    """
+    То же, что get_active_game, но по game_id.
+    """
+    key = _active_game_keys.get(game_id)
+    if key is not None:
+        return _copy_game(_active_games[key])
+    if _active_games_warm:
+        return {}
+    async with _cursor() as cur:
+        await cur.execute("""
+SELECT game_id, user_id, guild_id, channel_id, message_id, player_hand, dealer_hand, bet, shoe_seed, shoe_pos, decks
+FROM active_games WHERE game_id=%s;
+""", (game_id,))
+        row = await cur.fetchone()
+    return _game_from_row(row) if row else {}
+
+async def delete_active_game(game_id: int) -> bool:
+    """
+    Удаляет игру из active_games и из реестра в памяти.
+    Удаление пишется в БД сразу, чтобы вместе с выплатой попасть в одну транзакцию.
+    Возвращает True, если игра ещё была активна: выплачивать выигрыш можно
+    только в этом случае. Параллельное завершение той же игры ждёт блокировку
+    строки и после COMMIT первого получает False.
+    """
+    async with _cursor() as cur:
+        await cur.execute("DELETE FROM active_games WHERE game_id=%s RETURNING game_id;", (game_id,))
+        live = await cur.fetchone() is not None
+
+    def apply():
+        key = _active_game_keys.pop(game_id, None)
+        if key is not None and _active_games.get(key, {}).get("game_id") == game_id:
+            del _active_games[key]
+        _active_games_dirty.discard(game_id)
+
+    _after_commit(apply)
+    return live
+
+async def flush_active_games():
+    """
+    Записывает изменённые игры в active_games одним UPDATE ... FROM (VALUES ...).
+    Игры, удалённые до записи, пропускаются. При ошибке id возвращаются в очередь.
+    """
+    if not _active_games_dirty:
+        return
+    game_ids = list(_active_games_dirty)
+    _active_games_dirty.clear()
+    games = [_active_games[_active_game_keys[game_id]] for game_id in game_ids if game_id in _active_game_keys]
+    if not games:
+        return
+    params = []
+    for game in games:
+        deck = game["deck"]
+        params.extend((
+            game["game_id"], game["message_id"], game["player_hand"], game["dealer_hand"],
+            game["bet"], game["start_time"], deck.seed, deck.pos, deck.decks
+        ))
+    values = ", ".join(
+        ["(%s::INTEGER, %s::BIGINT, %s::SMALLINT[], %s::SMALLINT[], %s::BIGINT, %s::TIMESTAMPTZ, %s::BIGINT, %s::SMALLINT, %s::SMALLINT)"] * len(games)
+    )
     pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("DELETE FROM active_games WHERE game_id=%s;", (game_id,))
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "UPDATE active_games AS g SET "
+                    "message_id=v.message_id, player_hand=v.player_hand, dealer_hand=v.dealer_hand, bet=v.bet, "
+                    "start_time=v.start_time, shoe_seed=v.shoe_seed, shoe_pos=v.shoe_pos, decks=v.decks "
+                    f"FROM (VALUES {values}) AS v(game_id, message_id, player_hand, dealer_hand, bet, start_time, shoe_seed, shoe_pos, decks) "
+                    "WHERE g.game_id = v.game_id;",
+                    params
+                )
+    except Exception as e:
+        _active_games_dirty.update(game["game_id"] for game in games if game["game_id"] in _active_game_keys)
+        logger.error(f"Ошибка записи активных игр: {e}")
+        raise
+
+async def _active_game_flusher():
+    while True:
+        await asyncio.sleep(ACTIVE_GAME_FLUSH_INTERVAL)
+        try:
+            await flush_active_games()
+        except Exception:
+            # ошибка уже залогирована, игры повторятся в следующий раз
+            pass
+
+def start_active_game_flusher():
+    """
+    Запускает фоновую запись активных игр (повторный вызов ничего не делает).
+    """
+    global _active_game_flusher_task
+    if _active_game_flusher_task is None or _active_game_flusher_task.done():
+        _active_game_flusher_task = asyncio.get_running_loop().create_task(_active_game_flusher())
 
 async def log_game_history(
     game_id: int,
@@ -600,50 +1242,369 @@ async def log_game_history(
     dealer_score: int
 ):
     """
-    Вставляет завершённую игру в game_history.
+    Ставит завершённую игру в очередь записи в game_history (flush_history).
+    Руки передаются кодами карт и сохраняются в читаемом виде ("10♥").
     """
     now = datetime.now(timezone.utc)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO game_history "
-                "(game_id, user_id, guild_id, bet, result, player_hand, player_score, dealer_hand, dealer_score, timestamp) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);",
-                (
-                    game_id, user_id, guild_id, bet, result,
-                    json.dumps(player_hand), player_score,
-                    json.dumps(dealer_hand), dealer_score, now
-                )
-            )
+    await _queue_history("game_history", [(
+        game_id, user_id, guild_id, bet, result,
+        json.dumps(card_names(player_hand)), player_score,
+        json.dumps(card_names(dealer_hand)), dealer_score, now
+    )])
 
 # ------------------------
 #  Cooldowns (для команд)
 # ------------------------
+# Кулдауны хранятся в памяти процесса и пачками сбрасываются в таблицу cooldowns.
+COOLDOWN_FLUSH_INTERVAL = 5
+COOLDOWN_FLUSH_BATCH = 1000
+
+# (user_id, guild_id, command_name) -> last_used
+_cooldowns = {}
+# Ключи, ещё не записанные в БД
+_cooldowns_dirty = set()
+_cooldowns_warm = False
+_cooldown_flusher_task = None
+
+async def warm_cooldowns():
+    """
+    Загружает таблицу cooldowns в память. Вызывается при старте после init_db().
+    Значения, уже изменённые в памяти, не перезаписываются.
+    """
+    global _cooldowns_warm
+    async with _cursor() as cur:
+        await cur.execute("SELECT user_id, guild_id, command_name, last_used FROM cooldowns;")
+        rows = await cur.fetchall()
+    for user_id, guild_id, command_name, last_used in rows:
+        key = (user_id, guild_id, command_name)
+        if key not in _cooldowns_dirty:
+            _cooldowns[key] = last_used
+    _cooldowns_warm = True
+    logger.info(f"Загружено кулдаунов: {len(rows)}")
+
+def reset_cooldown_cache():
+    """
+    Очищает кулдауны в памяти (после пересоздания схемы).
+    """
+    global _cooldowns_warm
+    _cooldowns.clear()
+    _cooldowns_dirty.clear()
+    _cooldowns_warm = False
+
 async def get_cooldown(user_id: int, guild_id: int, command_name: str) -> int:
     """
     Возвращает last_used или None, если записи нет.
-    """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT last_used FROM cooldowns WHERE user_id=%s AND guild_id=%s AND command_name=%s;", (user_id, guild_id, command_name))
-            row = await cur.fetchone()
-            return row[0] if row else None
+    После warm_cooldowns() отвечает из памяти без запроса к БД.
+    """
+    key = (user_id, guild_id, command_name)
+    if _cooldowns_warm or key in _cooldowns:
+        return _cooldowns.get(key)
+    async with _cursor() as cur:
+        await cur.execute("SELECT last_used FROM cooldowns WHERE user_id=%s AND guild_id=%s AND command_name=%s;", (user_id, guild_id, command_name))
+        row = await cur.fetchone()
+    if row and key not in _cooldowns:
+        _cooldowns[key] = row[0]
+    return row[0] if row else None
 
 async def update_cooldown(user_id: int, guild_id: int, command_name: str, timestamp: int):
     """
-    Вставляет или обновляет last_used для (user_id, guild_id, command_name).
+    Запоминает last_used для (user_id, guild_id, command_name).
+    В БД значение попадает при ближайшем flush_cooldowns().
+    Внутри unit_of_work() применяется только после COMMIT.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
+    key = (user_id, guild_id, command_name)
+
+    def apply():
+        _cooldowns[key] = timestamp
+        _cooldowns_dirty.add(key)
+
+    _after_commit(apply)
+
+async def get_cooldowns(user_id: int, guild_id: int, command_names: list) -> dict:
+    """
+    Возвращает {command_name: last_used} для нескольких команд пользователя
+    (команды без записи в результат не попадают). Промахи до warm_cooldowns()
+    читаются одним запросом.
+    """
+    result = {}
+    missing = []
+    for command_name in command_names:
+        key = (user_id, guild_id, command_name)
+        if key in _cooldowns:
+            result[command_name] = _cooldowns[key]
+        elif not _cooldowns_warm:
+            missing.append(command_name)
+    if missing:
+        async with _cursor() as cur:
             await cur.execute(
-                "INSERT INTO cooldowns (user_id, guild_id, command_name, last_used) "
-                "VALUES (%s, %s, %s, %s) "
-                "ON CONFLICT (user_id, guild_id, command_name) DO UPDATE SET last_used=EXCLUDED.last_used;",
-                (user_id, guild_id, command_name, timestamp)
+                "SELECT command_name, last_used FROM cooldowns "
+                "WHERE user_id=%s AND guild_id=%s AND command_name = ANY(%s);",
+                (user_id, guild_id, missing)
             )
+            rows = await cur.fetchall()
+        for command_name, last_used in rows:
+            _cooldowns.setdefault((user_id, guild_id, command_name), last_used)
+            result[command_name] = last_used
+    return result
+
+async def update_cooldowns(user_id: int, guild_id: int, command_names: list, timestamp: int):
+    """
+    То же, что update_cooldown, сразу для нескольких команд пользователя.
+    """
+    keys = [(user_id, guild_id, command_name) for command_name in command_names]
+
+    def apply():
+        for key in keys:
+            _cooldowns[key] = timestamp
+        _cooldowns_dirty.update(keys)
+
+    _after_commit(apply)
+
+async def flush_cooldowns():
+    """
+    Записывает изменённые кулдауны в таблицу cooldowns пачками upsert-запросов.
+    При ошибке ключи возвращаются в очередь на запись.
+    """
+    if not _cooldowns_dirty:
+        return
+    keys = list(_cooldowns_dirty)
+    _cooldowns_dirty.clear()
+    pool = await get_pool()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                for i in range(0, len(keys), COOLDOWN_FLUSH_BATCH):
+                    chunk = [k for k in keys[i:i + COOLDOWN_FLUSH_BATCH] if k in _cooldowns]
+                    if not chunk:
+                        continue
+                    params = []
+                    for key in chunk:
+                        params.extend((*key, _cooldowns[key]))
+                    values = ", ".join(["(%s, %s, %s, %s)"] * len(chunk))
+                    await cur.execute(
+                        "INSERT INTO cooldowns (user_id, guild_id, command_name, last_used) "
+                        f"VALUES {values} "
+                        "ON CONFLICT (user_id, guild_id, command_name) DO UPDATE SET last_used=EXCLUDED.last_used;",
+                        params
+                    )
+    except Exception as e:
+        # Autocommit: часть пачек могла записаться, повторная запись безопасна
+        _cooldowns_dirty.update(k for k in keys if k in _cooldowns)
+        logger.error(f"Ошибка записи кулдаунов: {e}")
+        raise
+
+async def _cooldown_flusher():
+    while True:
+        await asyncio.sleep(COOLDOWN_FLUSH_INTERVAL)
+        try:
+            await flush_cooldowns()
+        except Exception:
+            # ошибка уже залогирована, ключи повторятся в следующий раз
+            pass
+
+def start_cooldown_flusher():
+    """
+    Запускает фоновую запись кулдаунов (повторный вызов ничего не делает).
+    """
+    global _cooldown_flusher_task
+    if _cooldown_flusher_task is None or _cooldown_flusher_task.done():
+        _cooldown_flusher_task = asyncio.get_running_loop().create_task(_cooldown_flusher())
+
+# ------------------------
+#  Отложенная запись истории (write-behind)
+# ------------------------
+# game_history, roulette_history и transactions пишутся не в пути команды:
+# строки копятся в памяти (внутри unit_of_work() — после COMMIT) и уходят
+# в БД multi-row INSERT-ами в фоне. Каждый INSERT — отдельная (autocommit)
+# транзакция, поэтому сбой одной пачки не откатывает остальные.
+HISTORY_FLUSH_INTERVAL = 2
+# Столько ожидающих строк запускают запись, не дожидаясь интервала
+HISTORY_FLUSH_ROWS = 1000
+# Строк в одном INSERT
+HISTORY_INSERT_BATCH = 1000
+# Сверх стольких ожидающих строк команда сама дожидается записи (backpressure)
+HISTORY_MAX_PENDING = 20000
+# Жёсткий предел очереди: сверх него новые строки отбрасываются с записью в лог
+HISTORY_HARD_LIMIT = 200000
+# Строка, отвергнутая БД столько раз подряд, отбрасывается с записью в лог
+HISTORY_MAX_ATTEMPTS = 3
+
+# таблица -> (INSERT с местом под VALUES, число колонок)
+_HISTORY_INSERTS = {
+    # Пачка, записанная перед обрывом соединения, возвращается в очередь целиком;
+    # ON CONFLICT не даёт такому повтору упасть на первичном ключе. Пропущенные
+    # game_id логируются в _write_history_chunk, так что настоящий дубль не теряется молча.
+    "game_history": (
+        "INSERT INTO game_history "
+        "(game_id, user_id, guild_id, bet, result, player_hand, player_score, dealer_hand, dealer_score, timestamp) "
+        "VALUES {values} ON CONFLICT (game_id) DO NOTHING RETURNING game_id;",
+        10
+    ),
+    "roulette_history": (
+        "INSERT INTO roulette_history "
+        "(roulette_id, result, timestamp, user_id, amount, space, space_type, winnings) "
+        "VALUES {values};",
+        8
+    ),
+    "transactions": (
+        "INSERT INTO transactions "
+        "(user_id, datetime, amount, reason, transaction_type, guild_id) "
+        "VALUES {values};",
+        6
+    )
+}
+
+# таблица -> строки, ожидающие записи (в порядке поступления)
+_history_pending = {table: [] for table in _HISTORY_INSERTS}
+# (таблица, строка) -> сколько раз БД отвергла строку
+_history_failures = {}
+_history_dropped = 0
+_history_lock = None
+_history_wakeup = None
+_history_flusher_task = None
+
+def _history_pending_rows() -> int:
+    return sum(len(rows) for rows in _history_pending.values())
+
+async def _queue_history(table: str, rows: list):
+    """
+    Ставит строки в очередь записи в table. Вне unit_of_work() при переполненной
+    очереди сначала дожидается записи накопленного; внутри транзакции не ждёт
+    (её соединение занято) — там это сделал unit_of_work() до начала.
+    """
+    if _active_uow() is None:
+        await _history_backpressure()
+
+    def apply():
+        global _history_dropped
+        if _history_pending_rows() + len(rows) > HISTORY_HARD_LIMIT:
+            _history_dropped += len(rows)
+            return
+        _history_pending[table].extend(rows)
+        if _history_wakeup is not None and _history_pending_rows() >= HISTORY_FLUSH_ROWS:
+            _history_wakeup.set()
+
+    _after_commit(apply)
+
+async def _history_backpressure():
+    """
+    Если очередь истории переполнена, дожидается её записи.
+    Вызывается, пока у задачи нет занятого соединения.
+    """
+    if _history_pending_rows() >= HISTORY_MAX_PENDING:
+        try:
+            await flush_history()
+        except Exception:
+            # ошибка уже залогирована, строки останутся в очереди
+            pass
+
+def reset_history_queue():
+    """
+    Выбрасывает строки, ожидающие записи (используется при пересоздании схемы).
+    """
+    for rows in _history_pending.values():
+        rows.clear()
+    _history_failures.clear()
+
+async def _write_history_chunk(cur, table: str, chunk: list) -> list:
+    """
+    Пишет chunk одним INSERT. Если БД отвергает данные, делит пачку пополам,
+    чтобы записать всё, кроме виновных строк; строка, отвергнутая
+    HISTORY_MAX_ATTEMPTS раз, отбрасывается с записью в лог.
+    Возвращает строки для повтора. Сетевые ошибки пробрасываются.
+    """
+    sql, width = _HISTORY_INSERTS[table]
+    row_sql = "(" + ", ".join(["%s"] * width) + ")"
+    try:
+        await cur.execute(
+            sql.format(values=", ".join([row_sql] * len(chunk))),
+            [value for row in chunk for value in row]
+        )
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        if len(chunk) > 1:
+            middle = len(chunk) // 2
+            return (
+                await _write_history_chunk(cur, table, chunk[:middle])
+                + await _write_history_chunk(cur, table, chunk[middle:])
+            )
+        key = (table, chunk[0])
+        attempts = _history_failures.get(key, 0) + 1
+        if attempts >= HISTORY_MAX_ATTEMPTS:
+            _history_failures.pop(key, None)
+            logger.error(f"Строка {table} отброшена после {attempts} попыток: {chunk[0]!r}: {e}")
+            return []
+        _history_failures[key] = attempts
+        logger.warning(f"Строка {table} отвергнута (попытка {attempts}): {e}")
+        return chunk
+    if table == "game_history":
+        written = {row[0] for row in await cur.fetchall()}
+        skipped = [row[0] for row in chunk if row[0] not in written]
+        if skipped:
+            logger.warning(f"game_history: пропущено {len(skipped)} строк с уже записанным game_id: {skipped}")
+    for row in chunk:
+        _history_failures.pop((table, row), None)
+    return []
+
+async def flush_history():
+    """
+    Записывает накопленную историю multi-row INSERT-ами по HISTORY_INSERT_BATCH строк.
+    Отвергнутые БД строки возвращаются в начало очереди (см. _write_history_chunk),
+    при сетевой ошибке туда же возвращается всё незаписанное.
+    """
+    global _history_lock, _history_dropped
+    if _history_lock is None:
+        _history_lock = asyncio.Lock()
+    async with _history_lock:
+        if _history_dropped:
+            logger.error(f"Очередь истории переполнена, отброшено строк: {_history_dropped}")
+            _history_dropped = 0
+        batch = {table: rows for table, rows in _history_pending.items() if rows}
+        if not batch:
+            return
+        for table in batch:
+            _history_pending[table] = []
+        retry = {table: [] for table in batch}
+        pool = await get_pool()
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    for table, rows in batch.items():
+                        while rows:
+                            chunk = rows[:HISTORY_INSERT_BATCH]
+                            retry[table] += await _write_history_chunk(cur, table, chunk)
+                            rows = batch[table] = rows[HISTORY_INSERT_BATCH:]
+        except BaseException as e:
+            logger.error(f"Ошибка записи истории: {e}")
+            raise
+        finally:
+            # Незаписанное и отвергнутое — обратно в начало очереди, в исходном порядке
+            for table in batch:
+                _history_pending[table][:0] = retry[table] + batch[table]
+
+async def _history_flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_history_wakeup.wait(), HISTORY_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _history_wakeup.clear()
+        try:
+            await flush_history()
+        except Exception:
+            # ошибка уже залогирована, строки повторятся в следующий раз
+            pass
+
+def start_history_flusher():
+    """
+    Запускает фоновую запись истории (повторный вызов ничего не делает).
+    """
+    global _history_wakeup, _history_flusher_task
+    if _history_wakeup is None:
+        _history_wakeup = asyncio.Event()
+    if _history_flusher_task is None or _history_flusher_task.done():
+        _history_flusher_task = asyncio.get_running_loop().create_task(_history_flusher())
 
 # ------------------------
 #  Лог переводов (transactions)
@@ -656,26 +1617,35 @@ async def log_transfer(
     fee: int
 ):
     """
-    Делает две записи в transactions:
+    Ставит в очередь записи (flush_history) две записи transactions:
     1) списание у sender_id
     2) зачисление receiver_id (amount - fee)
     """
     now = datetime.now(timezone.utc)
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO transactions "
-                "(user_id, datetime, amount, reason, transaction_type, guild_id) "
-                "VALUES (%s, %s, %s, %s, %s, %s);",
-                (sender_id, now, -amount, f"Платёж пользователю {receiver_id}", "write-off", guild_id)
-            )
-            await cur.execute(
-                "INSERT INTO transactions "
-                "(user_id, datetime, amount, reason, transaction_type, guild_id) "
-                "VALUES (%s, %s, %s, %s, %s, %s);",
-                (receiver_id, now, amount - fee, f"Платёж от {sender_id}", "receipt", guild_id)
-            )
+    await _queue_history("transactions", [
+        (sender_id, now, -amount, f"Платёж пользователю {receiver_id}", "write-off", guild_id),
+        (receiver_id, now, amount - fee, f"Платёж от {sender_id}", "receipt", guild_id)
+    ])
+
+async def _with_deadlock_retry(body, keys, retries: int, delay: float):
+    """
+    Выполняет body() в отдельной транзакции, повторяя её при дедлоке.
+    Внутри уже открытой unit_of_work() повторять нечего — откатится
+    вся внешняя транзакция, поэтому body() вызывается один раз.
+    """
+    if _active_uow() is not None:
+        return await body()
+    for attempt in range(retries):
+        try:
+            async with unit_of_work():
+                return await body()
+        except Exception as e:
+            for user_id, guild_id in keys:
+                invalidate_balance_cache(user_id, guild_id)
+            if "deadlock" in str(e).lower() and attempt < retries - 1:
+                await asyncio.sleep(delay)
+                continue
+            raise
 
 async def transfer_cash(
     sender_id: int,
@@ -688,42 +1658,26 @@ async def transfer_cash(
 ) -> tuple:
     """
     Переводит из cash у sender_id → cash у receiver_id, удерживая fee.
+    Списание, зачисление и лог выполняются в одной транзакции.
     При дедлоке повторяет до retries раз.
     Возвращает (новый_cash_sender, новый_cash_receiver).
     """
-    await ensure_user_exists(sender_id, guild_id)
-    await ensure_user_exists(receiver_id, guild_id)
-    pool = await get_pool()
+    async def body():
+        new_sender_cash, _ = await adjust_balance(
+            sender_id, guild_id, cash_delta=-amount, guard="cash",
+            error="Недостаточно средств для перевода.", reason=f"Платёж пользователю {receiver_id}"
+        )
+        new_receiver_cash, _ = await adjust_balance(
+            receiver_id, guild_id, cash_delta=amount - fee, reason=f"Платёж от {sender_id}"
+        )
 
-    for attempt in range(retries):
-        try:
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("SELECT cash FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (sender_id, guild_id))
-                    sender_cash = (await cur.fetchone())[0]
-                    if sender_cash < amount:
-                        raise ValueError("Недостаточно средств для перевода.")
-
-                    await cur.execute("UPDATE users SET cash=cash-%s WHERE user_id=%s AND guild_id=%s;", (amount, sender_id, guild_id))
-                    recv_amount = amount - fee
-                    await cur.execute("UPDATE users SET cash=cash+%s WHERE user_id=%s AND guild_id=%s;", (recv_amount, receiver_id, guild_id))
-
-                    # Логируем обе операции
-                    await log_transfer(guild_id, sender_id, receiver_id, amount, fee)
+        # Логируем обе операции
+        await log_transfer(guild_id, sender_id, receiver_id, amount, fee)
+        return (new_sender_cash, new_receiver_cash)
 
-                    # Читаем новые балансы
-                    await cur.execute("SELECT cash FROM users WHERE user_id=%s AND guild_id=%s;", (sender_id, guild_id))
-                    new_sender_cash = (await cur.fetchone())[0]
-                    await cur.execute("SELECT cash FROM users WHERE user_id=%s AND guild_id=%s;", (receiver_id, guild_id))
-                    new_receiver_cash = (await cur.fetchone())[0]
-
-                    return (new_sender_cash, new_receiver_cash)
-
-        except Exception as e:
-            if "deadlock" in str(e).lower() and attempt < retries - 1:
-                await asyncio.sleep(delay)
-                continue
-            raise
+    return await _with_deadlock_retry(
+        body, [(sender_id, guild_id), (receiver_id, guild_id)], retries, delay
+    )
 
 async def rob_user(
     robber_id: int,
@@ -740,50 +1694,42 @@ async def rob_user(
     """
     await ensure_user_exists(robber_id, guild_id)
     await ensure_user_exists(target_id, guild_id)
-    pool = await get_pool()
 
-    for attempt in range(retries):
-        try:
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    # Блокируем цель
-                    await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (target_id, guild_id))
-                    tgt_row = await cur.fetchone()
-                    if not tgt_row:
-                        raise ValueError("Цель не найдена.")
-                    target_cash, target_bank = tgt_row
-
-                    steal = min(target_cash, stolen_amount)
-                    await cur.execute("UPDATE users SET cash=%s WHERE user_id=%s AND guild_id=%s;", (target_cash - steal, target_id, guild_id))
-
-                    # Блокируем грабителя
-                    await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (robber_id, guild_id))
-                    rob_row = await cur.fetchone()
-                    if not rob_row:
-                        raise ValueError("Грабитель не найден.")
-                    robber_cash, robber_bank = rob_row
-
-                    await cur.execute("UPDATE users SET cash=%s WHERE user_id=%s AND guild_id=%s;", (robber_cash + steal, robber_id, guild_id))
-
-                    now = datetime.now(timezone.utc)
-                    await cur.execute(
-                        "INSERT INTO transactions (user_id, datetime, amount, reason, transaction_type, guild_id) "
-                        "VALUES (%s, %s, %s, %s, %s, %s);",
-                        (target_id, now, -steal, f"Ограбление пользователем {robber_id}", "write-off", guild_id)
-                    )
-                    await cur.execute(
-                        "INSERT INTO transactions (user_id, datetime, amount, reason, transaction_type, guild_id) "
-                        "VALUES (%s, %s, %s, %s, %s, %s);",
-                        (robber_id, now, steal, f"Ограбление у {target_id}", "receipt", guild_id)
-                    )
+    async def body():
+        async with _cursor() as cur:
+            # Блокируем цель
+            await cur.execute("SELECT cash, bank FROM users WHERE user_id=%s AND guild_id=%s FOR UPDATE;", (target_id, guild_id))
+            tgt_row = await cur.fetchone()
+            if not tgt_row:
+                raise ValueError("Цель не найдена.")
+            target_cash, target_bank = tgt_row
 
-                    return (robber_cash + steal, robber_bank, target_cash - steal, target_bank)
+            steal = min(target_cash, stolen_amount)
+            await cur.execute("UPDATE users SET cash=%s WHERE user_id=%s AND guild_id=%s;", (target_cash - steal, target_id, guild_id))
+            _cache_put_balance(target_id, guild_id, target_cash - steal, target_bank)
+            _audit(target_id, guild_id, -steal, 0, f"Ограбление пользователем {robber_id}")
 
-        except Exception as e:
-            if "deadlock" in str(e).lower() and attempt < retries - 1:
-                await asyncio.sleep(delay)
-                continue
-            raise
+            await cur.execute(
+                "UPDATE users SET cash=cash+%s WHERE user_id=%s AND guild_id=%s RETURNING cash, bank;",
+                (steal, robber_id, guild_id)
+            )
+            rob_row = await cur.fetchone()
+            if not rob_row:
+                raise ValueError("Грабитель не найден.")
+            robber_cash, robber_bank = rob_row
+            _cache_put_balance(robber_id, guild_id, robber_cash, robber_bank)
+            _audit(robber_id, guild_id, steal, 0, f"Ограбление у {target_id}")
+
+            now = datetime.now(timezone.utc)
+            await _queue_history("transactions", [
+                (target_id, now, -steal, f"Ограбление пользователем {robber_id}", "write-off", guild_id),
+                (robber_id, now, steal, f"Ограбление у {target_id}", "receipt", guild_id)
+            ])
+            return (robber_cash, robber_bank, target_cash - steal, target_bank)
+
+    return await _with_deadlock_retry(
+        body, [(robber_id, guild_id), (target_id, guild_id)], retries, delay
+    )
 
 # ------------------------
 #  Магазин и инвентарь
@@ -792,102 +1738,86 @@ async def add_shop_item(item_type: str, name: str, description: str, price: int,
     """
     Добавляет новый товар и возвращает его item_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO shop_items (type, name, description, price, external_id, active) "
-                "VALUES (%s, %s, %s, %s, %s, TRUE) RETURNING item_id;",
-                (item_type, name, description, price, external_id)
-            )
-            row = await cur.fetchone()
-            return row[0]
+    async with _cursor() as cur:
+        await cur.execute(
+            "INSERT INTO shop_items (type, name, description, price, external_id, active) "
+            "VALUES (%s, %s, %s, %s, %s, TRUE) RETURNING item_id;",
+            (item_type, name, description, price, external_id)
+        )
+        row = await cur.fetchone()
+        return row[0]
 
 async def update_shop_item(item_id: int, item_type: str, name: str, description: str, price: int, external_id: str = None):
     """
     Обновляет поля существующего товара по item_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "UPDATE shop_items SET type=%s, name=%s, description=%s, price=%s, external_id=%s "
-                "WHERE item_id=%s;",
-                (item_type, name, description, price, external_id, item_id)
-            )
+    async with _cursor() as cur:
+        await cur.execute(
+            "UPDATE shop_items SET type=%s, name=%s, description=%s, price=%s, external_id=%s "
+            "WHERE item_id=%s;",
+            (item_type, name, description, price, external_id, item_id)
+        )
 
 async def deactivate_shop_item(item_id: int):
     """
     Деактивирует товар (active=FALSE) и удаляет его из всех инвентарей.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("UPDATE shop_items SET active=FALSE WHERE item_id=%s;", (item_id,))
-            await cur.execute("DELETE FROM user_inventory WHERE item_id=%s;", (item_id,))
+    async with _cursor() as cur:
+        await cur.execute("UPDATE shop_items SET active=FALSE WHERE item_id=%s;", (item_id,))
+        await cur.execute("DELETE FROM user_inventory WHERE item_id=%s;", (item_id,))
 
 async def get_shop_items(category: str = None) -> list:
     """
     Если category="all", возвращает все активные товары.
     Иначе только type=category.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            if category == "all":
-                await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE active=TRUE ORDER BY price ASC, item_id ASC;")
-            else:
-                await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE type=%s AND active=TRUE ORDER BY price ASC, item_id ASC;", (category,))
-            return await cur.fetchall()
+    async with _cursor() as cur:
+        if category == "all":
+            await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE active=TRUE ORDER BY price ASC, item_id ASC;")
+        else:
+            await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE type=%s AND active=TRUE ORDER BY price ASC, item_id ASC;", (category,))
+        return await cur.fetchall()
 
 async def get_shop_item_by_id(item_id: int) -> tuple:
     """
     Возвращает (item_id, type, name, description, price, external_id) или None.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE item_id=%s AND active=TRUE;", (item_id,))
-            return await cur.fetchone()
+    async with _cursor() as cur:
+        await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE item_id=%s AND active=TRUE;", (item_id,))
+        return await cur.fetchone()
 
 async def get_shop_item_by_external(external_id: str) -> tuple:
     """
     Возвращает (item_id, type, name, description, price, external_id) или None.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE external_id=%s AND active=TRUE;", (external_id,))
-            return await cur.fetchone()
+    async with _cursor() as cur:
+        await cur.execute("SELECT item_id, type, name, description, price, external_id FROM shop_items WHERE external_id=%s AND active=TRUE;", (external_id,))
+        return await cur.fetchone()
 
 async def get_shop_item_by_name(name: str) -> tuple:
     """
     Возвращает (item_id, type, name, description, price, external_id) или None
     для товара с данным name (нечувствительно к регистру).
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT item_id, type, name, description, price, external_id
 FROM shop_items
 WHERE LOWER(name) = LOWER(%s) AND active = TRUE;
 """, (name,))
-            return await cur.fetchone()
+        return await cur.fetchone()
 
 async def get_all_shop_items() -> list:
     """
     Возвращает все товары (включая неактивные) для админки.
     Формат: [(item_id, type, name, description, price, external_id, active), …]
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT item_id, type, name, description, price, external_id, active
 FROM shop_items;
 """)
-            return await cur.fetchall()
+        return await cur.fetchall()
 
 # ------------------------
 #  Инвентарь пользователя
@@ -897,31 +1827,45 @@ async def add_to_inventory(user_id: int, item_id: int, count: int = 1) -> None:
     Добавляет count штук item_id в инвентарь пользователя.
     Если уже есть, увеличивает quantity.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 INSERT INTO user_inventory (user_id, item_id, quantity)
 VALUES (%s, %s, %s)
 ON CONFLICT (user_id, item_id) DO UPDATE
   SET quantity = user_inventory.quantity + EXCLUDED.quantity;
 """, (user_id, item_id, count))
 
+async def add_to_inventory_many(user_id: int, counts: dict) -> None:
+    """
+    То же, что add_to_inventory, для нескольких предметов одним запросом:
+    counts = {item_id: count}.
+    """
+    if not counts:
+        return
+    rows = sorted(counts.items())
+    values = ", ".join(["(%s, %s, %s)"] * len(rows))
+    params = [v for item_id, count in rows for v in (user_id, item_id, count)]
+    async with _cursor() as cur:
+        await cur.execute(f"""
+INSERT INTO user_inventory (user_id, item_id, quantity)
+VALUES {values}
+ON CONFLICT (user_id, item_id) DO UPDATE
+  SET quantity = user_inventory.quantity + EXCLUDED.quantity;
+""", params)
+
 async def get_user_inventory(user_id: int) -> list:
     """
     Возвращает [(item_id, quantity, name, description), …] активных предметов.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT ui.item_id, ui.quantity, si.name, si.description
 FROM user_inventory ui
 JOIN shop_items si ON ui.item_id = si.item_id
 WHERE ui.user_id=%s AND si.active=TRUE
 ORDER BY si.name;
 """, (user_id,))
-            return await cur.fetchall()
+        return await cur.fetchall()
 
 async def remove_from_inventory(user_id: int, item_id: int, count: int = 1) -> int:
     """
@@ -929,21 +1873,19 @@ async def remove_from_inventory(user_id: int, item_id: int, count: int = 1) -> i
     Если quantity <= count, удаляет запись.
     Возвращает реально удалённое количество.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT quantity FROM user_inventory WHERE user_id=%s AND item_id=%s FOR UPDATE;", (user_id, item_id))
-            row = await cur.fetchone()
-            if not row:
-                return 0
-            current_qty = row[0]
-            to_remove = min(current_qty, count)
-            new_qty = current_qty - to_remove
-            if new_qty > 0:
-                await cur.execute("UPDATE user_inventory SET quantity=%s WHERE user_id=%s AND item_id=%s;", (new_qty, user_id, item_id))
-            else:
-                await cur.execute("DELETE FROM user_inventory WHERE user_id=%s AND item_id=%s;", (user_id, item_id))
-            return to_remove
+    async with _cursor() as cur:
+        await cur.execute("SELECT quantity FROM user_inventory WHERE user_id=%s AND item_id=%s FOR UPDATE;", (user_id, item_id))
+        row = await cur.fetchone()
+        if not row:
+            return 0
+        current_qty = row[0]
+        to_remove = min(current_qty, count)
+        new_qty = current_qty - to_remove
+        if new_qty > 0:
+            await cur.execute("UPDATE user_inventory SET quantity=%s WHERE user_id=%s AND item_id=%s;", (new_qty, user_id, item_id))
+        else:
+            await cur.execute("DELETE FROM user_inventory WHERE user_id=%s AND item_id=%s;", (user_id, item_id))
+        return to_remove
 
 # ------------------------
 #  CockFight (шанс)
@@ -953,26 +1895,22 @@ async def get_cock_fight_chance(user_id: int, guild_id: int) -> int:
     Получение текущего шанса победы в CockFight (0–100).
     Если записи нет — возвращает None.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT chance FROM cock_fight_chance WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
-            row = await cur.fetchone()
-            return row[0] if row else None
+    async with _cursor() as cur:
+        await cur.execute("SELECT chance FROM cock_fight_chance WHERE user_id=%s AND guild_id=%s;", (user_id, guild_id))
+        row = await cur.fetchone()
+        return row[0] if row else None
 
 async def update_cock_fight_chance(user_id: int, guild_id: int, chance: int):
     """
     Вставляет или обновляет шанс (0–100) для CockFight.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "INSERT INTO cock_fight_chance (user_id, guild_id, chance) "
-                "VALUES (%s, %s, %s) "
-                "ON CONFLICT (user_id, guild_id) DO UPDATE SET chance=EXCLUDED.chance;",
-                (user_id, guild_id, chance)
-            )
+    async with _cursor() as cur:
+        await cur.execute(
+            "INSERT INTO cock_fight_chance (user_id, guild_id, chance) "
+            "VALUES (%s, %s, %s) "
+            "ON CONFLICT (user_id, guild_id) DO UPDATE SET chance=EXCLUDED.chance;",
+            (user_id, guild_id, chance)
+        )
 
 # ------------------------
 #  Case‐логика
@@ -982,32 +1920,51 @@ async def get_all_cases() -> list:
     Возвращает список всех активных кейсов:
     [(item_id, name, description, price, external_id), …]
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT item_id, name, description, price, external_id
 FROM shop_items
 WHERE type='case' AND active=TRUE
 ORDER BY price ASC, item_id ASC;
 """)
-            return await cur.fetchall()
+        return await cur.fetchall()
 
 async def get_case_contents(case_external: str) -> list:
     """
     Возвращает список дропов для кейса case_external:
     [(id, reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name), …]
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT id, reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name
 FROM case_contents
 WHERE case_external=%s
 ORDER BY id ASC;
 """, (case_external,))
-            return await cur.fetchall()
+        return await cur.fetchall()
+
+# case_external -> DropTable (сбрасывается при изменении case_contents)
+_drop_tables = {}
+
+def invalidate_drop_table(case_external: str = None):
+    """
+    Сбрасывает скомпилированные таблицы дропа: все (без аргумента) или одного кейса.
+    """
+    if case_external is None:
+        _drop_tables.clear()
+    else:
+        _drop_tables.pop(case_external, None)
+
+async def get_case_drop_table(case_external: str) -> DropTable:
+    """
+    Возвращает скомпилированную таблицу дропа кейса (DropTable).
+    Строится из get_case_contents() один раз и кэшируется до изменения дропов.
+    """
+    table = _drop_tables.get(case_external)
+    if table is None:
+        table = DropTable(row for row in await get_case_contents(case_external) if len(row) == 7)
+        _drop_tables[case_external] = table
+    return table
 
 async def add_case_content(
     case_external: str,
@@ -1021,17 +1978,16 @@ async def add_case_content(
     """
     Добавляет новую запись дропа для кейса. Возвращает id вставленной записи.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 INSERT INTO case_contents
   (case_external, reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name)
 VALUES (%s, %s, %s, %s, %s, %s, %s)
 RETURNING id;
 """, (case_external, reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name))
-            row = await cur.fetchone()
-            return row[0] if row else None
+        row = await cur.fetchone()
+    _after_commit(lambda: invalidate_drop_table(case_external))
+    return row[0] if row else None
 
 async def update_case_content(
     content_id: int,
@@ -1045,10 +2001,8 @@ async def update_case_content(
     """
     Обновляет существующую запись дропа по content_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 UPDATE case_contents
 SET reward_type=%s,
     reward_value=%s,
@@ -1056,28 +2010,46 @@ SET reward_type=%s,
     duration_secs=%s,
     comp_coins=%s,
     hidden_name=%s
-WHERE id=%s;
+WHERE id=%s
+RETURNING case_external;
 """, (reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name, content_id))
+        row = await cur.fetchone()
+    if row:
+        _after_commit(lambda: invalidate_drop_table(row[0]))
 
 async def delete_case_content(content_id: int):
     """
     Удаляет запись дропа по content_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("DELETE FROM case_contents WHERE id=%s;", (content_id,))
+    async with _cursor() as cur:
+        await cur.execute("DELETE FROM case_contents WHERE id=%s RETURNING case_external;", (content_id,))
+        row = await cur.fetchone()
+    if row:
+        _after_commit(lambda: invalidate_drop_table(row[0]))
 
 async def get_item_id_by_external(external_id: str) -> int:
     """
     Возвращает item_id (int) из shop_items по external_id.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT item_id FROM shop_items WHERE external_id=%s AND active=TRUE;", (external_id,))
-            row = await cur.fetchone()
-            return row[0] if row else None
+    async with _cursor() as cur:
+        await cur.execute("SELECT item_id FROM shop_items WHERE external_id=%s AND active=TRUE;", (external_id,))
+        row = await cur.fetchone()
+        return row[0] if row else None
+
+async def get_item_ids_by_external(external_ids) -> dict:
+    """
+    Возвращает {external_id: item_id} активных товаров одним запросом.
+    Неизвестные external_id в результат не попадают.
+    """
+    external_ids = list(set(external_ids))
+    if not external_ids:
+        return {}
+    async with _cursor() as cur:
+        await cur.execute(
+            "SELECT external_id, item_id FROM shop_items WHERE external_id = ANY(%s) AND active=TRUE;",
+            (external_ids,)
+        )
+        return {external_id: item_id for external_id, item_id in await cur.fetchall()}
 
 async def decrement_inventory(user_id: int, item_id: int, count: int = 1):
     """
@@ -1095,39 +2067,161 @@ async def add_or_update_temp_role(user_id: int, guild_id: int, role_id: int, exp
     Вставляет новую запись в user_temp_roles или обновляет существующую:
     ON CONFLICT (user_id, guild_id, role_id) DO UPDATE SET expires_at = EXCLUDED.expires_at.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 INSERT INTO user_temp_roles (user_id, guild_id, role_id, expires_at)
 VALUES (%s, %s, %s, %s)
 ON CONFLICT (user_id, guild_id, role_id) DO UPDATE
   SET expires_at = EXCLUDED.expires_at;
 """, (user_id, guild_id, role_id, expires_at))
 
+async def add_or_update_temp_roles(user_id: int, guild_id: int, expirations: dict) -> set:
+    """
+    То же, что add_or_update_temp_role, для нескольких ролей одним запросом:
+    expirations = {role_id: expires_at}.
+    Возвращает role_id, для которых запись вставлена заново (а не продлена):
+    эти роли нужно выдать, даже если в памяти бота они ещё числятся активными.
+    """
+    if not expirations:
+        return set()
+    rows = sorted(expirations.items())
+    values = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+    params = [v for role_id, expires_at in rows for v in (user_id, guild_id, role_id, expires_at)]
+    async with _cursor() as cur:
+        await cur.execute(f"""
+INSERT INTO user_temp_roles (user_id, guild_id, role_id, expires_at)
+VALUES {values}
+ON CONFLICT (user_id, guild_id, role_id) DO UPDATE
+  SET expires_at = EXCLUDED.expires_at
+RETURNING role_id, (xmax = 0) AS inserted;
+""", params)
+        return {role_id for role_id, inserted in await cur.fetchall() if inserted}
+
 async def remove_temp_role_record(user_id: int, guild_id: int, role_id: int):
     """
     Удаляет запись о временной роли из user_temp_roles.
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 DELETE FROM user_temp_roles
 WHERE user_id = %s AND guild_id = %s AND role_id = %s;
 """, (user_id, guild_id, role_id))
 
+async def pop_expired_temp_roles(cutoff_ts: int) -> list:
+    """
+    Удаляет все временные роли, истёкшие к моменту cutoff_ts (unix-время),
+    одним запросом и возвращает их: [(user_id, guild_id, role_id), …].
+    Срез передаёт вызывающий: часы БД могут отставать от часов бота, и по NOW()
+    запись, уже снятая с кучи планировщика, осталась бы в таблице.
+    """
+    async with _cursor() as cur:
+        await cur.execute("""
+DELETE FROM user_temp_roles
+WHERE expires_at <= to_timestamp(%s)
+RETURNING user_id, guild_id, role_id;
+""", (cutoff_ts,))
+        return await cur.fetchall()
+
 async def get_all_active_temp_roles() -> list:
     """
     Возвращает список всех активных временных ролей (expires_at > NOW()):
     [(user_id, guild_id, role_id, expires_at), …]
     """
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
+    async with _cursor() as cur:
+        await cur.execute("""
 SELECT user_id, guild_id, role_id, expires_at
 FROM user_temp_roles
 WHERE expires_at > NOW();
 """)
-            return await cur.fetchall()
+        return await cur.fetchall()
+
+# ------------------------
+#  Очередь изменений ролей (outbox)
+# ------------------------
+# Команды пишут сюда в своей транзакции, а воркер utils.role_outbox
+# применяет изменения в Discord уже после ответа пользователю.
+ROLE_ACTIONS = ("add", "remove")
+
+# Будит воркер после коммита новых записей (создаётся лениво в цикле бота)
+_role_outbox_event = None
+
+def _role_outbox_signal() -> asyncio.Event:
+    global _role_outbox_event
+    if _role_outbox_event is None:
+        _role_outbox_event = asyncio.Event()
+    return _role_outbox_event
+
+async def enqueue_role_changes(changes: list, reason: str = None):
+    """
+    Ставит изменения ролей в очередь одним запросом:
+    changes = [(user_id, guild_id, role_id, 'add' | 'remove'), …].
+    Внутри unit_of_work() записи видны воркеру только после COMMIT.
+    """
+    if not changes:
+        return
+    for change in changes:
+        if change[3] not in ROLE_ACTIONS:
+            raise ValueError(f"Неизвестное действие с ролью: {change[3]}")
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(changes))
+    params = [v for user_id, guild_id, role_id, action in changes for v in (user_id, guild_id, role_id, action, reason)]
+    async with _cursor() as cur:
+        await cur.execute(f"""
+INSERT INTO role_outbox (user_id, guild_id, role_id, action, reason)
+VALUES {values};
+""", params)
+    _after_commit(_role_outbox_signal().set)
+
+async def wait_role_outbox(timeout: float):
+    """
+    Ждёт новых записей в role_outbox не дольше timeout секунд.
+    """
+    event = _role_outbox_signal()
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+async def get_due_role_changes(limit: int) -> list:
+    """
+    Возвращает наступившие записи очереди в порядке постановки:
+    [(id, user_id, guild_id, role_id, action, reason, attempts), …].
+    Участники с отложенным повтором пропускаются целиком: их более поздние
+    записи не должны обогнать неудавшиеся, иначе нарушится порядок действий.
+    """
+    async with _cursor() as cur:
+        await cur.execute("""
+SELECT o.id, o.user_id, o.guild_id, o.role_id, o.action, o.reason, o.attempts
+FROM role_outbox AS o
+WHERE o.next_attempt <= NOW()
+  AND NOT EXISTS (
+    SELECT 1 FROM role_outbox AS d
+    WHERE d.guild_id = o.guild_id AND d.user_id = o.user_id AND d.next_attempt > NOW()
+  )
+ORDER BY o.id
+LIMIT %s;
+""", (limit,))
+        return await cur.fetchall()
+
+async def complete_role_changes(ids: list):
+    """
+    Удаляет применённые (или отброшенные) записи очереди.
+    """
+    if not ids:
+        return
+    async with _cursor() as cur:
+        await cur.execute("DELETE FROM role_outbox WHERE id = ANY(%s);", (list(ids),))
+
+async def retry_role_changes(ids: list, delay_secs: float):
+    """
+    Откладывает записи очереди на delay_secs секунд и увеличивает счётчик попыток.
+    """
+    if not ids:
+        return
+    async with _cursor() as cur:
+        await cur.execute("""
+UPDATE role_outbox
+SET attempts = attempts + 1,
+    next_attempt = NOW() + make_interval(secs => %s)
+WHERE id = ANY(%s);
+""", (delay_secs, list(ids)))
@@ -0,0 +1,71 @@
+import random
+from collections import Counter
+
+# ------------------------
+#  Таблица дропа кейса (метод Уолкера / alias method)
+# ------------------------
+class DropTable:
+    """
+    Скомпилированная таблица дропа: выбор одной строки за O(1) на один random().
+    rows — строки case_contents в порядке id:
+    (id, reward_type, reward_value, chance, duration_secs, comp_coins, hidden_name).
+    """
+    __slots__ = ("rows", "total_chance", "_prob", "_alias")
+
+    def __init__(self, rows):
+        self.rows = tuple(rows)
+        weights = [float(row[3]) for row in self.rows]
+        self.total_chance = sum(weights)
+        self._prob, self._alias = self._build(weights)
+
+    @staticmethod
+    def _build(weights):
+        # Алгоритм Воуза: каждая ячейка i хранит порог prob[i] и альтернативу alias[i]
+        n = len(weights)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            return [], []
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Остатки из-за погрешности округления — полные ячейки
+        for i in small + large:
+            prob[i] = 1.0
+        return prob, alias
+
+    def __bool__(self) -> bool:
+        return bool(self._prob)
+
+    def draw_indices(self, count: int, rng: random.Random = None) -> list:
+        """count индексов строк rows (по одному random() на выбор)."""
+        if not self._prob:
+            return []
+        rnd = (rng or random).random
+        n = len(self._prob)
+        prob = self._prob
+        alias = self._alias
+        result = []
+        append = result.append
+        for _ in range(count):
+            x = rnd() * n
+            i = int(x)
+            append(i if x - i < prob[i] else alias[i])
+        return result
+
+    def draw(self, count: int, rng: random.Random = None) -> list:
+        """count выпавших строк rows."""
+        rows = self.rows
+        return [rows[i] for i in self.draw_indices(count, rng)]
+
+    def draw_counts(self, count: int, rng: random.Random = None) -> Counter:
+        """{индекс строки: сколько раз выпала} для count открытий."""
+        return Counter(self.draw_indices(count, rng))
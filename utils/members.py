@@ -0,0 +1,81 @@
+import time
+import logging
+import disnake
+
+# ------------------------
+#  Настройка логирования
+# ------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Сколько секунд хранится найденное имя
+NAME_CACHE_TTL = 600
+# Максимум user_ids в одном запросе участников через gateway
+QUERY_CHUNK_SIZE = 100
+
+UNKNOWN_USER_NAME = "Неизвестный пользователь"
+
+# (guild_id, user_id) -> (display_name, время истечения)
+_name_cache = {}
+
+async def resolve_members(guild: disnake.Guild, user_ids) -> dict:
+    """
+    Возвращает {user_id: Member} для участников guild.
+    Сначала смотрит в кэш участников gateway, промахи запрашивает
+    пачками по QUERY_CHUNK_SIZE через guild.query_members (без REST).
+    Ушедших с сервера пользователей в результате нет.
+    """
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        member = guild.get_member(user_id)
+        if member is not None:
+            found[user_id] = member
+        else:
+            missing.append(user_id)
+
+    for i in range(0, len(missing), QUERY_CHUNK_SIZE):
+        chunk = missing[i:i + QUERY_CHUNK_SIZE]
+        try:
+            members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+        except Exception as e:
+            logger.error(f"Ошибка запроса участников guild={guild.id}: {e}")
+            continue
+        for member in members:
+            found[member.id] = member
+    return found
+
+async def resolve_display_names(bot, guild: disnake.Guild, user_ids) -> dict:
+    """
+    Возвращает {user_id: display_name}.
+    Имена берутся из TTL-кэша, затем из resolve_members, затем из кэша
+    пользователей бота; не найденные получают UNKNOWN_USER_NAME и тоже
+    кэшируются, чтобы перелистывание страниц не повторяло запросы.
+    """
+    now = time.monotonic()
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        cached = _name_cache.get((guild.id, user_id))
+        if cached is not None and cached[1] > now:
+            names[user_id] = cached[0]
+        else:
+            missing.append(user_id)
+
+    if missing:
+        members = await resolve_members(guild, missing)
+        expires = now + NAME_CACHE_TTL
+        for user_id in missing:
+            member = members.get(user_id)
+            if member is not None:
+                name = member.display_name
+            else:
+                user = bot.get_user(user_id)
+                name = user.display_name if user else UNKNOWN_USER_NAME
+            names[user_id] = name
+            _name_cache[(guild.id, user_id)] = (name, expires)
+
+        # Заодно выбрасываем просроченные записи
+        for key in [k for k, (_, exp) in _name_cache.items() if exp <= now]:
+            del _name_cache[key]
+    return names
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import disnake
+
+from utils.database import get_due_role_changes, complete_role_changes, retry_role_changes, wait_role_outbox
+from utils.members import resolve_members
+
+# ------------------------
+#  Настройка логирования
+# ------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Записей очереди за один проход
+ROLE_OUTBOX_BATCH = 500
+# Как часто воркер проверяет отложенные повторы без нового сигнала (секунды)
+ROLE_OUTBOX_POLL = 5
+# Задержка повтора: ROLE_OUTBOX_BACKOFF * 2 ** attempts, не больше ROLE_OUTBOX_MAX_BACKOFF
+ROLE_OUTBOX_BACKOFF = 5
+ROLE_OUTBOX_MAX_BACKOFF = 600
+# После стольких неудачных попыток запись отбрасывается
+ROLE_OUTBOX_MAX_ATTEMPTS = 8
+
+_role_outbox_task = None
+
+def _merge_changes(rows) -> dict:
+    """
+    Сворачивает записи очереди по участникам:
+    {(guild_id, user_id): {"ids": [...], "roles": {role_id: action}, "reason": ..., "attempts": ...}}.
+    Для одной роли побеждает последнее по порядку действие.
+    """
+    members = {}
+    for row_id, user_id, guild_id, role_id, action, reason, attempts in rows:
+        entry = members.setdefault((guild_id, user_id), {"ids": [], "roles": {}, "reason": reason, "attempts": 0})
+        entry["ids"].append(row_id)
+        entry["roles"][role_id] = action
+        entry["attempts"] = max(entry["attempts"], attempts)
+        if reason:
+            entry["reason"] = reason
+    return members
+
+async def _apply_member(guild: disnake.Guild, member: disnake.Member, entry: dict):
+    """
+    Применяет все изменения ролей участника одним member.edit(roles=...).
+    """
+    current = member.roles[1:]  # без @everyone
+    current_ids = {role.id for role in current}
+    new_roles = [role for role in current if entry["roles"].get(role.id) != "remove"]
+    for role_id, action in entry["roles"].items():
+        if action == "add" and role_id not in current_ids:
+            role = guild.get_role(role_id)
+            if role is not None:
+                new_roles.append(role)
+    if {role.id for role in new_roles} == current_ids:
+        return
+    await member.edit(roles=new_roles, reason=entry["reason"])
+
+async def process_role_outbox(bot) -> int:
+    """
+    Один проход воркера: берёт до ROLE_OUTBOX_BATCH наступивших записей,
+    применяет их по одному edit на участника и возвращает число обработанных записей.
+    """
+    rows = await get_due_role_changes(ROLE_OUTBOX_BATCH)
+    if not rows:
+        return 0
+
+    done = []
+    retry = {}  # задержка -> ids
+    by_guild = {}
+    for (guild_id, user_id), entry in _merge_changes(rows).items():
+        by_guild.setdefault(guild_id, {})[user_id] = entry
+
+    for guild_id, entries in by_guild.items():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            # Бота нет на сервере: ролей не выдать
+            done.extend(i for entry in entries.values() for i in entry["ids"])
+            continue
+        members = await resolve_members(guild, entries)
+        for user_id, entry in entries.items():
+            member = members.get(user_id)
+            if member is None:
+                done.extend(entry["ids"])
+                continue
+            try:
+                await _apply_member(guild, member, entry)
+                done.extend(entry["ids"])
+            except (disnake.Forbidden, disnake.NotFound) as e:
+                logger.error(f"role_outbox: guild={guild_id} user={user_id}: {e}, изменения отброшены")
+                done.extend(entry["ids"])
+            except Exception as e:
+                attempts = entry["attempts"] + 1
+                if attempts >= ROLE_OUTBOX_MAX_ATTEMPTS:
+                    logger.error(f"role_outbox: guild={guild_id} user={user_id}: {e}, попытки исчерпаны")
+                    done.extend(entry["ids"])
+                    continue
+                delay = min(ROLE_OUTBOX_MAX_BACKOFF, ROLE_OUTBOX_BACKOFF * 2 ** entry["attempts"])
+                logger.warning(f"role_outbox: guild={guild_id} user={user_id}: {e}, повтор через {delay} с")
+                retry.setdefault(delay, []).extend(entry["ids"])
+
+    await complete_role_changes(done)
+    for delay, ids in retry.items():
+        await retry_role_changes(ids, delay)
+    return len(rows)
+
+async def _role_outbox_worker(bot):
+    await bot.wait_until_ready()
+    while True:
+        try:
+            processed = await process_role_outbox(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка воркера очереди ролей: {e}")
+            processed = 0
+        # Полная пачка — сразу следующий проход, иначе ждём сигнала или опроса
+        if processed < ROLE_OUTBOX_BATCH:
+            await wait_role_outbox(ROLE_OUTBOX_POLL)
+
+def start_role_outbox(bot):
+    """
+    Запускает фоновый воркер очереди ролей (один раз).
+    """
+    global _role_outbox_task
+    if _role_outbox_task is None or _role_outbox_task.done():
+        _role_outbox_task = asyncio.create_task(_role_outbox_worker(bot))
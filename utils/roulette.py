@@ -0,0 +1,87 @@
+from types import MappingProxyType
+
+# ------------------------
+#  Правила рулетки (без Discord и БД)
+# ------------------------
+# Используются RouletteCog и симулятором utils.simulate.
+
+# Номер -> цвет
+SLOTS = {
+    '0': 'green', '1': 'red', '2': 'black', '3': 'red', '4': 'black', '5': 'red', '6': 'black',
+    '7': 'red', '8': 'black', '9': 'red', '10': 'black', '11': 'red', '12': 'black', '13': 'red',
+    '14': 'black', '15': 'red', '16': 'black', '17': 'red', '18': 'black', '19': 'red', '20': 'black',
+    '21': 'red', '22': 'black', '23': 'red', '24': 'black', '25': 'red', '26': 'black', '27': 'red',
+    '28': 'black', '29': 'red', '30': 'black', '31': 'red', '32': 'black', '33': 'red', '34': 'black',
+    '35': 'red', '36': 'black'
+}
+
+COLUMNS = {
+    "1st": {1, 4, 7, 10, 13, 16, 19, 22, 25, 28, 31, 34},
+    "2nd": {2, 5, 8, 11, 14, 17, 20, 23, 26, 29, 32, 35},
+    "3rd": {3, 6, 9, 12, 15, 18, 21, 24, 27, 30, 33, 36}
+}
+DOZENS = {"1-12": range(1, 13), "13-24": range(13, 25), "25-36": range(25, 37)}
+HALVES = {"1-18": range(1, 19), "19-36": range(19, 37)}
+
+# Тип места -> допустимые места (порядок важен для classify_space)
+VALID_SPACES = {
+    "number": set(SLOTS),
+    "dozen": set(DOZENS),
+    "column": set(COLUMNS),
+    "half": set(HALVES),
+    "parity": {"odd", "even"},
+    "color": {"red", "black"}
+}
+
+# Выплата (вместе со ставкой) в ставках
+MULTIPLIERS = {
+    "number": 36, "dozen": 3, "column": 3, "half": 2, "parity": 2, "color": 2
+}
+
+def _wins(space: str, space_type: str, result: str) -> bool:
+    """Правило выигрыша; используется только для построения таблиц ниже."""
+    if space_type == "number":
+        return space == result
+    if space_type == "color":
+        return SLOTS[result] == space
+    result_num = int(result)
+    if space_type == "dozen":
+        return result_num in DOZENS[space]
+    if space_type == "column":
+        return result_num in COLUMNS[space]
+    if space_type == "half":
+        return result_num in HALVES[space]
+    if space_type == "parity":
+        # 0 считается чётным
+        return (result_num % 2 == 1) == (space == "odd")
+    return False
+
+# ------------------------
+#  Предрасчитанные таблицы
+# ------------------------
+# Место -> тип места
+SPACE_TYPES = MappingProxyType({
+    space: space_type for space_type, spaces in VALID_SPACES.items() for space in spaces
+})
+
+# Номер (0..36) -> {выигравшее место: множитель}
+WINNING_SPACES = tuple(
+    MappingProxyType({
+        space: MULTIPLIERS[space_type]
+        for space, space_type in SPACE_TYPES.items()
+        if _wins(space, space_type, str(number))
+    })
+    for number in range(len(SLOTS))
+)
+
+def classify_space(space: str):
+    """Тип места ('number', 'dozen', ...) или None, если место неизвестно."""
+    return SPACE_TYPES.get(space)
+
+def is_winning(space: str, space_type: str, result: str) -> bool:
+    """Выиграла ли ставка на space при выпадении result."""
+    return space in WINNING_SPACES[int(result)]
+
+def payout(amount: int, space: str, space_type: str, result: str) -> int:
+    """Сумма к начислению (0 при проигрыше)."""
+    return amount * WINNING_SPACES[int(result)].get(space, 0)
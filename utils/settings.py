@@ -0,0 +1,359 @@
+import os
+import asyncio
+import logging
+import configparser
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+# ------------------------
+#  Настройка логирования
+# ------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ------------------------
+#  Файлы конфигурации
+# ------------------------
+CONFIG_FILE = "config.ini"
+GAMES_FILE = "games.ini"
+# Как часто (сек) проверять mtime файлов
+RELOAD_INTERVAL = 5
+
+for _file in (CONFIG_FILE, GAMES_FILE):
+    if not os.path.exists(_file):
+        logger.error(f"Config file {_file} not found.")
+        raise FileNotFoundError(f"Config file {_file} not found.")
+
+# ------------------------
+#  Снимки секций
+# ------------------------
+@dataclass(frozen=True)
+class IncomeSettings:
+    """[Work], [Crime], [Slut]."""
+    success_chance: float
+    min_reward: int
+    max_reward: int
+    min_fine_percent: float
+    max_fine_percent: float
+    cooldown: int
+
+@dataclass(frozen=True)
+class RobSettings:
+    """[Rob]."""
+    min_fine_percent: float
+    max_fine_percent: float
+    cooldown: int
+    immune_roles: frozenset
+
+@dataclass(frozen=True)
+class PaySettings:
+    """[Pay]."""
+    cooldown: int
+    banned_roles: frozenset
+    reduce_tax_roles: frozenset
+    min_amount: int
+    max_amount: int
+    tax_percentage: float
+    reduce_tax_percentage: float
+
+@dataclass(frozen=True)
+class CollectRole:
+    """Награда за одну роль из [Collect]."""
+    role_id: int
+    reward: int
+    cooldown: int
+    reward_type: str
+
+@dataclass(frozen=True)
+class CollectConfig:
+    """[Collect]."""
+    roles: tuple                       # CollectRole в порядке конфига
+    by_role: Mapping[int, CollectRole]  # role_id -> CollectRole
+    role_ids: frozenset
+
+    @classmethod
+    def from_items(cls, items):
+        roles = tuple(CollectRole(item['role_id'], item['reward'], item['cooldown'], item['reward_type']) for item in items)
+        return cls(
+            roles=roles,
+            by_role=MappingProxyType({role.role_id: role for role in roles}),
+            role_ids=frozenset(role.role_id for role in roles)
+        )
+
+    def eligible(self, member_role_ids) -> list:
+        """Роли из конфига, которые есть у участника (в порядке конфига)."""
+        owned = self.role_ids.intersection(member_role_ids)
+        return [role for role in self.roles if role.role_id in owned]
+
+@dataclass(frozen=True)
+class RouletteSettings:
+    """[Roulette] из games.ini."""
+    duration: int
+    min_bet: int
+
+@dataclass(frozen=True)
+class BlackjackSettings:
+    """[Blackjack] из games.ini."""
+    min_bet: int
+    decks: int
+
+@dataclass(frozen=True)
+class CockFightSettings:
+    """[CockFight] из games.ini."""
+    min_bet: int
+    min_chance: int
+    max_chance: int
+
+# ------------------------
+#  Разбор секций
+# ------------------------
+def _parse_list(value: str) -> list:
+    """'[1, 2, 3]' -> ['1', '2', '3']."""
+    return [item.strip() for item in value.strip().strip('[]').split(',') if item.strip()]
+
+def _parse_income(section) -> IncomeSettings:
+    min_fine = float(section.get("min_fine", 5))
+    max_fine = float(section.get("max_fine", 10))
+    if not (0 <= min_fine <= 100) or not (0 <= max_fine <= 100):
+        raise ValueError("min_fine and max_fine must be between 0 and 100")
+    return IncomeSettings(
+        success_chance=float(section.get("success_chance", 0.5)),
+        min_reward=int(section.get("min_reward", 100)),
+        max_reward=int(section.get("max_reward", 500)),
+        min_fine_percent=min_fine,
+        max_fine_percent=max_fine,
+        cooldown=int(section.get("cooldown", 3600))
+    )
+
+def _parse_rob(section) -> RobSettings:
+    min_fine = float(section.get("min_fine", 10))
+    max_fine = float(section.get("max_fine", 25))
+    cooldown = int(section.get("cooldown", 15))
+    immune_roles = frozenset(int(role_id) for role_id in _parse_list(section.get("immune_role", "[]")))
+    if not (0 <= min_fine <= 100) or not (0 <= max_fine <= 100):
+        raise ValueError("min_fine and max_fine must be between 0 and 100")
+    if min_fine > max_fine:
+        raise ValueError("min_fine cannot be greater than max_fine")
+    if cooldown < 0:
+        raise ValueError("cooldown cannot be negative")
+    return RobSettings(min_fine, max_fine, cooldown, immune_roles)
+
+def _parse_pay(section) -> PaySettings:
+    settings = PaySettings(
+        cooldown=int(section.get("cooldown", 3)),
+        banned_roles=frozenset(int(role_id) for role_id in _parse_list(section.get("banned_roles", "[]"))),
+        reduce_tax_roles=frozenset(int(role_id) for role_id in _parse_list(section.get("reduce_tax_roles", "[]"))),
+        min_amount=int(section.get("min_amount", 0)),
+        max_amount=int(section.get("max_amount", 1000)),
+        tax_percentage=float(section.get("tax_percentage", 10)),
+        reduce_tax_percentage=float(section.get("reduce_tax_percentage", 5))
+    )
+    if settings.min_amount < 0 or settings.max_amount < 0:
+        raise ValueError("min_amount and max_amount cannot be negative")
+    if settings.max_amount != 0 and settings.min_amount > settings.max_amount:
+        raise ValueError("min_amount cannot be greater than max_amount")
+    if not (0 <= settings.tax_percentage <= 100) or not (0 <= settings.reduce_tax_percentage <= 100):
+        raise ValueError("tax_percentage and reduce_tax_percentage must be between 0 and 100")
+    return settings
+
+def _parse_collect(section) -> CollectConfig:
+    role_ids = [int(role_id) for role_id in _parse_list(section['role_id'])]
+    role_rewards = [int(reward) for reward in _parse_list(section['role_reward'])]
+    reward_cooldowns = [int(cooldown) for cooldown in _parse_list(section['reward_cooldown'])]
+    reward_types = _parse_list(section['reward_type'])
+
+    if not (len(role_ids) == len(role_rewards) == len(reward_cooldowns) == len(reward_types)):
+        raise ValueError("Lists role_id, role_reward, reward_cooldown, and reward_type must have the same length.")
+    for t in reward_types:
+        if t not in ['cash', 'bank']:
+            raise ValueError(f"Invalid reward_type: '{t}'. Must be 'cash' or 'bank'.")
+
+    return CollectConfig.from_items(
+        {"role_id": role_id, "reward": reward, "cooldown": cooldown, "reward_type": reward_type}
+        for role_id, reward, cooldown, reward_type in zip(role_ids, role_rewards, reward_cooldowns, reward_types)
+    )
+
+def _parse_roulette(section) -> RouletteSettings:
+    settings = RouletteSettings(
+        duration=int(section.get("duration", 30)),
+        min_bet=int(section.get("min_bet", 100))
+    )
+    if settings.duration < 10 or settings.min_bet < 1:
+        raise ValueError("duration >= 10s, min_bet >= 1")
+    return settings
+
+def _parse_blackjack(section) -> BlackjackSettings:
+    settings = BlackjackSettings(
+        min_bet=int(section.get("min_bet", 10)),
+        decks=int(section.get("decks", 1))
+    )
+    if settings.min_bet < 1:
+        raise ValueError("min_bet должен быть >= 1")
+    if settings.decks < 1:
+        raise ValueError("decks должен быть >= 1")
+    return settings
+
+def _parse_cock_fight(section) -> CockFightSettings:
+    settings = CockFightSettings(
+        min_bet=int(section.get("min_bet", 10)),
+        min_chance=int(section.get("min_chance", 50)),
+        max_chance=int(section.get("max_chance", 90))
+    )
+    if settings.min_bet < 1:
+        raise ValueError("min_bet должен быть >= 1")
+    if not (0 <= settings.min_chance <= settings.max_chance <= 100):
+        raise ValueError("min_chance/max_chance должны быть в диапазоне 0–100 и min_chance ≤ max_chance")
+    return settings
+
+# секция -> (файл, функция разбора)
+SECTIONS = {
+    "Work": (CONFIG_FILE, _parse_income),
+    "Crime": (CONFIG_FILE, _parse_income),
+    "Slut": (CONFIG_FILE, _parse_income),
+    "Rob": (CONFIG_FILE, _parse_rob),
+    "Pay": (CONFIG_FILE, _parse_pay),
+    "Collect": (CONFIG_FILE, _parse_collect),
+    "Roulette": (GAMES_FILE, _parse_roulette),
+    "Blackjack": (GAMES_FILE, _parse_blackjack),
+    "CockFight": (GAMES_FILE, _parse_cock_fight),
+}
+
+# ------------------------
+#  Реестр
+# ------------------------
+@dataclass(frozen=True)
+class Settings:
+    """Снимок всех секций. Ошибочные секции хранят текст ошибки вместо значения."""
+    sections: Mapping[str, object]
+    errors: Mapping[str, str]
+    mtimes: Mapping[str, int]
+
+    def section(self, name: str):
+        if name in self.errors:
+            raise ValueError(self.errors[name])
+        return self.sections[name]
+
+_settings = None
+
+def _mtimes() -> dict:
+    return {path: os.stat(path).st_mtime_ns for path in (CONFIG_FILE, GAMES_FILE)}
+
+def _read(path: str) -> configparser.ConfigParser:
+    # Значения в ini содержат комментарии вида "10 # это %"
+    parser = configparser.ConfigParser(inline_comment_prefixes=("#", ";"))
+    parser.read(path, encoding='utf-8')
+    return parser
+
+def load_settings() -> Settings:
+    """
+    Читает оба файла и собирает новый снимок. Если секция не разбирается,
+    остаётся её предыдущее значение (если было), иначе запоминается ошибка.
+    """
+    global _settings
+    previous = _settings
+    mtimes = _mtimes()
+    parsers = {path: _read(path) for path in (CONFIG_FILE, GAMES_FILE)}
+    sections = {}
+    errors = {}
+    for name, (path, parse) in SECTIONS.items():
+        try:
+            sections[name] = parse(parsers[path][name])
+        except KeyError as e:
+            message = f"Invalid config section for {name}: {e}"
+        except Exception as e:
+            message = f"Error parsing config for {name}: {e}"
+        else:
+            continue
+        logger.error(message)
+        if previous is not None and name in previous.sections:
+            sections[name] = previous.sections[name]
+        else:
+            errors[name] = message
+    _settings = Settings(
+        sections=MappingProxyType(sections),
+        errors=MappingProxyType(errors),
+        mtimes=MappingProxyType(mtimes)
+    )
+    logger.info(f"Settings loaded: {len(sections)} sections, {len(errors)} errors")
+    return _settings
+
+def get_settings() -> Settings:
+    """Текущий снимок настроек (загружается при первом обращении)."""
+    if _settings is None:
+        return load_settings()
+    return _settings
+
+def reload_settings(force: bool = False) -> bool:
+    """
+    Перечитывает настройки, если изменился mtime одного из файлов (или force).
+    Возвращает True, если снимок обновлён.
+    """
+    if not force and _settings is not None:
+        try:
+            if _mtimes() == dict(_settings.mtimes):
+                return False
+        except OSError as e:
+            logger.error(f"Cannot stat config files: {e}")
+            return False
+    load_settings()
+    return True
+
+def save_collect(roles) -> None:
+    """
+    Записывает секцию [Collect] в CONFIG_FILE и сразу обновляет снимок.
+    roles — словари с ключами role_id, reward, cooldown, reward_type.
+    """
+    roles = list(roles)
+    # Без inline_comment_prefixes: комментарии в значениях других секций сохраняются
+    parser = configparser.ConfigParser()
+    parser.read(CONFIG_FILE, encoding='utf-8')
+    parser['Collect'] = {
+        'role_id': f"[{', '.join(str(item['role_id']) for item in roles)}]",
+        'role_reward': f"[{', '.join(str(item['reward']) for item in roles)}]",
+        'reward_cooldown': f"[{', '.join(str(item['cooldown']) for item in roles)}]",
+        'reward_type': f"[{', '.join(item['reward_type'] for item in roles)}]"
+    }
+    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+        parser.write(f)
+    reload_settings(force=True)
+
+async def _watch_settings():
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            reload_settings()
+        except Exception as e:
+            logger.error(f"Settings reload error: {e}")
+
+_watcher_task = None
+
+def start_settings_watcher():
+    """Запускает фоновую проверку файлов (повторный вызов ничего не делает)."""
+    global _watcher_task
+    if _watcher_task is None or _watcher_task.done():
+        _watcher_task = asyncio.get_running_loop().create_task(_watch_settings())
+
+# ------------------------
+#  Доступ к секциям
+# ------------------------
+def income(command_name: str) -> IncomeSettings:
+    return get_settings().section(command_name)
+
+def rob() -> RobSettings:
+    return get_settings().section("Rob")
+
+def pay() -> PaySettings:
+    return get_settings().section("Pay")
+
+def collect() -> CollectConfig:
+    return get_settings().section("Collect")
+
+def roulette() -> RouletteSettings:
+    return get_settings().section("Roulette")
+
+def blackjack() -> BlackjackSettings:
+    return get_settings().section("Blackjack")
+
+def cock_fight() -> CockFightSettings:
+    return get_settings().section("CockFight")
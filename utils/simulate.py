@@ -0,0 +1,270 @@
+"""
+Офлайн-симуляция блэкджека и рулетки: RTP, дисперсия и скорость движка
+для разных настроек games.ini. Discord и БД не нужны.
+
+Запуск из корня проекта:
+    python -m utils.simulate blackjack --rounds 2000000 --decks 1 6 --strategy basic dealer
+    python -m utils.simulate roulette --rounds 5000000 --spaces red even 17 1-12
+"""
+import os
+import math
+import time
+import random
+import argparse
+from collections import Counter
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.cards import DECK_SIZE, CARD_VALUES, WIN_PAYOUT, BLACKJACK_PAYOUT, score_hand, play_dealer
+from utils.roulette import SLOTS, WINNING_SPACES, classify_space
+
+# Раундов в одной задаче пула
+CHUNK_ROUNDS = 50_000
+# Сколько карт снимается с шу на раунд (остальное доснимается при нехватке)
+DRAW_CARDS = 32
+
+# ------------------------
+#  Результаты
+# ------------------------
+@dataclass
+class SimResult:
+    game: str
+    config: str
+    rounds: int = 0
+    wagered: int = 0
+    returned: int = 0
+    sum_net: float = 0.0  # сумма чистых результатов раундов в ставках
+    sum_sq: float = 0.0   # сумма их квадратов
+    seconds: float = 0.0
+
+    def add(self, rounds, wagered, returned, sum_net, sum_sq):
+        self.rounds += rounds
+        self.wagered += wagered
+        self.returned += returned
+        self.sum_net += sum_net
+        self.sum_sq += sum_sq
+
+    @property
+    def rtp(self) -> float:
+        return self.returned / self.wagered if self.wagered else 0.0
+
+    @property
+    def variance(self) -> float:
+        """Дисперсия чистого результата раунда (в ставках)."""
+        if not self.rounds:
+            return 0.0
+        mean = self.sum_net / self.rounds
+        return self.sum_sq / self.rounds - mean * mean
+
+    @property
+    def throughput(self) -> float:
+        return self.rounds / self.seconds if self.seconds else 0.0
+
+# ------------------------
+#  Блэкджек
+# ------------------------
+class _SampledShoe:
+    """
+    Верх свежеперемешанного шу. Бот начинает каждую игру с новой колоды,
+    а rng.sample даёт то же распределение первых карт, что и shuffle всего шу,
+    но без перемешивания сотен карт на раунд. Интерфейс как у utils.cards.Shoe.
+    """
+    __slots__ = ("_rng", "_cards", "_drawn", "_pos")
+
+    def __init__(self, rng: random.Random, cards: list):
+        self._rng = rng
+        self._cards = cards
+        self._drawn = rng.sample(cards, min(DRAW_CARDS, len(cards)))
+        self._pos = 0
+
+    def pop(self) -> int:
+        if self._pos == len(self._drawn):
+            rest = Counter(self._cards)
+            rest.subtract(self._drawn)
+            rest = list(rest.elements())
+            if not rest:
+                raise IndexError("pop from empty shoe")
+            self._rng.shuffle(rest)
+            self._drawn.extend(rest)
+        card = self._drawn[self._pos]
+        self._pos += 1
+        return card
+
+def _strategy_dealer(score: int, is_soft: bool, upcard: int, can_double: bool) -> str:
+    """Играет как дилер: добор до 17, без удвоений."""
+    return "hit" if score < 17 else "stand"
+
+def _strategy_basic(score: int, is_soft: bool, upcard: int, can_double: bool) -> str:
+    """Упрощённая базовая стратегия (без сплитов, которых нет в боте)."""
+    if is_soft:
+        if score >= 19:
+            return "stand"
+        if score == 18:
+            if can_double and 3 <= upcard <= 6:
+                return "double"
+            return "hit" if upcard >= 9 else "stand"
+        low = {13: 5, 14: 5, 15: 4, 16: 4, 17: 3}[score] if score >= 13 else 7
+        if can_double and low <= upcard <= 6:
+            return "double"
+        return "hit"
+    if score >= 17:
+        return "stand"
+    if 13 <= score <= 16:
+        return "stand" if upcard <= 6 else "hit"
+    if score == 12:
+        return "stand" if 4 <= upcard <= 6 else "hit"
+    if can_double and (score == 11 and upcard <= 10 or score == 10 and upcard <= 9 or score == 9 and 3 <= upcard <= 6):
+        return "double"
+    return "hit"
+
+STRATEGIES = {
+    "basic": _strategy_basic,
+    "dealer": _strategy_dealer,
+}
+
+def play_blackjack_round(shoe, bet: int, strategy) -> tuple:
+    """
+    Один раунд по правилам BlackjackCog. Возвращает (поставлено, выплачено).
+    """
+    player = [shoe.pop(), shoe.pop()]
+    dealer = [shoe.pop(), shoe.pop()]
+    player_score, is_soft = score_hand(player)
+    dealer_score = score_hand(dealer, True)[0]
+
+    # Моментальный блэкджек
+    if player_score == 21 or dealer_score == 21:
+        if dealer_score != 21:
+            return bet, int(bet * BLACKJACK_PAYOUT)
+        if player_score != 21:
+            return bet, 0
+        return bet, bet
+
+    # Открытая карта дилера — вторая (первая скрыта)
+    upcard = CARD_VALUES[dealer[1]]
+    if upcard == 1:
+        upcard = 11
+    wagered = bet
+    while True:
+        action = strategy(player_score, is_soft, upcard, len(player) == 2)
+        if action == "stand":
+            break
+        if action == "double":
+            wagered += bet
+        player.append(shoe.pop())
+        player_score, is_soft = score_hand(player)
+        if player_score > 21:
+            return wagered, 0
+        if action == "double":
+            break
+
+    dealer_score = play_dealer(dealer, shoe)
+    if dealer_score > 21 or player_score > dealer_score:
+        if len(player) == 2 and player_score == 21:
+            return wagered, int(wagered * BLACKJACK_PAYOUT)
+        return wagered, wagered * WIN_PAYOUT
+    if player_score == dealer_score:
+        return wagered, wagered
+    return wagered, 0
+
+def _blackjack_chunk(seed: int, rounds: int, decks: int, bet: int, strategy_name: str) -> tuple:
+    rng = random.Random(seed)
+    strategy = STRATEGIES[strategy_name]
+    cards = list(range(DECK_SIZE)) * decks
+    wagered = returned = 0
+    sum_net = sum_sq = 0.0
+    for _ in range(rounds):
+        w, r = play_blackjack_round(_SampledShoe(rng, cards), bet, strategy)
+        wagered += w
+        returned += r
+        net = (r - w) / bet
+        sum_net += net
+        sum_sq += net * net
+    return rounds, wagered, returned, sum_net, sum_sq
+
+# ------------------------
+#  Рулетка
+# ------------------------
+RESULTS = range(len(SLOTS))
+
+def _roulette_chunk(seed: int, rounds: int, space: str, bet: int) -> tuple:
+    rng = random.Random(seed)
+    # Выплата для каждого из 37 исходов берётся из WINNING_SPACES, дальше — подсчёт исходов
+    payouts = [bet * WINNING_SPACES[number].get(space, 0) for number in RESULTS]
+    counts = Counter(rng.choices(RESULTS, k=rounds))
+    returned = sum(payouts[number] * count for number, count in counts.items())
+    sum_net = sum_sq = 0.0
+    for number, count in counts.items():
+        net = (payouts[number] - bet) / bet
+        sum_net += net * count
+        sum_sq += net * net * count
+    return rounds, bet * rounds, returned, sum_net, sum_sq
+
+# ------------------------
+#  Запуск
+# ------------------------
+def _chunks(rounds: int):
+    for start in range(0, rounds, CHUNK_ROUNDS):
+        yield min(CHUNK_ROUNDS, rounds - start)
+
+def run(pool, seeds: random.Random, result: SimResult, func, rounds: int, *args) -> SimResult:
+    """Раскладывает rounds по пулу пачками CHUNK_ROUNDS и собирает итог в result."""
+    started = time.perf_counter()
+    futures = [pool.submit(func, seeds.getrandbits(63), size, *args) for size in _chunks(rounds)]
+    for future in futures:
+        result.add(*future.result())
+    result.seconds = time.perf_counter() - started
+    return result
+
+def _print_report(results):
+    header = f"{'игра':<10} {'конфигурация':<28} {'раундов':>10} {'RTP':>8} {'преим.':>8} {'дисперсия':>10} {'ст.откл.':>9} {'раунд/с':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.game:<10} {r.config:<28} {r.rounds:>10} {r.rtp * 100:>7.3f}% {(1 - r.rtp) * 100:>7.3f}% "
+            f"{r.variance:>10.4f} {math.sqrt(max(r.variance, 0.0)):>9.4f} {r.throughput:>10.0f}"
+        )
+
+def main(argv=None):
+    # Значения по умолчанию — текущие настройки games.ini
+    from utils import settings
+    blackjack_defaults = settings.blackjack()
+    roulette_defaults = settings.roulette()
+
+    parser = argparse.ArgumentParser(prog="python -m utils.simulate", description="Симуляция RTP блэкджека и рулетки")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="раундов на конфигурацию")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов в пуле")
+    parser.add_argument("--seed", type=int, default=None, help="зерно для воспроизводимого прогона")
+    games = parser.add_subparsers(dest="game", required=True)
+
+    blackjack = games.add_parser("blackjack")
+    blackjack.add_argument("--decks", type=int, nargs="+", default=[blackjack_defaults.decks])
+    blackjack.add_argument("--bet", type=int, nargs="+", default=[blackjack_defaults.min_bet])
+    blackjack.add_argument("--strategy", nargs="+", choices=sorted(STRATEGIES), default=["basic"])
+
+    roulette = games.add_parser("roulette")
+    roulette.add_argument("--spaces", nargs="+", default=["red", "even", "1-12", "1st", "1-18", "17"])
+    roulette.add_argument("--bet", type=int, nargs="+", default=[roulette_defaults.min_bet])
+
+    args = parser.parse_args(argv)
+    seeds = random.Random(args.seed) if args.seed is not None else random.SystemRandom()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        if args.game == "blackjack":
+            for decks in args.decks:
+                for bet in args.bet:
+                    for strategy in args.strategy:
+                        config = f"decks={decks} bet={bet} {strategy}"
+                        results.append(run(pool, seeds, SimResult("blackjack", config), _blackjack_chunk, args.rounds, decks, bet, strategy))
+        else:
+            for space in args.spaces:
+                if classify_space(space) is None:
+                    parser.error(f"неизвестное место: {space}")
+                for bet in args.bet:
+                    config = f"{space} bet={bet}"
+                    results.append(run(pool, seeds, SimResult("roulette", config), _roulette_chunk, args.rounds, space, bet))
+    _print_report(results)
+    return results
+
+if __name__ == "__main__":
+    main()